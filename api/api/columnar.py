@@ -0,0 +1,291 @@
+import copy
+import math
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from api.models import RealignSegment, Segment, SubtitleConfig, TranscriptionData, TranscriptionResponse, Word
+
+# word timings are float32, missing ones are stored as nan
+MISSING = float("nan")
+# languages whose words are written without spaces between them
+LANGUAGES_WITHOUT_SPACES = ("ja", "zh")
+
+
+def _value(value: Optional[float]) -> float:
+    return MISSING if value is None else value
+
+
+def _optional(value: float, digits: int = 3) -> Optional[float]:
+    # float32 keeps times to the millisecond up to about two hours
+    return None if math.isnan(value) else round(value, digits)
+
+
+class ColumnarTranscription:
+    """
+    Transcription data held in columns instead of one object per word.
+
+    Segments are kept as start and end arrays, a list of texts and the index
+    of their first word in word_offsets. The text of all the words is packed
+    in a single string sliced by word_text_offsets, their start, end and
+    score in float32 arrays. Converted from and to TranscriptionData at the
+    api boundary only, word_segments is rebuilt from the segment words.
+    """
+
+    __slots__ = (
+        "language",
+        "segment_start",
+        "segment_end",
+        "segment_text",
+        "segment_has_words",
+        "word_offsets",
+        "word_text",
+        "word_text_offsets",
+        "word_start",
+        "word_end",
+        "word_score",
+    )
+
+    def __init__(self, language: Optional[str] = None):
+        self.language = language
+        self.segment_start = array("d")
+        self.segment_end = array("d")
+        self.segment_text = []
+        # segments without a words list, as opposed to an empty one
+        self.segment_has_words = array("b")
+        # words of segment i are word_offsets[i]:word_offsets[i + 1]
+        self.word_offsets = array("I", [0])
+        self.word_text = ""
+        self.word_text_offsets = array("I", [0])
+        self.word_start = array("f")
+        self.word_end = array("f")
+        self.word_score = array("f")
+
+    def __len__(self) -> int:
+        return len(self.segment_text)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.word_start)
+
+    @classmethod
+    def from_data(cls, data: Optional[TranscriptionData]) -> Optional["ColumnarTranscription"]:
+        if data is None:
+            return None
+        columns = cls(data.language)
+        texts = []
+        text_end = 0
+        for segment in data.segments:
+            columns.segment_start.append(segment.start)
+            columns.segment_end.append(segment.end)
+            columns.segment_text.append(segment.text)
+            columns.segment_has_words.append(segment.words is not None)
+            for word in segment.words or []:
+                texts.append(word.word)
+                text_end += len(word.word)
+                columns.word_text_offsets.append(text_end)
+                columns.word_start.append(_value(word.start))
+                columns.word_end.append(_value(word.end))
+                columns.word_score.append(_value(word.score))
+            columns.word_offsets.append(len(columns.word_start))
+        columns.word_text = "".join(texts)
+        return columns
+
+    def word(self, index: int) -> str:
+        return self.word_text[self.word_text_offsets[index]:self.word_text_offsets[index + 1]]
+
+    def segments(self) -> Iterator[Tuple[float, float, str]]:
+        """Start, end and text of each segment."""
+        return zip(self.segment_start, self.segment_end, self.segment_text)
+
+    def to_data(self) -> TranscriptionData:
+        segments = []
+        word_segments = []
+        for i, (start, end, text) in enumerate(self.segments()):
+            words = None
+            if self.segment_has_words[i]:
+                words = [
+                    Word(
+                        word=self.word(j),
+                        start=_optional(self.word_start[j]),
+                        end=_optional(self.word_end[j]),
+                        score=_optional(self.word_score[j]))
+                    for j in range(self.word_offsets[i], self.word_offsets[i + 1])
+                ]
+                word_segments += words
+            segments.append(Segment(start=start, end=end, text=text, words=words))
+        return TranscriptionData(segments=segments, word_segments=word_segments, language=self.language)
+
+    def stale_segments(self) -> List[int]:
+        """Segments whose text no longer matches their words, e.g. after an edit."""
+        stale = []
+        for i, text in enumerate(self.segment_text):
+            if not self.segment_has_words[i]:
+                continue
+            words = self.word_text[
+                self.word_text_offsets[self.word_offsets[i]]:self.word_text_offsets[self.word_offsets[i + 1]]]
+            # words are packed without separators
+            if words != "".join(text.split()):
+                stale.append(i)
+        return stale
+
+    def replace_words(self, words: Dict[int, List[Word]]) -> None:
+        """
+        Replaces the words of the segments in words, rebuilding the word
+        columns once. Their start and end move to their first and last word
+        timings, if any.
+        """
+        offsets = array("I", [0])
+        texts = []
+        text_offsets = array("I", [0])
+        starts, ends, scores = array("f"), array("f"), array("f")
+        for i in range(len(self)):
+            first, last = self.word_offsets[i], self.word_offsets[i + 1]
+            if i in words:
+                self.segment_has_words[i] = True
+                timed = [word for word in words[i] if word.start is not None and word.end is not None]
+                if timed:
+                    self.segment_start[i] = min(word.start for word in timed)
+                    self.segment_end[i] = max(word.end for word in timed)
+                for word in words[i]:
+                    texts.append(word.word)
+                    text_offsets.append(text_offsets[-1] + len(word.word))
+                    starts.append(_value(word.start))
+                    ends.append(_value(word.end))
+                    scores.append(_value(word.score))
+            else:
+                text_first, text_last = self.word_text_offsets[first], self.word_text_offsets[last]
+                texts.append(self.word_text[text_first:text_last])
+                shift = text_offsets[-1] - text_first
+                text_offsets.extend(offset + shift for offset in self.word_text_offsets[first + 1:last + 1])
+                starts += self.word_start[first:last]
+                ends += self.word_end[first:last]
+                scores += self.word_score[first:last]
+            offsets.append(len(starts))
+        self.word_offsets = offsets
+        self.word_text = "".join(texts)
+        self.word_text_offsets = text_offsets
+        self.word_start, self.word_end, self.word_score = starts, ends, scores
+
+    def _word_times(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Word start and end times with the missing ones filled: a word without
+        timings starts and ends where the previous one ends, or where its
+        segment starts.
+        """
+        start = np.frombuffer(self.word_start, dtype=np.float32).astype(np.float64)
+        end = np.frombuffer(self.word_end, dtype=np.float32).astype(np.float64)
+        counts = np.diff(np.frombuffer(self.word_offsets, dtype=np.uint32).astype(np.int64))
+        fallback = np.repeat(np.frombuffer(self.segment_start, dtype=np.float64), counts)
+        # forward fill of the ends, through the index of the last known one
+        known = np.where(np.isnan(end), 0, np.arange(len(end)))
+        np.maximum.accumulate(known, out=known)
+        previous_end = np.concatenate(([np.nan], end[known][:-1]))
+        start = np.where(np.isnan(start), previous_end, start)
+        start = np.where(np.isnan(start), fallback, start)
+        end = np.where(np.isnan(end), start, end)
+        return start, end
+
+    def resegment(
+            self,
+            max_duration: float,
+            max_chars: int,
+            max_lines: int = 1,
+            pause: float = None) -> "ColumnarTranscription":
+        """
+        Segments rebuilt from the word timings, words and their timings are
+        kept as they are. A segment ends before a pause of at least pause
+        seconds, before it would last longer than max_duration, or before it
+        would need more than max_lines lines of max_chars characters. Segment
+        texts are the words joined in lines. Segments without words are
+        dropped.
+        """
+        columns = ColumnarTranscription(self.language)
+        columns.word_text = self.word_text
+        columns.word_text_offsets = self.word_text_offsets[:]
+        columns.word_start = self.word_start[:]
+        columns.word_end = self.word_end[:]
+        columns.word_score = self.word_score[:]
+        n = self.word_count
+        if not n:
+            return columns
+
+        start, end = self._word_times()
+        # the segment end is searched on non decreasing word ends
+        search_end = np.maximum.accumulate(end)
+        separator = "" if self.language in LANGUAGES_WITHOUT_SPACES else " "
+        lengths = np.diff(np.frombuffer(self.word_text_offsets, dtype=np.uint32).astype(np.int64))
+        # characters up to word i, each word followed by a separator
+        chars = np.concatenate(([0], np.cumsum(lengths + len(separator))))
+        # segments always break at the words following a pause
+        breaks = np.empty(0, dtype=np.int64)
+        if pause is not None:
+            breaks = np.flatnonzero(start[1:] - end[:-1] >= pause) + 1
+        breaks = np.append(breaks, n)
+
+        bounds = [0]
+        lines = []
+        first = 0
+        while first < n:
+            last = int(breaks[np.searchsorted(breaks, first, side="right")])
+            last = min(last, max(int(np.searchsorted(search_end, start[first] + max_duration, side="right")), first + 1))
+            segment_lines = []
+            line_first = first
+            while line_first < last and len(segment_lines) < max(max_lines, 1):
+                # a word longer than a line gets a line of its own
+                line_last = int(np.searchsorted(chars, chars[line_first] + max_chars + len(separator), side="right")) - 1
+                line_last = min(max(line_last, line_first + 1), last)
+                segment_lines.append((line_first, line_last))
+                line_first = line_last
+            first = line_first
+            bounds.append(first)
+            lines.append(segment_lines)
+
+        for (segment_first, segment_last), segment_lines in zip(zip(bounds[:-1], bounds[1:]), lines):
+            columns.segment_start.append(round(float(start[segment_first]), 3))
+            columns.segment_end.append(round(float(search_end[segment_last - 1]), 3))
+            columns.segment_text.append("\n".join(
+                separator.join(self.word(i) for i in range(line_first, line_last))
+                for line_first, line_last in segment_lines))
+            columns.segment_has_words.append(True)
+        columns.word_offsets = array("I", bounds)
+        return columns
+
+    def copy(self) -> "ColumnarTranscription":
+        columns = ColumnarTranscription.__new__(ColumnarTranscription)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            # strings are immutable, the arrays and the text list are copied
+            if isinstance(value, (array, list)):
+                value = value[:]
+            setattr(columns, name, value)
+        return columns
+
+    def __deepcopy__(self, memo) -> "ColumnarTranscription":
+        return self.copy()
+
+
+@dataclass
+class TranscriptionRecord:
+    """A transcription as kept by the repository."""
+    id: str
+    data: Optional[ColumnarTranscription]
+    original_data: Optional[ColumnarTranscription]
+    job_id: Optional[str] = None
+    filename: Optional[str] = None
+    subtitle_config: Optional[SubtitleConfig] = None
+    realign_job_id: Optional[str] = None
+    # segments submitted to the realign job, until its result is applied
+    realign_segments: Optional[List[RealignSegment]] = None
+
+    def to_response(self) -> TranscriptionResponse:
+        return TranscriptionResponse(
+            id=self.id,
+            job_id=self.job_id,
+            filename=self.filename,
+            data=self.data.to_data() if self.data is not None else None,
+            original_data=self.original_data.to_data() if self.original_data is not None else None,
+            subtitle_config=copy.deepcopy(self.subtitle_config),
+            realign_job_id=self.realign_job_id)
@@ -1,6 +1,7 @@
 import os
 from api.repositories.file import InMemoryFileRepository, FileRepository, FileStore, AWSFileStore
 from api.repositories.transcription import InMemoryTranscriptionRepository, TranscriptionRepository
+from api.repositories.queue import JobQueue, create_job_queue
 from api.services.file import FileService
 from fastapi import Depends
 import redis
@@ -13,6 +14,12 @@ file_store = AWSFileStore()
 
 
 redis_client = redis.StrictRedis(host=os.getenv("REDIS_HOST", "0.0.0.0"), port=os.getenv("REDIS_PORT", 6379), decode_responses=True)
+job_queue = create_job_queue(
+    redis_client,
+    os.getenv("JOB_QUEUE_BACKEND", "list"),
+    cost_weight=float(os.getenv("JOB_COST_WEIGHT", "1")))
+# jobs processed at the same time by all the workers, used for job eta
+worker_slots = int(os.getenv("JOB_WORKER_SLOTS", "1"))
 
 def get_file_repository() -> FileRepository:
     return file_repository
@@ -30,13 +37,20 @@ transcription_repository = InMemoryTranscriptionRepository()
 def get_transcription_repository() -> TranscriptionRepository:
     return transcription_repository
 
-def get_transcription_service(
-        repo: TranscriptionRepository = Depends(get_transcription_repository)
-) -> TranscriptionService:
-    return TranscriptionService(os.getenv("OPENAI_API_TOKEN", ""), repo)
-
 def get_redis_client() -> redis.Redis:
     return redis_client
 
-def get_job_service(redis_client = Depends(get_redis_client)):
-    return JobService(redis_client)
\ No newline at end of file
+def get_job_queue() -> JobQueue:
+    return job_queue
+
+def get_job_service(
+        redis_client = Depends(get_redis_client),
+        job_queue: JobQueue = Depends(get_job_queue),
+        file_repository: FileRepository = Depends(get_file_repository)):
+    return JobService(redis_client, job_queue, file_repository, worker_slots)
+
+def get_transcription_service(
+        repo: TranscriptionRepository = Depends(get_transcription_repository),
+        job_service: JobService = Depends(get_job_service)
+) -> TranscriptionService:
+    return TranscriptionService(os.getenv("OPENAI_API_TOKEN", ""), repo, job_service)
\ No newline at end of file
@@ -6,13 +6,39 @@ from __future__ import annotations
 
 from datetime import datetime
 from enum import Enum
-from typing import List, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
 
+class Priority(str, Enum):
+    high = 'high'
+    normal = 'normal'
+    low = 'low'
+
 class JobInfo(BaseModel):
     config: Optional[JobConfig] = None
     filename: Optional[str] = Field(None, title='filename')
+    priority: Optional[Priority] = Field(Priority.normal, title='priority')
+    lyrics: Optional[str] = Field(
+        None, title='lyrics',
+        description="Text sung in the media, one line per subtitle. Aligned to the audio instead of transcribing it")
+    realign: Optional[RealignInfo] = Field(
+        None, title='realign', description="Segments of a transcription to align again instead of transcribing")
+
+class RealignSegment(BaseModel):
+    index: int = Field(..., title='index', description="Index of the segment in the transcription")
+    start: float = Field(..., title='start')
+    end: float = Field(..., title='end')
+    text: str = Field(..., title='text')
+
+class RealignInfo(BaseModel):
+    transcription_id: str = Field(..., title='transcription_id')
+    segments: List[RealignSegment] = Field(..., title='segments')
+
+class RealignRequest(BaseModel):
+    segments: Optional[List[int]] = Field(
+        None, title='segments',
+        description="Indexes of the segments to align again, by default the ones whose text no longer matches their words")
 
 class JobRequest(BaseModel):
     id: Optional[str] = Field(None, title='id')
@@ -23,12 +49,17 @@ class JobResponse(BaseModel):
     info: JobInfo = None
     status: Status = Field(..., title='status')
     data: Optional[TranscriptionData] = Field(None, title='id')
+    metadata: Optional[Dict[str, Any]] = Field(default_factory=dict, title='metadata')
+    progress: Optional[float] = Field(None, title='progress', description="Fraction of the media processed")
+    eta: Optional[float] = Field(None, title='eta', description="Estimated seconds until the job completes")
+    error: Optional[str] = Field(None, title='error', description="Reason of the failure of a failed job")
 
 class JobConfig(BaseModel):
     model_size: str = Field(..., title='model_size')
     subtitles_frequency: int = Field(..., title='subtitles_frequency')
     language: str = Field(..., title='language')
     speaker_detection: bool = Field(..., title='speaker_detection')
+    streaming: Optional[bool] = Field(False, title='streaming', description="Publish segments while the job is running")
 
 class Status(str, Enum):
     pending = 'pending'
@@ -96,6 +127,20 @@ class TranscriptionResponse(BaseModel):
     filename: str = Field(None, title='filename')
     original_data: TranscriptionData
     subtitle_config: Optional[SubtitleConfig] = None
+    realign_job_id: Optional[str] = Field(
+        None, title='realign_job_id', description="Job aligning edited segments again, until its result is applied")
+
+class RealignResult(BaseModel):
+    status: Status = Field(..., title='status', description="Final status of the realign job")
+    data: Optional[TranscriptionData] = Field(None, title='data', description="One segment per realigned segment")
+    error: Optional[str] = Field(None, title='error')
+
+class ResegmentRequest(BaseModel):
+    max_duration: float = Field(7.0, gt=0, title='max_duration', description="Longest segment, in seconds")
+    max_chars: int = Field(42, gt=0, title='max_chars', description="Characters per line")
+    max_lines: int = Field(2, gt=0, title='max_lines', description="Lines per segment")
+    pause: Optional[float] = Field(
+        0.8, ge=0, title='pause', description="Silence between words, in seconds, that always ends a segment")
 
 class SubtitleConfig(BaseModel):
     position: int = Field(50, description="Position of the subtitle in % for bottom to top.")
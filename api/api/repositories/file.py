@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from io import BytesIO
 import logging
 import os
@@ -23,6 +24,13 @@ class FileStoreException(Exception):
     pass
 
 
+@dataclass
+class StoredFileInfo:
+    size: int
+    # changes whenever the content of the file changes
+    etag: str
+
+
 class FileRepository(BaseRepository[File]):
     pass
 
@@ -64,7 +72,16 @@ class FileStore(ABC):
     @abstractmethod
     def get_file(self, filename: str) -> IO[bytes]:
         pass
-    
+
+    @abstractmethod
+    def get_info(self, filename: str) -> StoredFileInfo:
+        pass
+
+    @abstractmethod
+    def get_range(self, filename: str, start: int, end: int) -> IO[bytes]:
+        """Bytes start to end of the file, both included."""
+        pass
+
 class AWSFileStore(FileStore):
     def __init__(
             self,
@@ -131,6 +148,16 @@ class AWSFileStore(FileStore):
         file_content = res['Body'].read()
         return BytesIO(file_content)
 
+    def get_info(self, filename: str) -> StoredFileInfo:
+        res = self._run_s3('head_object', Bucket=self.bucket_name, Key=f"{self.prefix}{filename}")
+        return StoredFileInfo(size=res['ContentLength'], etag=res['ETag'].strip('"'))
+
+    def get_range(self, filename: str, start: int, end: int) -> IO[bytes]:
+        res = self._run_s3(
+            'get_object', Bucket=self.bucket_name, Key=f"{self.prefix}{filename}", Range=f"bytes={start}-{end}")
+        # streamed from s3 as it is read
+        return res['Body']
+
 class LocalFileStore(FileStore):
     def __init__(self, file_root_dir: Path = "/tmp/mais/file"):
         self.file_root_dir = file_root_dir
@@ -181,4 +208,13 @@ class LocalFileStore(FileStore):
         return f'/videos/{Path(filename).stem}/{filename}'
     
     def get_file(self, filename: str) -> IO[bytes]:
-        return open(self._get_file_path(Path(filename)), 'rb')
\ No newline at end of file
+        return open(self._get_file_path(Path(filename)), 'rb')
+
+    def get_info(self, filename: str) -> StoredFileInfo:
+        st = os.stat(self._get_file_path(Path(filename)))
+        return StoredFileInfo(size=st.st_size, etag=f'{st.st_mtime_ns:x}-{st.st_size:x}')
+
+    def get_range(self, filename: str, start: int, end: int) -> IO[bytes]:
+        with open(self._get_file_path(Path(filename)), 'rb') as f:
+            f.seek(start)
+            return BytesIO(f.read(end - start + 1))
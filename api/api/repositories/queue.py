@@ -0,0 +1,156 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+from redis import Redis
+from redis.exceptions import ResponseError
+
+
+class JobQueueException(Exception):
+    pass
+
+
+class JobQueue(ABC):
+    @abstractmethod
+    def push(self, job_id: str, cost: float = 0.0, priority: str = "normal") -> None:
+        """
+        Queues a job. cost is the estimated processing time in seconds, only
+        backends that order jobs use it and the priority class.
+        """
+        pass
+
+    @abstractmethod
+    def pending(self) -> List[str]:
+        pass
+
+    def ahead(self, job_id: str) -> List[str]:
+        """Jobs that will be delivered before job_id, empty if it is not queued."""
+        pending = self.pending()
+        return pending[:pending.index(job_id)] if job_id in pending else []
+
+    @abstractmethod
+    def stats(self) -> dict:
+        pass
+
+
+class ListJobQueue(JobQueue):
+    """
+    Plain redis list, jobs are popped by workers and lost if a worker crashes
+    while processing them.
+    """
+
+    def __init__(self, redis_client: Redis, name: str = "subtitle"):
+        self.r = redis_client
+        self.name = name
+
+    def push(self, job_id: str, cost: float = 0.0, priority: str = "normal") -> None:
+        self.r.rpush(self.name, job_id)
+
+    def pending(self) -> List[str]:
+        return list(self.r.lrange(self.name, 0, -1))
+
+    def stats(self) -> dict:
+        return {"backend": "list", "length": self.r.llen(self.name)}
+
+
+class StreamJobQueue(JobQueue):
+    """
+    Redis stream read by workers through a consumer group. Entries stay in the
+    group pending list until the worker acknowledges them, entries of dead
+    workers are claimed by the others.
+    """
+
+    def __init__(self, redis_client: Redis, name: str = "subtitle:stream", group: str = "workers"):
+        self.r = redis_client
+        self.name = name
+        self.group = group
+        self._group_ready = False
+
+    def _ensure_group(self) -> None:
+        # the group is created from id 0 so that jobs added before the first
+        # worker started are delivered too
+        if self._group_ready:
+            return
+        try:
+            self.r.xgroup_create(self.name, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise JobQueueException(f"failed to create consumer group {self.group}: {e}")
+        self._group_ready = True
+
+    def push(self, job_id: str, cost: float = 0.0, priority: str = "normal") -> None:
+        self._ensure_group()
+        self.r.xadd(self.name, {"job_id": job_id})
+
+    def pending(self) -> List[str]:
+        # acknowledged entries are deleted, whatever is left is either waiting
+        # or being processed
+        return [fields["job_id"] for _, fields in self.r.xrange(self.name)]
+
+    def stats(self) -> dict:
+        self._ensure_group()
+        group = next((g for g in self.r.xinfo_groups(self.name) if g["name"] == self.group), {})
+        consumers = self.r.xinfo_consumers(self.name, self.group)
+        return {
+            "backend": "stream",
+            "length": self.r.xlen(self.name),
+            "lag": group.get("lag"),
+            "pending": group.get("pending"),
+            "consumers": [
+                {
+                    "name": c["name"],
+                    "pending": c["pending"],
+                    "idle": c["idle"],
+                }
+                for c in consumers
+            ],
+        }
+
+
+class PriorityJobQueue(JobQueue):
+    """
+    Sorted set popped lowest score first. A job is scored by its enqueue time
+    plus its estimated cost times cost_weight plus the offset of its priority
+    class, so short jobs overtake long ones queued shortly before them. The
+    score of a queued job never changes while later jobs get later scores, so
+    long jobs age their way to the front instead of starving. Each push also
+    adds a token to the ready list, on which idle workers block.
+    """
+
+    # seconds added to the score of each priority class
+    PRIORITY_OFFSETS: Dict[str, float] = {"high": -3600.0, "normal": 0.0, "low": 3600.0}
+
+    def __init__(self, redis_client: Redis, name: str = "subtitle:priority", cost_weight: float = 1.0):
+        self.r = redis_client
+        self.name = name
+        self.ready = f'{name}:ready'
+        self.cost_weight = cost_weight
+
+    def push(self, job_id: str, cost: float = 0.0, priority: str = "normal") -> None:
+        score = time.time() + cost * self.cost_weight + self.PRIORITY_OFFSETS.get(priority, 0.0)
+        pipe = self.r.pipeline()
+        pipe.zadd(self.name, {job_id: score})
+        pipe.rpush(self.ready, 1)
+        pipe.execute()
+
+    def pending(self) -> List[str]:
+        return list(self.r.zrange(self.name, 0, -1))
+
+    def ahead(self, job_id: str) -> List[str]:
+        rank = self.r.zrank(self.name, job_id)
+        if not rank:
+            return []
+        return list(self.r.zrange(self.name, 0, rank - 1))
+
+    def stats(self) -> dict:
+        return {"backend": "priority", "length": self.r.zcard(self.name)}
+
+
+def create_job_queue(redis_client: Redis, backend: str = "list", cost_weight: float = 1.0) -> JobQueue:
+    if backend == "list":
+        return ListJobQueue(redis_client)
+    if backend == "stream":
+        return StreamJobQueue(redis_client)
+    if backend == "priority":
+        return PriorityJobQueue(redis_client, cost_weight=cost_weight)
+    raise JobQueueException(f"unsupported job queue backend: {backend}")
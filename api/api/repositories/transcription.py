@@ -1,5 +1,5 @@
 from api.repositories.base import BaseRepository, NotFoundException
-from api.models import TranscriptionResponse as Transcription
+from api.columnar import TranscriptionRecord as Transcription
 from typing import Dict, List
 
 class TranscriptionNotFoundException(NotFoundException):
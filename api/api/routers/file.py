@@ -1,8 +1,9 @@
-from fastapi import APIRouter, File, Path, Query, UploadFile, Depends
+from fastapi import APIRouter, File, Header, HTTPException, Path, Query, UploadFile, Depends
 from typing import List, Optional
 from api.models import FileResponse
 from api.dependencies import get_file_service
-from fastapi.responses import StreamingResponse
+from api.services.file import InvalidRangeException
+from fastapi.responses import Response, StreamingResponse
 
 file_router = APIRouter()
 
@@ -20,9 +21,36 @@ def delete_files(filename: Optional[str] = Query(None, description="Filename to
         return service.delete(filename)
     return service.delete_all()
 
+@file_router.head("/file/{id}")
+def get_file_info_by_id(id: str = Path(..., description="File ID"), service=Depends(get_file_service)):
+    info = service.get_info(id)
+    return Response(headers={
+            "Content-Length": str(info.size),
+            "Accept-Ranges": "bytes",
+            "ETag": f'"{info.etag}"',
+        })
+
 @file_router.get("/file/{id}", response_model=FileResponse)
-def get_file_by_id(id: str = Path(..., description="File ID"), service=Depends(get_file_service)):
+def get_file_by_id(
+        id: str = Path(..., description="File ID"),
+        range: Optional[str] = Header(None, description="Single byte range, e.g. bytes=0-1023"),
+        service=Depends(get_file_service)):
+    info = service.get_info(id)
+    headers = {
+        "Content-Disposition": f"attachment; filename={id}",
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{info.etag}"',
+    }
+    if range:
+        try:
+            start, end = service.parse_range(range, info.size)
+        except InvalidRangeException as e:
+            raise HTTPException(status_code=416, detail=e.message, headers={"Content-Range": f"bytes */{info.size}"})
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            service.get_range(id, start, end), status_code=206, media_type="application/octet-stream", headers=headers)
+
+    headers["Content-Length"] = str(info.size)
     file_obj = service.get_file(id)
-    return StreamingResponse(file_obj, media_type="application/octet-stream", headers={
-            "Content-Disposition": f"attachment; filename={id}"
-        })
+    return StreamingResponse(file_obj, media_type="application/octet-stream", headers=headers)
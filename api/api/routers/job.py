@@ -13,6 +13,13 @@ def get_jobs(service=Depends(get_job_service)):
 def create_job(job_request: JobRequest, service=Depends(get_job_service)):
     return service.run(job_request)
 
+@job_router.get("/job/queue")
+def get_job_queue_stats(service=Depends(get_job_service)):
+    """
+    Returns queue length and, for the stream backend, per-consumer lag.
+    """
+    return service.queue_stats()
+
 @job_router.get("/job/{id}", response_model=JobResponse)
 def get_job_by_id(id: str = Path(..., description="Job ID"), service=Depends(get_job_service)):
     return service.get(id)
\ No newline at end of file
@@ -1,10 +1,10 @@
-import copy
-from typing import List
+from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Path, Query
 from fastapi.responses import StreamingResponse
 from api.dependencies import get_file_service, get_transcription_service
-from api.models import TranscriptionRequest, TranscriptionResponse
+from api.models import JobResponse, RealignRequest, RealignResult, ResegmentRequest, TranscriptionRequest, TranscriptionResponse
 from api.services.file import RemotionFileRender
+from api.services.transcription import TranscriptionRealignException, TranscriptionResegmentException
 
 transcription_router = APIRouter()
 
@@ -36,9 +36,7 @@ def transcription_id_clear(
     """
     Restores initial transcription.
     """
-    current_transcription = service.get(id)
-    current_transcription.data = copy.deepcopy(current_transcription.original_data)
-    service.edit(id, copy.deepcopy(current_transcription))
+    service.clear(id)
 
 
 @transcription_router.post("/transcription/{id}/fit")
@@ -63,6 +61,49 @@ def transcription_id_fix(
     service.fix(id)
 
 
+@transcription_router.post("/transcription/{id}/resegment", response_model=TranscriptionResponse)
+def transcription_id_resegment(
+    resegment_request: Optional[ResegmentRequest] = None,
+    id: str = Path(..., description="Transcription ID"),
+    service=Depends(get_transcription_service)
+):
+    """
+    Rebuilds subtitle segments from the word timings.
+    """
+    try:
+        return service.resegment(id, resegment_request or ResegmentRequest())
+    except TranscriptionResegmentException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+
+
+@transcription_router.post("/transcription/{id}/realign", response_model=JobResponse)
+def transcription_id_realign(
+    realign_request: Optional[RealignRequest] = None,
+    id: str = Path(..., description="Transcription ID"),
+    service=Depends(get_transcription_service)
+):
+    """
+    Aligns edited segments again to update their word timings.
+    """
+    try:
+        return service.realign(id, realign_request.segments if realign_request else None)
+    except TranscriptionRealignException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+
+
+@transcription_router.post("/transcription/{id}/realign/{job_id}")
+def transcription_id_realign_result(
+    result: RealignResult,
+    id: str = Path(..., description="Transcription ID"),
+    job_id: str = Path(..., description="Realign job ID"),
+    service=Depends(get_transcription_service)
+):
+    """
+    Applies the result of a realign job, posted by the worker when the job is over.
+    """
+    service.complete_realign(id, job_id, result)
+
+
 @transcription_router.get("/transcription/{id}/export")
 def transcription_id_export(
     id: str = Path(..., description="Transcription ID"),
@@ -3,9 +3,9 @@ import logging
 import os
 from moviepy import VideoFileClip
 from PIL import Image
-from api.repositories.file import FileRepository, FileStore, InMemoryFileRepository, LocalFileStore
+from api.repositories.file import FileRepository, FileStore, InMemoryFileRepository, LocalFileStore, StoredFileInfo
 from pathlib import Path
-from typing import IO, Optional
+from typing import IO, Optional, Tuple
 from typing import List
 from api.models import FileResponse
 from api.models import Segment
@@ -25,6 +25,11 @@ class InvalidFileException(FileServiceException):
         self.message = f"File {filename} extension not supported"
         super().__init__(self.message)
 
+class InvalidRangeException(FileServiceException):
+    def __init__(self, header: str, size: int):
+        self.message = f"Range {header} not satisfiable for a file of {size} bytes"
+        super().__init__(self.message)
+
 class FileService:
     video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv']
     audio_extensions = ['.mp3', '.wav', '.aac', '.flac', '.ogg', '.wma']
@@ -176,6 +181,35 @@ class FileService:
     def get_file(self, filename: str) -> IO[bytes]:
         return self.file_store.get_file(filename)
 
+    def get_info(self, filename: str) -> StoredFileInfo:
+        return self.file_store.get_info(filename)
+
+    def get_range(self, filename: str, start: int, end: int) -> IO[bytes]:
+        return self.file_store.get_range(filename, start, end)
+
+    @staticmethod
+    def parse_range(header: str, size: int) -> Tuple[int, int]:
+        """
+        Parses a single range http Range header, e.g. bytes=0-1023, bytes=1024-
+        or bytes=-512, into the first and last byte positions.
+        """
+        unit, _, spec = header.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            raise InvalidRangeException(header, size)
+        first, _, last = spec.strip().partition("-")
+        try:
+            if not first:
+                # suffix range, the last bytes of the file
+                start, end = max(size - int(last), 0), size - 1
+            else:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            raise InvalidRangeException(header, size)
+        if start > end or start >= size:
+            raise InvalidRangeException(header, size)
+        return start, end
+
     def get_all(self) -> List[FileResponse]:
         return self.repository.get_all()
 
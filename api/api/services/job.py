@@ -1,22 +1,98 @@
-from api.models import JobRequest, JobResponse
-from typing import List
+from api.models import JobInfo, JobRequest, JobResponse
+from typing import List, Optional
 from redis import Redis
+import hashlib
+import json
 import uuid
 
 from api.repositories.base import NotFoundException
+from api.repositories.file import FileRepository
+from api.repositories.queue import JobQueue, ListJobQueue
+
+# processing seconds per second of media for each model size, including vocals
+# separation and alignment, used to order and estimate jobs
+MODEL_COST_FACTORS = {
+    "tiny": 0.15,
+    "base": 0.2,
+    "small": 0.35,
+    "medium": 0.7,
+    "large": 1.2,
+    "large-v2": 1.2,
+    "large-v3": 1.2,
+}
+SPEAKER_DETECTION_COST_FACTOR = 1.3
+# jobs with lyrics skip the transcription, only separation and alignment run
+LYRICS_COST_FACTOR = 0.1
+# realign jobs only align the edited segments, per second of segment
+REALIGN_COST_FACTOR = 0.05
+# assumed duration of media whose duration is unknown
+DEFAULT_DURATION = 180.0
+# lifetime of the in-flight marker of a job, in case its worker never clears it
+INFLIGHT_TTL = 24 * 3600
+# times a submitter retries to attach to or take over the in-flight marker
+INFLIGHT_ATTEMPTS = 3
+
+# results published by the workers keep each word once, inside its segment,
+# as a row of WORD_FIELDS
+COMPACT_RESULT_ENCODING = "compact-v1"
+WORD_FIELDS = ("word", "start", "end", "score", "speaker")
 
 class JobNotFoundException(NotFoundException):
     pass
 
+def decode_result(data: Optional[dict]) -> Optional[dict]:
+    """Expands a compact job result to the transcription data schema."""
+    if not data or data.get('encoding') != COMPACT_RESULT_ENCODING:
+        return data
+    segments = []
+    for segment in data.get('segments', []):
+        segment = dict(segment)
+        if segment.get('words') is not None:
+            segment['words'] = [dict(zip(WORD_FIELDS, row)) for row in segment['words']]
+        segments.append(segment)
+    return {
+        'segments': segments,
+        'word_segments': [word for segment in segments for word in segment.get('words') or []],
+        'language': data.get('language'),
+    }
+
+def decode_job(job: Optional[dict]) -> Optional[dict]:
+    if job and job.get('data'):
+        job['data'] = decode_result(job['data'])
+    return job
+
 class JobService:
-    def __init__(self, redis_client: Redis):
+    # replaces the in-flight marker of a finished job, unless another
+    # submitter replaced it first
+    _TAKEOVER_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(
+            self,
+            redis_client: Redis,
+            job_queue: JobQueue = None,
+            file_repository: FileRepository = None,
+            worker_slots: int = 1):
         self.r = redis_client
+        if not job_queue:
+            job_queue = ListJobQueue(redis_client)
+        self.job_queue = job_queue
+        self.file_repository = file_repository
+        # jobs processed at the same time across all workers
+        self.worker_slots = max(worker_slots, 1)
+        self._takeover = self.r.register_script(self._TAKEOVER_SCRIPT)
 
     def get_all(self) -> List[JobResponse]:
         all_jobs = []
-        for job_id in self.r.lrange('subtitle', 0, -1):
-            job_info = self.r.json().get(f'job:{job_id.decode()}')
-            all_jobs.append(job_info)
+        for job_id in self.job_queue.pending():
+            job_info = self.r.json().get(f'job:{job_id}')
+            if job_info:
+                all_jobs.append(decode_job(job_info))
         return all_jobs
 
     def get(self, job_id) -> JobResponse:
@@ -25,13 +101,148 @@ class JobService:
         if job is None:
             raise JobNotFoundException
 
-        return JobResponse(**job)
+        job = JobResponse(**decode_job(job))
+        leader_id = (job.metadata or {}).get('leader')
+        if leader_id and job.status in ('pending', 'running'):
+            # followers show the progress of the job computing their result
+            leader = self.r.json().get(f'job:{leader_id}')
+            if leader:
+                leader = JobResponse(**decode_job(leader))
+                job.status = leader.status
+                job.progress = leader.progress
+                job.data = leader.data
+                job.error = leader.error
+                job.eta = self.eta(leader)
+                return job
+        job.eta = self.eta(job)
+        return job
+
+    def _duration(self, filename: Optional[str]) -> float:
+        if self.file_repository is None or not filename:
+            return DEFAULT_DURATION
+        try:
+            duration = self.file_repository.get_by_id(filename).duration
+        except NotFoundException:
+            return DEFAULT_DURATION
+        return duration or DEFAULT_DURATION
+
+    def estimate_cost(self, info: Optional[JobInfo]) -> float:
+        """Estimated processing seconds of a job, from media duration and model size."""
+        if info is None:
+            return DEFAULT_DURATION
+        if info.realign:
+            return round(sum(max(s.end - s.start, 0) for s in info.realign.segments) * REALIGN_COST_FACTOR, 3)
+        cost = self._duration(info.filename)
+        if info.lyrics:
+            cost *= LYRICS_COST_FACTOR
+        elif info.config:
+            cost *= MODEL_COST_FACTORS.get(info.config.model_size, MODEL_COST_FACTORS["large"])
+        if info.config and info.config.speaker_detection:
+            cost *= SPEAKER_DETECTION_COST_FACTOR
+        return round(cost, 3)
+
+    def eta(self, job: JobResponse) -> Optional[float]:
+        """
+        Estimated seconds until the job completes: the cost of the jobs queued
+        ahead of it spread over the worker slots, plus its own remaining cost.
+        """
+        cost = (job.metadata or {}).get('cost')
+        if cost is None:
+            return None
+        if job.status == 'running':
+            return round(cost * (1 - (job.progress or 0)), 1)
+        if job.status != 'pending':
+            return None
+        ahead = self.job_queue.ahead(job.id)
+        ahead_cost = 0.0
+        if ahead:
+            for costs in self.r.json().mget([f'job:{job_id}' for job_id in ahead], '$.metadata.cost'):
+                # missing jobs and jobs without cost come back empty
+                if costs:
+                    ahead_cost += costs[0] or 0.0
+        return round(ahead_cost / self.worker_slots + cost, 1)
+
+    def identity(self, info: Optional[JobInfo]) -> Optional[str]:
+        """
+        Hash of the media and of the normalized config of a job, identical jobs
+        produce the same result.
+        """
+        # realign jobs belong to a single transcription
+        if info is None or not info.filename or info.config is None or info.realign:
+            return None
+        # a file uploaded again under the same name gets a new id
+        media = info.filename
+        if self.file_repository is not None:
+            try:
+                media = self.file_repository.get_by_id(info.filename).id or media
+            except NotFoundException:
+                pass
+        config = info.config
+        payload = json.dumps([
+            media,
+            config.model_size.strip().lower(),
+            config.language.strip().lower() if config.language else None,
+            int(config.subtitles_frequency),
+            bool(config.speaker_detection),
+            bool(config.streaming),
+            hashlib.sha256(info.lyrics.encode()).hexdigest() if info.lyrics else None,
+        ])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _attach(self, job: JobResponse, identity: str) -> Optional[str]:
+        """
+        Registers job as the one computing identity, or attaches it as a
+        follower of an identical pending or running job. Returns the id of that
+        job, None if job must run itself.
+        """
+        inflight_key = f'job:inflight:{identity}'
+        for _ in range(INFLIGHT_ATTEMPTS):
+            if self.r.set(inflight_key, job.id, nx=True, ex=INFLIGHT_TTL):
+                return None
+            leader_id = self.r.get(inflight_key)
+            if not leader_id:
+                # cleared meanwhile
+                continue
+            # the document of a job is written before it may become a leader
+            leader = self.r.json().get(f'job:{leader_id}')
+            if leader and leader.get('status') in ('pending', 'running'):
+                return leader_id
+            # left over by a job that finished without clearing it
+            if self._takeover(keys=[inflight_key], args=[leader_id, job.id, INFLIGHT_TTL]):
+                return None
+        # the marker keeps changing hands, the job runs on its own
+        return None
 
     def run(self, job_request: JobRequest) -> JobResponse:
         id = job_request.id if job_request.id else str(uuid.uuid4())
-        job = JobResponse(id=id, info=job_request.info, status='pending')
+        cost = self.estimate_cost(job_request.info)
+        job = JobResponse(id=id, info=job_request.info, status='pending', metadata={'cost': cost})
 
+        identity = self.identity(job_request.info)
         self.r.json().set(f'job:{id}', '$', job.model_dump())
-        self.r.rpush('subtitle', id)
+        leader_id = self._attach(job, identity) if identity else None
+        if leader_id:
+            job.metadata['leader'] = leader_id
+            self.r.json().set(f'job:{id}', '$.metadata.leader', leader_id)
+            self.r.sadd(f'job:{leader_id}:followers', id)
+            # the leader may have completed before the follower was registered
+            leader = self.r.json().get(f'job:{leader_id}')
+            if leader and leader.get('status') in ('completed', 'failed'):
+                pipe = self.r.pipeline(transaction=True)
+                for field in ('status', 'data', 'error'):
+                    if field in leader:
+                        pipe.json().set(f'job:{id}', f'$.{field}', leader[field])
+                pipe.execute()
+            return self.get(id)
+
+        if identity:
+            job.metadata['identity'] = identity
+            self.r.json().set(f'job:{id}', '$.metadata.identity', identity)
+        priority = job_request.info.priority if job_request.info and job_request.info.priority else 'normal'
+        self.job_queue.push(id, cost=cost, priority=priority)
 
+        job.eta = self.eta(job)
         return job
+
+    def queue_stats(self) -> dict:
+        return self.job_queue.stats()
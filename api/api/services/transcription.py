@@ -4,53 +4,144 @@ import requests
 import json
 import copy
 from datetime import timedelta
+from api.columnar import ColumnarTranscription, TranscriptionRecord
 from api.repositories.transcription import InMemoryTranscriptionRepository, TranscriptionNotFoundException, TranscriptionRepository
-from api.models import TranscriptionRequest, TranscriptionResponse
-from typing import IO, List
+from api.models import (JobInfo, JobRequest, JobResponse, Priority, RealignInfo, RealignResult, RealignSegment,
+                        ResegmentRequest, TranscriptionRequest, TranscriptionResponse)
+from api.services.job import JobNotFoundException, JobService
+from typing import IO, List, Optional
 import logging
 
 
+class TranscriptionRealignException(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+class TranscriptionResegmentException(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
 class TranscriptionService:
     def __init__(
             self,
             openai_token,
-            repository: TranscriptionRepository = None):
+            repository: TranscriptionRepository = None,
+            job_service: JobService = None):
         self.openai_token = openai_token
         self.logger = logging.getLogger(__name__)
         if not repository:
             self.logger.debug("using default in memory transcription repository")
             repository = InMemoryTranscriptionRepository()
         self.repository = repository
+        # runs the realign jobs of edited segments
+        self.job_service = job_service
 
     def add(self, transcription_request: TranscriptionRequest) -> TranscriptionResponse:
-        transcription_response = TranscriptionResponse(
+        # transcriptions are stored in columns, converted from and to the json
+        # schema only here and in get
+        original_data = ColumnarTranscription.from_data(transcription_request.data)
+        transcription = TranscriptionRecord(
             id=transcription_request.id if transcription_request.id else str(uuid.uuid4()),
             job_id=transcription_request.job_id,
             filename=transcription_request.filename,
-            original_data=copy.deepcopy(transcription_request.data),
-            data=transcription_request.data
+            original_data=original_data,
+            data=original_data.copy() if original_data is not None else None,
+            subtitle_config=copy.deepcopy(transcription_request.subtitle_config)
         )
-        self.repository.add(transcription_response)
+        self.repository.add(transcription)
 
-        return transcription_response
+        return transcription.to_response()
 
     def get_all(self) -> List[TranscriptionResponse]:
-        return self.repository.get_all()
+        return [transcription.to_response() for transcription in self.repository.get_all()]
 
-    def get(self, id: str) -> TranscriptionResponse:
+    def _get(self, id: str) -> TranscriptionRecord:
         try:
             transcription = self.repository.get_by_id(id)
-            return transcription
         except TranscriptionNotFoundException as e:
             self.logger.warning(e)
             raise
+        return transcription
+
+    def complete_realign(self, id: str, job_id: str, result: RealignResult) -> None:
+        """
+        Applies the result of a realign job of transcription id, posted by the
+        worker once the job is over: the words and bounds of the realigned
+        segments are replaced. Results of jobs superseded by a later realign
+        are ignored.
+        """
+        transcription = self._get(id)
+        if transcription.realign_job_id != job_id:
+            self.logger.info(f"ignoring realign job {job_id} of transcription {id}, superseded")
+            return
+        if result.status == 'completed' and result.data is not None and transcription.data is not None:
+            words = {}
+            for requested, segment in zip(transcription.realign_segments or [], result.data.segments):
+                # segments edited again since the job was submitted keep their words
+                if requested.index < len(transcription.data) and \
+                        transcription.data.segment_text[requested.index] == requested.text:
+                    words[requested.index] = segment.words or []
+            transcription.data.replace_words(words)
+        else:
+            self.logger.warning(f"realign job {job_id} of transcription {id} failed: {result.error}")
+        transcription.realign_job_id = None
+        transcription.realign_segments = None
+        self.repository.update(transcription)
+
+    def get(self, id: str) -> TranscriptionResponse:
+        return self._get(id).to_response()
 
     def edit(self, id: str, transcription_request: TranscriptionRequest):
-        transcription = self.get(id)
-        transcription.data = copy.deepcopy(transcription_request.data)
+        transcription = self._get(id)
+        transcription.data = ColumnarTranscription.from_data(transcription_request.data)
         transcription.subtitle_config = copy.deepcopy(transcription_request.subtitle_config)
         self.repository.update(transcription)
 
+    def clear(self, id: str) -> None:
+        """Restores the initial transcription."""
+        transcription = self._get(id)
+        transcription.data = transcription.original_data.copy()
+        self.repository.update(transcription)
+
+    def realign(self, id: str, segments: Optional[List[int]] = None) -> JobResponse:
+        """
+        Submits a job aligning the given segments again, by default the ones
+        whose text was edited. Their words are replaced when the job completes.
+        """
+        transcription = self._get(id)
+        data = transcription.data
+        if self.job_service is None or data is None or not transcription.job_id:
+            raise TranscriptionRealignException(f"Transcription {id} has no job to realign from")
+        try:
+            job = self.job_service.get(transcription.job_id)
+        except JobNotFoundException:
+            raise TranscriptionRealignException(f"Job {transcription.job_id} of transcription {id} not found")
+        if job.info is None or job.info.config is None:
+            raise TranscriptionRealignException(f"Job {transcription.job_id} of transcription {id} has no config")
+
+        if segments is None:
+            segments = data.stale_segments()
+        segments = sorted(set(i for i in segments if 0 <= i < len(data)))
+        if not segments:
+            raise TranscriptionRealignException(f"Transcription {id} has no segment to realign")
+
+        config = job.info.config.model_copy(
+            update={'language': data.language or job.info.config.language, 'streaming': False})
+        realign = RealignInfo(transcription_id=id, segments=[
+            RealignSegment(index=i, start=data.segment_start[i], end=data.segment_end[i], text=data.segment_text[i])
+            for i in segments
+        ])
+        realign_job = self.job_service.run(JobRequest(info=JobInfo(
+            config=config, filename=job.info.filename, priority=Priority.high, realign=realign)))
+        transcription.realign_job_id = realign_job.id
+        transcription.realign_segments = realign.segments
+        self.repository.update(transcription)
+        return realign_job
+
     def delete(self, id: str) -> None:
         try:
             self.repository.delete(id)
@@ -59,25 +150,34 @@ class TranscriptionService:
             raise
 
     def fit(self, id: str) -> None:
-        transcription = self.get(id)
-        segments = copy.deepcopy(transcription.data.segments)
-        for index, segment in enumerate(segments):
-            if index == 0:
-                segment_start = 0
-            else:
-                segment_start = segments[index - 1].end
-            segment_end = segment.end
-
-            segment.start = segment_start
-            segment.end = segment_end
-
-        transcription.data.segments = segments
+        transcription = self._get(id)
+        data = transcription.data
+        if len(data):
+            # each segment starts where the previous one ends
+            data.segment_start[1:] = data.segment_end[:-1]
+            data.segment_start[0] = 0
+        self.repository.update(transcription)
 
-        self.edit(id, transcription)
+    def resegment(self, id: str, resegment_request: ResegmentRequest) -> TranscriptionResponse:
+        """
+        Rebuilds the segments from the word timings, e.g. to change the caption
+        length without transcribing again. Segment texts are made of the words,
+        edited segments should be aligned again first.
+        """
+        transcription = self._get(id)
+        if transcription.data is None or not transcription.data.word_count:
+            raise TranscriptionResegmentException(f"Transcription {id} has no word timings")
+        transcription.data = transcription.data.resegment(
+            resegment_request.max_duration,
+            resegment_request.max_chars,
+            resegment_request.max_lines,
+            resegment_request.pause)
+        self.repository.update(transcription)
+        return transcription.to_response()
 
     def fix(self, id: str) -> None:
-        transcription = self.get(id)
-        transcription_data = transcription.data
+        transcription = self._get(id)
+        transcription_data = transcription.data.to_data()
         url = 'https://api.openai.com/v1/chat/completions'
         headers = {
             "Content-Type": "application/json",
@@ -111,30 +211,28 @@ class TranscriptionService:
             response_data["choices"][0]["message"]["content"])["segments"]
 
         for index, segment in enumerate(segments):
-            if index < len(transcription.data.segments):
-                transcription.data.segments[index].text = segment.get(
+            if index < len(transcription.data):
+                transcription.data.segment_text[index] = segment.get(
                     "text", "")
 
-        self.edit(id, transcription)
+        self.repository.update(transcription)
 
     def create_vtt(self, id: str) -> IO[bytes]:
-        transcription = self.get(id)
+        transcription = self._get(id)
         stt_content = ""
-        for index, segment in enumerate(transcription.data.segments):
-            start_time = self.format_time(segment.start)
-            end_time = self.format_time(segment.end)
-            text = segment.text
+        for index, (start, end, text) in enumerate(transcription.data.segments()):
+            start_time = self.format_time(start)
+            end_time = self.format_time(end)
             stt_content += f"{index}\n{start_time} --> {end_time}\n{text}\n\n"
 
         return io.BytesIO(stt_content.encode())
 
     def create_srt(self, id: str) -> IO[bytes]:
-        transcription = self.get(id)
+        transcription = self._get(id)
         srt_content = ""
-        for index, segment in enumerate(transcription.data.segments):
-            start_time = self.format_time(segment.start)
-            end_time = self.format_time(segment.end)
-            text = segment.text
+        for index, (start, end, text) in enumerate(transcription.data.segments()):
+            start_time = self.format_time(start)
+            end_time = self.format_time(end)
             srt_content += f"{index + 1}\n{start_time} --> {end_time}\n{text}\n\n"
 
         return io.BytesIO(srt_content.encode())
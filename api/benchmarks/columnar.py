@@ -0,0 +1,123 @@
+"""
+Measures the memory and copy cost of a transcription held as pydantic
+TranscriptionData (one Word object per word, repeated in word_segments)
+against the columnar representation the api keeps internally.
+
+A synthetic transcription of the given duration is built with the given
+number of words per second, grouped in segments. For each representation the
+memory retained after building it, the time of copy.deepcopy and the time of
+the conversions at the api boundary are reported, as well as the time taken to
+rebuild the segments from the word timings.
+
+usage: python benchmarks/columnar.py [--durations 600 3600] [--words-per-second 3]
+           [--words-per-segment 8] [--repeat 3] [--output columnar.json]
+"""
+import argparse
+import copy
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from api.columnar import ColumnarTranscription
+from api.models import Segment, TranscriptionData, Word
+
+
+def synthetic_data(duration: float, words_per_second: float, words_per_segment: int) -> TranscriptionData:
+    step = 1 / words_per_second
+    n_words = int(duration * words_per_second)
+    segments = []
+    word_segments = []
+    for first in range(0, n_words, words_per_segment):
+        words = [
+            Word(word=f"word{i % 997}", start=round(i * step, 3), end=round(i * step + step * 0.8, 3), score=0.5)
+            for i in range(first, min(first + words_per_segment, n_words))
+        ]
+        word_segments += words
+        segments.append(Segment(
+            start=words[0].start, end=words[-1].end, text=" ".join(w.word for w in words), words=words))
+    return TranscriptionData(segments=segments, word_segments=word_segments, language="en")
+
+
+def retained(build) -> tuple:
+    """The value built and the bytes it keeps allocated."""
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size
+
+
+def timed(fn, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 6)
+
+
+def measure(duration: float, args) -> dict:
+    data = synthetic_data(duration, args.words_per_second, args.words_per_segment)
+    # rebuilt from a serialized copy so that only the model itself is traced
+    payload = data.model_dump()
+    data, data_bytes = retained(lambda: TranscriptionData(**payload))
+    columns, columns_bytes = retained(lambda: ColumnarTranscription.from_data(data))
+
+    return {
+        "duration": duration,
+        "segments": len(data.segments),
+        "words": columns.word_count,
+        "pydantic": {
+            "bytes": data_bytes,
+            "deepcopy_seconds": timed(lambda: copy.deepcopy(data), args.repeat),
+        },
+        "columnar": {
+            "bytes": columns_bytes,
+            "deepcopy_seconds": timed(lambda: copy.deepcopy(columns), args.repeat),
+            "from_data_seconds": timed(lambda: ColumnarTranscription.from_data(data), args.repeat),
+            "to_data_seconds": timed(columns.to_data, args.repeat),
+            "resegment_seconds": timed(lambda: columns.resegment(7.0, 42, 2, 0.8), args.repeat),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=float, nargs="*", default=[600, 3600],
+                        help="durations in seconds of the synthetic transcriptions")
+    parser.add_argument("--words-per-second", type=float, default=3)
+    parser.add_argument("--words-per-segment", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3, help="timings are the best of this many runs")
+    parser.add_argument("--output", type=Path, help="write results as json to this file")
+    args = parser.parse_args()
+
+    results = []
+    for duration in args.durations:
+        result = measure(duration, args)
+        results.append(result)
+        pydantic, columnar = result["pydantic"], result["columnar"]
+        print(
+            f'{duration:.0f}s, {result["words"]} words: '
+            f'memory {pydantic["bytes"] / 2**20:.1f} MB -> {columnar["bytes"] / 2**20:.2f} MB, '
+            f'deepcopy {pydantic["deepcopy_seconds"] * 1000:.1f} ms -> {columnar["deepcopy_seconds"] * 1000:.3f} ms, '
+            f'conversion {columnar["from_data_seconds"] * 1000:.1f} ms in, '
+            f'{columnar["to_data_seconds"] * 1000:.1f} ms out, '
+            f'resegment {columnar["resegment_seconds"] * 1000:.1f} ms', file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Compares the per-stage cost of the mp3 based audio path used before with the
+single decode to float32 PCM shared by every stage.
+
+Previous path:
+  extract  video -> mp3 (moviepy)
+  separate mp3 -> 44.1 kHz stereo pcm (demucs input)
+  stems    vocals pcm -> mp3 (demucs --mp3 output)
+  whisper  mp3 -> 16 kHz mono pcm (whisperx.load_audio)
+
+Current path:
+  decode   video -> 44.1 kHz stereo float32 pcm
+  resample vocals -> 16 kHz mono float32, in memory
+
+Separation itself is the same in both paths and is not measured, the mixture
+stands in for the vocals stem.
+
+usage: python benchmarks/audio_path.py [--durations 60 600] [--input clip.mp4 ...] [--output results.json]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import julius
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "worker"))
+
+from audio_decoder import SAMPLE_RATE, decode_audio  # noqa: E402
+
+SEPARATION_SAMPLE_RATE = 44100
+SEPARATION_CHANNELS = 2
+
+
+def ffmpeg(*args):
+    subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-y", *args], check=True)
+
+
+def synthetic_clip(path: Path, duration: float) -> Path:
+    # a tone plus noise over a black video, encoded like a typical upload
+    ffmpeg(
+        "-f", "lavfi", "-i", f"sine=frequency=220:duration={duration}",
+        "-f", "lavfi", "-i", f"anoisesrc=amplitude=0.05:duration={duration}",
+        "-f", "lavfi", "-i", f"color=c=black:s=320x240:d={duration}",
+        "-filter_complex", "[0:a][1:a]amix=inputs=2[a]",
+        "-map", "2:v", "-map", "[a]",
+        "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest",
+        str(path))
+    return path
+
+
+def timed(stages: dict, name: str, fn, *args):
+    start = time.perf_counter()
+    res = fn(*args)
+    stages[name] = round(time.perf_counter() - start, 4)
+    return res
+
+
+def encode_mp3(pcm: np.ndarray, path: Path):
+    proc = subprocess.run(
+        ["ffmpeg", "-nostdin", "-v", "error", "-y",
+         "-f", "f32le", "-ar", str(SEPARATION_SAMPLE_RATE), "-ac", str(SEPARATION_CHANNELS), "-i", "-",
+         str(path)],
+        input=np.ascontiguousarray(pcm.T).tobytes(), check=True)
+    return proc
+
+
+def decode_s16(path: Path) -> np.ndarray:
+    # equivalent of whisperx.load_audio
+    out = subprocess.run(
+        ["ffmpeg", "-nostdin", "-threads", "0", "-i", str(path),
+         "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"],
+        capture_output=True, check=True).stdout
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def previous_path(clip: Path, workdir: Path) -> dict:
+    stages = {}
+    audio_mp3 = workdir / "audio.mp3"
+    vocals_mp3 = workdir / "vocals.mp3"
+    timed(stages, "extract", ffmpeg, "-i", str(clip), "-vn", str(audio_mp3))
+    wav = timed(stages, "separate_decode", decode_audio, audio_mp3, SEPARATION_SAMPLE_RATE, SEPARATION_CHANNELS)
+    timed(stages, "stems_encode", encode_mp3, wav, vocals_mp3)
+    timed(stages, "whisper_decode", decode_s16, vocals_mp3)
+    stages["total"] = round(sum(stages.values()), 4)
+    return stages
+
+
+def current_path(clip: Path) -> dict:
+    stages = {}
+    wav = timed(stages, "decode", decode_audio, clip, SEPARATION_SAMPLE_RATE, SEPARATION_CHANNELS)
+    timed(stages, "resample", lambda: julius.resample_frac(
+        torch.from_numpy(wav).mean(0), SEPARATION_SAMPLE_RATE, SAMPLE_RATE).numpy())
+    stages["total"] = round(sum(stages.values()), 4)
+    return stages
+
+
+def current_path_no_separation(clip: Path) -> dict:
+    stages = {}
+    timed(stages, "decode", decode_audio, clip, SAMPLE_RATE, 1)
+    stages["total"] = stages["decode"]
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=float, nargs="*", default=[60, 600],
+                        help="durations in seconds of the synthetic clips")
+    parser.add_argument("--input", type=Path, nargs="*", default=[], help="additional media files")
+    parser.add_argument("--output", type=Path, help="write results as json to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        clips = [synthetic_clip(workdir / f"synthetic-{int(d)}s.mp4", d) for d in args.durations] + args.input
+        for clip in clips:
+            previous = previous_path(clip, workdir)
+            current = current_path(clip)
+            result = {
+                "clip": clip.name,
+                "previous": previous,
+                "current": current,
+                "current_no_separation": current_path_no_separation(clip),
+                "speedup": round(previous["total"] / current["total"], 2) if current["total"] else None,
+            }
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
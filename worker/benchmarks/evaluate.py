@@ -0,0 +1,220 @@
+"""
+Evaluates the accuracy against the speed of each model size and compute type
+on music: transcripts produced by SubtitleService are scored against
+reference lyrics, and configurations are ranked in a Pareto table of word
+error rate against real-time factor.
+
+The corpus is a json manifest, paths are relative to it:
+
+  {"clips": [
+    {"media": "song.mp4", "lyrics": "song.txt", "language": "en"},
+    {"media": "other.mp3", "words": [{"word": "hello", "start": 1.2, "end": 1.5}, ...]}
+  ]}
+
+"lyrics" is a plain text file, "words" reference words with timings. The
+word-timing error is only computed for clips with reference timings.
+
+Metrics per configuration, over the whole corpus:
+  wer          word errors (substitutions, insertions, deletions) over reference words
+  timing_error mean absolute start time error in seconds of the correctly transcribed words
+  rtf          wall time over audio duration, end to end
+  asr_rtf      transcription and alignment time over audio duration
+  cpu_rtf      process cpu time over audio duration
+
+usage: python benchmarks/evaluate.py corpus.json [--model-sizes tiny small medium]
+           [--compute-types int8 float32] [--output evaluation.json] [--reuse-vocals]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "worker"))
+
+
+def normalize(text: str) -> list:
+    """Lower case words without punctuation."""
+    return re.findall(r"[\w']+", text.lower())
+
+
+def align_words(reference: list, hypothesis: list):
+    """
+    Levenshtein alignment of two word lists. Returns the number of errors and
+    the (reference index, hypothesis index) pairs of the matching words.
+    """
+    n, m = len(reference), len(hypothesis)
+    # cost[i][j]: edits between reference[:i] and hypothesis[:j]
+    cost = [[0] * (m + 1) for _ in range(n + 1)]
+    for i in range(n + 1):
+        cost[i][0] = i
+    for j in range(m + 1):
+        cost[0][j] = j
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            substitution = cost[i - 1][j - 1] + (reference[i - 1] != hypothesis[j - 1])
+            cost[i][j] = min(substitution, cost[i - 1][j] + 1, cost[i][j - 1] + 1)
+
+    matches = []
+    i, j = n, m
+    while i > 0 and j > 0:
+        if reference[i - 1] == hypothesis[j - 1] and cost[i][j] == cost[i - 1][j - 1]:
+            matches.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif cost[i][j] == cost[i - 1][j - 1] + 1:
+            i, j = i - 1, j - 1
+        elif cost[i][j] == cost[i - 1][j] + 1:
+            i -= 1
+        else:
+            j -= 1
+    return cost[n][m], matches[::-1]
+
+
+def hypothesis_words(result: dict) -> list:
+    # a word may normalize to several tokens, e.g. "don't-stop", or to none
+    words = []
+    for word in result.get("word_segments", []):
+        for token in normalize(word["word"]):
+            words.append({"word": token, "start": word.get("start"), "end": word.get("end")})
+    return words
+
+
+def reference_words(clip: dict, root: Path) -> list:
+    if "words" in clip:
+        return [{"word": token, "start": w.get("start"), "end": w.get("end")}
+                for w in clip["words"] for token in normalize(w["word"])]
+    return [{"word": token, "start": None, "end": None}
+            for token in normalize((root / clip["lyrics"]).read_text())]
+
+
+def score(reference: list, hypothesis: list) -> dict:
+    errors, matches = align_words([w["word"] for w in reference], [w["word"] for w in hypothesis])
+    timing = [abs(hypothesis[j]["start"] - reference[i]["start"])
+              for i, j in matches
+              if reference[i]["start"] is not None and hypothesis[j]["start"] is not None]
+    return {"errors": errors, "reference_words": len(reference), "timing": timing}
+
+
+def pareto(rows: list) -> None:
+    """Flags the rows not beaten on both wer and rtf by another row."""
+    for row in rows:
+        row["pareto"] = not any(
+            other["wer"] <= row["wer"] and other["rtf"] <= row["rtf"]
+            and (other["wer"] < row["wer"] or other["rtf"] < row["rtf"])
+            for other in rows)
+
+
+def table(rows: list) -> str:
+    lines = [
+        "| model_size | compute_type | wer | timing_error | rtf | asr_rtf | cpu_rtf | pareto |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for row in sorted(rows, key=lambda r: r["rtf"]):
+        timing_error = f'{row["timing_error"]:.3f}' if row["timing_error"] is not None else "-"
+        lines.append(
+            f'| {row["model_size"]} | {row["compute_type"]} | {row["wer"]:.3f} | {timing_error} | '
+            f'{row["rtf"]:.3f} | {row["asr_rtf"]:.3f} | {row["cpu_rtf"]:.3f} | {"*" if row["pareto"] else ""} |')
+    return "\n".join(lines)
+
+
+def evaluate(corpus: Path, model_size: str, compute_type: str, args, model_cache, artifact_cache, workdir: Path):
+    from audio_decoder import probe_duration
+    from subtitle import SubtitleService
+
+    manifest = json.loads(corpus.read_text())
+    root = corpus.parent
+    errors = reference_total = 0
+    timing = []
+    wall = cpu = asr = duration = 0.0
+    clips = []
+    for clip in manifest["clips"]:
+        media = root / clip["media"]
+        clip_duration = probe_duration(media)
+        service = SubtitleService(
+            model_size=model_size,
+            language=clip.get("language"),
+            separate_vocals=not args.no_separation,
+            cache_path=workdir,
+            captions_path=workdir / "captions",
+            model_cache=model_cache,
+            artifact_cache=artifact_cache,
+            compute_type=compute_type,
+            batch_size=args.batch_size,
+            asr_threads=args.threads)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = service.generate_subtitles(media)
+        clip_wall, clip_cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        clip_asr = sum(s["wall_seconds"] for s in service.metrics.to_list() if s["stage"] in ("transcribe", "align"))
+
+        clip_score = score(reference_words(clip, root), hypothesis_words(result))
+        errors += clip_score["errors"]
+        reference_total += clip_score["reference_words"]
+        timing += clip_score["timing"]
+        wall, cpu, asr, duration = wall + clip_wall, cpu + clip_cpu, asr + clip_asr, duration + clip_duration
+        clips.append({
+            "media": clip["media"],
+            "wer": round(clip_score["errors"] / clip_score["reference_words"], 4)
+            if clip_score["reference_words"] else None,
+            "rtf": round(clip_wall / clip_duration, 4) if clip_duration else None,
+        })
+        print(json.dumps({"model_size": model_size, "compute_type": compute_type, **clips[-1]}), file=sys.stderr)
+
+    return {
+        "model_size": model_size,
+        "compute_type": compute_type,
+        "wer": round(errors / reference_total, 4) if reference_total else 0.0,
+        "timing_error": round(sum(timing) / len(timing), 4) if timing else None,
+        "rtf": round(wall / duration, 4) if duration else 0.0,
+        "asr_rtf": round(asr / duration, 4) if duration else 0.0,
+        "cpu_rtf": round(cpu / duration, 4) if duration else 0.0,
+        "clips": clips,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", type=Path, help="json manifest of the clips and their reference lyrics")
+    parser.add_argument("--model-sizes", nargs="*", default=["tiny", "base", "small", "medium"])
+    parser.add_argument("--compute-types", nargs="*", default=["int8", "float32"])
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--no-separation", action="store_true", help="transcribe the mix, skip demucs")
+    parser.add_argument("--reuse-vocals", action="store_true",
+                        help="separate each clip once for all configurations, rtf then excludes separation")
+    parser.add_argument("--cpu", action="store_true", help="run on cpu even if cuda is available")
+    parser.add_argument("--output", type=Path, help="write results as json to this file")
+    args = parser.parse_args()
+
+    if args.cpu:
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    import torch
+    from artifact_cache import ArtifactCache
+    from model_cache import ModelCache
+
+    torch.set_num_threads(args.threads)
+    # the models of one configuration (separation, whisper, alignment) stay
+    # resident across its clips, the cache is cleared between configurations
+    model_cache = ModelCache()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        artifact_cache = ArtifactCache(workdir / "artifacts", 0) if args.reuse_vocals else None
+        for model_size in args.model_sizes:
+            for compute_type in args.compute_types:
+                rows.append(evaluate(
+                    args.corpus, model_size, compute_type, args, model_cache, artifact_cache, workdir))
+                model_cache.clear()
+
+    pareto(rows)
+    print(table(rows))
+    if args.output:
+        args.output.write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Benchmarks SubtitleService end to end on cpu, per model size and compute
+type, over synthetic clips and the clips found in benchmarks/clips.
+
+Each case runs in a fresh process, so that model loading and peak memory are
+measured per case: the first run loads the models (cold), the following
+--repeat runs reuse them (warm). For every run the real-time factor (wall
+time over clip duration), the peak resident memory and the wall time of
+each pipeline stage are reported.
+
+Runs offline: models are loaded from the local caches only, download them
+once beforehand, e.g. by running the benchmark once with --online. A case
+whose process dies, or runs longer than --case-timeout seconds, is reported
+with an error.
+
+usage: python benchmarks/pipeline.py [--durations 30 120] [--model-sizes tiny base]
+           [--compute-types int8 float32] [--input clip.mp4 ...] [--output results.json]
+           [--compare baseline.json --tolerance 0.15] [--online] [--case-timeout 3600]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+WORKER_DIR = Path(__file__).resolve().parents[1] / "worker"
+CLIPS_DIR = Path(__file__).resolve().parent / "clips"
+MEDIA_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.mp3', '.wav', '.aac', '.flac', '.ogg'}
+
+
+def ffmpeg(*args):
+    subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-y", *args], check=True)
+
+
+def synthetic_clip(path: Path, duration: float) -> Path:
+    # a tone switched on and off over a noise bed and a black video, so that
+    # the voice activity detection has silent regions to skip
+    ffmpeg(
+        "-f", "lavfi", "-i", f"sine=frequency=220:duration={duration}",
+        "-f", "lavfi", "-i", f"anoisesrc=amplitude=0.02:duration={duration}",
+        "-f", "lavfi", "-i", f"color=c=black:s=320x240:d={duration}",
+        "-filter_complex", "[0:a]volume='if(lt(mod(t,10),6),1,0)':eval=frame[v];[v][1:a]amix=inputs=2[a]",
+        "-map", "2:v", "-map", "[a]",
+        "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest",
+        str(path))
+    return path
+
+
+def peak_rss() -> int:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def stage_totals(spans: list) -> dict:
+    # streaming and vad may record a stage more than once per run
+    totals = {}
+    for span in spans:
+        totals[span["stage"]] = round(totals.get(span["stage"], 0.0) + span["wall_seconds"], 4)
+    return totals
+
+
+def run_case(case: dict, workdir: str, results):
+    """Runs one case in the current process and puts its result on results."""
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    if case["offline"]:
+        os.environ["HF_HUB_OFFLINE"] = "1"
+    sys.path.insert(0, str(WORKER_DIR))
+
+    import torch
+    from audio_decoder import probe_duration
+    from model_cache import ModelCache
+    from subtitle import SubtitleService
+
+    torch.set_num_threads(case["threads"])
+    model_cache = ModelCache()
+    clip = Path(case["clip"])
+    duration = probe_duration(clip)
+
+    runs = []
+    try:
+        for i in range(case["repeat"] + 1):
+            service = SubtitleService(
+                model_size=case["model_size"],
+                language=case["language"],
+                separate_vocals=case["separate_vocals"],
+                cache_path=Path(workdir),
+                captions_path=Path(workdir) / "captions",
+                model_cache=model_cache,
+                compute_type=case["compute_type"],
+                batch_size=case["batch_size"],
+                asr_threads=case["threads"])
+            start = time.perf_counter()
+            result = service.generate_subtitles(clip)
+            wall = time.perf_counter() - start
+            runs.append({
+                "cold": i == 0,
+                "wall_seconds": round(wall, 4),
+                "real_time_factor": round(wall / duration, 4) if duration else None,
+                "segments": len(result["segments"]),
+                "stages": stage_totals(service.metrics.to_list()),
+            })
+        results.put({**case, "duration": duration, "runs": runs, "peak_rss": peak_rss()})
+    except Exception as e:
+        results.put({**case, "duration": duration, "runs": runs, "error": str(e)})
+
+
+def run_isolated(case: dict, workdir: Path, timeout: float) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=run_case, args=(case, str(workdir), results))
+    process.start()
+    deadline = time.monotonic() + timeout
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            # e.g. killed by the oom killer, or crashed in native code
+            if process.exitcode is not None:
+                result = {**case, "duration": None, "runs": [], "error": f"case process exited with code {process.exitcode}"}
+            elif time.monotonic() > deadline:
+                process.kill()
+                result = {**case, "duration": None, "runs": [], "error": f"case timed out after {timeout:.0f}s"}
+    process.join()
+    return result
+
+
+def summarize(result: dict) -> dict:
+    warm = [run for run in result["runs"] if not run["cold"]] or result["runs"]
+    if not warm:
+        return {}
+    stages = {}
+    for run in warm:
+        for stage, seconds in run["stages"].items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "real_time_factor": round(sum(run["real_time_factor"] or 0 for run in warm) / len(warm), 4),
+        "stages": {stage: round(sum(v) / len(v), 4) for stage, v in stages.items()},
+        "load_seconds": round(result["runs"][0]["wall_seconds"] - warm[0]["wall_seconds"], 4)
+        if len(result["runs"]) > 1 else None,
+    }
+
+
+def case_id(result: dict) -> str:
+    return f'{Path(result["clip"]).name}/{result["model_size"]}/{result["compute_type"]}/' \
+           f'{"separated" if result["separate_vocals"] else "mix"}'
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Cases whose warm real-time factor grew by more than tolerance over the baseline."""
+    previous = {case_id(r): r["summary"] for r in baseline if r.get("summary")}
+    regressions = []
+    for result in results:
+        before = previous.get(case_id(result))
+        after = result.get("summary")
+        if not before or not after or not before["real_time_factor"]:
+            continue
+        change = after["real_time_factor"] / before["real_time_factor"] - 1
+        if change > tolerance:
+            regressions.append({
+                "case": case_id(result),
+                "baseline": before["real_time_factor"],
+                "current": after["real_time_factor"],
+                "change": round(change, 4),
+            })
+    return regressions
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=WORKER_DIR).stdout.strip()
+    except FileNotFoundError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cores": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=float, nargs="*", default=[30, 120],
+                        help="durations in seconds of the synthetic clips")
+    parser.add_argument("--input", type=Path, nargs="*", default=[], help="additional media files")
+    parser.add_argument("--clips-dir", type=Path, default=CLIPS_DIR, help="directory of bundled clips")
+    parser.add_argument("--model-sizes", nargs="*", default=["tiny", "base"])
+    parser.add_argument("--compute-types", nargs="*", default=["int8", "float32"])
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--language", default="en", help="fixed, so that runs do not depend on detection")
+    parser.add_argument("--no-separation", action="store_true", help="transcribe the mix, skip demucs")
+    parser.add_argument("--repeat", type=int, default=1, help="warm runs after the cold one")
+    parser.add_argument("--online", action="store_true", help="allow model downloads")
+    parser.add_argument("--case-timeout", type=float, default=3600, help="seconds before a case is abandoned")
+    parser.add_argument("--output", type=Path, help="write results as json to this file")
+    parser.add_argument("--compare", type=Path, help="baseline results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="relative real-time factor increase reported as a regression")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        bundled = sorted(p for p in args.clips_dir.glob("*") if p.suffix.lower() in MEDIA_EXTENSIONS) \
+            if args.clips_dir.is_dir() else []
+        clips = [synthetic_clip(workdir / f"synthetic-{int(d)}s.mp4", d) for d in args.durations] + bundled + args.input
+        for clip in clips:
+            for model_size in args.model_sizes:
+                for compute_type in args.compute_types:
+                    case = {
+                        "clip": str(clip),
+                        "model_size": model_size,
+                        "compute_type": compute_type,
+                        "batch_size": args.batch_size,
+                        "threads": args.threads,
+                        "language": args.language,
+                        "separate_vocals": not args.no_separation,
+                        "repeat": args.repeat,
+                        "offline": not args.online,
+                    }
+                    result = run_isolated(case, workdir, args.case_timeout)
+                    result["summary"] = summarize(result)
+                    results.append(result)
+                    print(json.dumps({"case": case_id(result), **result["summary"],
+                                      "error": result.get("error")}), file=sys.stderr)
+
+    report = {"environment": environment(), "results": results}
+    if args.compare:
+        report["regressions"] = compare(results, json.loads(args.compare.read_text())["results"], args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+    if report.get("regressions"):
+        print(f"{len(report['regressions'])} regression(s) over {args.compare}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
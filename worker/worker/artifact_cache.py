@@ -0,0 +1,73 @@
+import json
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from content_hash import params_hash
+from disk_cache import DiskCache
+
+
+class ArtifactCache:
+    """
+    Intermediate pipeline artifacts (decoded audio, vocals, transcriptions)
+    stored on disk under an LRU quota.
+
+    Keys are chained: the key of a stage output is derived from the key of its
+    input plus the stage parameters, starting from the media hash, so changing
+    a parameter only invalidates the artifacts from that stage on.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.cache = DiskCache(root, max_bytes)
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(input_key: str, stage: str, **params) -> str:
+        return params_hash(input_key, stage, **params)
+
+    def _count(self, stage: str, hit: bool) -> None:
+        with self._lock:
+            counters = self.hits if hit else self.misses
+            counters[stage] = counters.get(stage, 0) + 1
+
+    def get_audio(self, key: str, stage: str, channels: int = 1) -> Optional[np.ndarray]:
+        """Memory maps cached float32 PCM, (samples,) if mono else (channels, samples)."""
+        path = self.cache.get(key)
+        samples = None
+        if path:
+            try:
+                samples = np.memmap(path, dtype=np.float32, mode="c")
+            except (OSError, ValueError):
+                samples = None
+        self._count(stage, samples is not None)
+        if samples is None or channels == 1:
+            return samples
+        return samples[:len(samples) - len(samples) % channels].reshape(-1, channels).T
+
+    def put_audio(self, key: str, samples: np.ndarray) -> None:
+        tmp_path = self.cache.tmp_file()
+        # interleaved, as decoded by ffmpeg
+        samples.T.tofile(tmp_path)
+        self.cache.put_file(key, tmp_path)
+
+    def get_json(self, key: str, stage: str) -> Optional[dict]:
+        path = self.cache.get(key)
+        value = None
+        if path:
+            try:
+                value = json.loads(path.read_bytes())
+            except (OSError, ValueError):
+                value = None
+        self._count(stage, value is not None)
+        return value
+
+    def put_json(self, key: str, value) -> None:
+        self.cache.put_bytes(key, json.dumps(value, separators=(',', ':')).encode())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": dict(self.misses), "size": self.cache.size}
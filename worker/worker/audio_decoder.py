@@ -0,0 +1,88 @@
+import json
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# sample rate expected by whisper and the alignment models
+SAMPLE_RATE = 16000
+
+
+class AudioDecoderException(Exception):
+    pass
+
+
+def probe_duration(path: Path) -> float:
+    """Duration of the media file in seconds, 0 if unknown."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "json",
+        str(path),
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+        return float(json.loads(out)["format"]["duration"])
+    except (subprocess.CalledProcessError, FileNotFoundError, KeyError, ValueError):
+        return 0.0
+
+
+def decode_audio(
+        path: Path,
+        sample_rate: int = SAMPLE_RATE,
+        channels: int = 1,
+        spill_path: Optional[Path] = None,
+        start: float = 0,
+        duration: float = None) -> np.ndarray:
+    """
+    Decodes the first audio stream of a media file straight to float32 PCM,
+    resampled and down-mixed by ffmpeg, without any intermediate encoding.
+
+    Returns a (samples,) array for mono audio, (channels, samples) otherwise.
+    If spill_path is set the PCM is written there as raw float32 and memory
+    mapped, so that long files are paged in on demand instead of being held
+    in memory. start and duration, in seconds, restrict decoding to a window
+    of the file.
+    """
+    window = []
+    if start:
+        window += ["-ss", f"{start:.3f}"]
+    if duration:
+        window += ["-t", f"{duration:.3f}"]
+    cmd = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-threads", "0",
+        *window,
+        "-i", str(path),
+        "-map", "0:a:0",
+        "-f", "f32le",
+        "-acodec", "pcm_f32le",
+        "-ac", str(channels),
+        "-ar", str(sample_rate),
+    ]
+    try:
+        if spill_path:
+            subprocess.run(cmd + ["-y", str(spill_path)], capture_output=True, check=True)
+            # copy-on-write so that consumers may modify the buffer in place
+            # without touching the file
+            samples = np.memmap(spill_path, dtype=np.float32, mode="c")
+        else:
+            proc = subprocess.Popen(cmd + ["-"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # read into a mutable buffer so the array is writeable without
+            # an extra copy
+            buffer = bytearray()
+            while chunk := proc.stdout.read(1 << 20):
+                buffer += chunk
+            stderr = proc.stderr.read()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+            samples = np.frombuffer(buffer, dtype=np.float32)
+    except subprocess.CalledProcessError as e:
+        raise AudioDecoderException(f"failed to decode audio from {path}: {e.stderr.decode(errors='ignore')}")
+    except FileNotFoundError:
+        raise AudioDecoderException("ffmpeg is not installed")
+
+    if channels == 1:
+        return samples
+    return samples[:len(samples) - len(samples) % channels].reshape(-1, channels).T
@@ -0,0 +1,205 @@
+import importlib.metadata
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+import torch
+from faster_whisper.tokenizer import Tokenizer
+from whisperx.audio import N_SAMPLES, SAMPLE_RATE, log_mel_spectrogram
+from whisperx.vad import merge_chunks
+
+# BatchScheduler.transcribe rebuilds FasterWhisperPipeline.transcribe on
+# private state of the pipeline (_vad_params, preset_language, the tokenizer
+# and generate_segment_batched of its model), as laid out in this version only
+WHISPERX_VERSION = "3.3.1"
+if importlib.metadata.version("whisperx") != WHISPERX_VERSION:
+    raise ImportError(
+        f"batching requires whisperx {WHISPERX_VERSION}, found {importlib.metadata.version('whisperx')}; "
+        "check BatchScheduler.transcribe against the new FasterWhisperPipeline.transcribe before updating the pin")
+
+
+class BatchSchedulerException(Exception):
+    pass
+
+
+class _Chunk:
+    def __init__(self, features: np.ndarray, pipeline, tokenizer: Tokenizer):
+        self.features = features
+        self.pipeline = pipeline
+        self.tokenizer = tokenizer
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class BatchScheduler:
+    """
+    Decodes the audio chunks of concurrent jobs sharing a whisper model in
+    common batches.
+
+    Jobs submit the log-mel features of their chunks, a single decoding thread
+    collects them per (model, language) and runs a batch as soon as
+    max_batch_size chunks are waiting or the oldest one has waited max_latency
+    seconds, then routes each text back to the job that submitted it.
+    """
+
+    def __init__(self, max_batch_size: int = 16, max_latency: float = 0.05):
+        self.logger = logging.getLogger(__name__)
+
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+
+        self._queues: Dict[Hashable, deque] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        # the vad model and language detection of a pipeline are not safe to
+        # call from several jobs at once, only its decoding goes through batches
+        self._pipeline_locks = weakref.WeakKeyDictionary()
+
+        self.batches = 0
+        self.chunks = 0
+        self.busy_seconds = 0.0
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='asr-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, key: Hashable, features: np.ndarray, pipeline, tokenizer: Tokenizer) -> Future:
+        """
+        Queues the features of one chunk, chunks with the same key must share
+        the model, tokenizer and decoding options.
+        """
+        self.start()
+        chunk = _Chunk(features, pipeline, tokenizer)
+        with self._cond:
+            self._queues.setdefault(key, deque()).append(chunk)
+            self._cond.notify()
+        return chunk.future
+
+    def _pipeline_lock(self, pipeline) -> threading.Lock:
+        with self._cond:
+            lock = self._pipeline_locks.get(pipeline)
+            if lock is None:
+                lock = self._pipeline_locks[pipeline] = threading.Lock()
+            return lock
+
+    def _next_batch(self):
+        # must be called with self._cond held. Returns the chunks to decode, or
+        # None and how long to wait before a batch may be due
+        now = time.monotonic()
+        due_key, oldest, wait = None, None, None
+        for key, queue in self._queues.items():
+            if not queue:
+                continue
+            ready_in = queue[0].enqueued + self.max_latency - now
+            if len(queue) >= self.max_batch_size or ready_in <= 0:
+                # the longest waiting group goes first
+                if oldest is None or queue[0].enqueued < oldest:
+                    due_key, oldest = key, queue[0].enqueued
+            elif wait is None or ready_in < wait:
+                wait = ready_in
+        if due_key is None:
+            return None, wait
+
+        queue = self._queues[due_key]
+        batch = [queue.popleft() for _ in range(min(len(queue), self.max_batch_size))]
+        if not queue:
+            del self._queues[due_key]
+        return batch, None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch, wait = self._next_batch()
+                while batch is None:
+                    self._cond.wait(wait)
+                    batch, wait = self._next_batch()
+            self._decode(batch)
+
+    def _decode(self, batch: List[_Chunk]) -> None:
+        pipeline, tokenizer = batch[0].pipeline, batch[0].tokenizer
+        start = time.perf_counter()
+        try:
+            features = np.stack([chunk.features for chunk in batch])
+            texts = pipeline.model.generate_segment_batched(features, tokenizer, pipeline.options)
+        except Exception as e:
+            for chunk in batch:
+                chunk.future.set_exception(BatchSchedulerException(f"failed to decode batch: {e}"))
+            return
+        finally:
+            self.batches += 1
+            self.chunks += len(batch)
+            self.busy_seconds += time.perf_counter() - start
+
+        for chunk, text in zip(batch, texts):
+            chunk.future.set_result(text)
+
+    def transcribe(
+            self,
+            key: Hashable,
+            pipeline,
+            audio: np.ndarray,
+            language: Optional[str] = None,
+            chunk_size: int = 30) -> dict:
+        """
+        Same as whisperx FasterWhisperPipeline.transcribe, with the chunks
+        decoded in batches shared with the other jobs using the same model.
+        """
+        with self._pipeline_lock(pipeline):
+            vad_segments = pipeline.vad_model(
+                {"waveform": torch.from_numpy(np.asarray(audio)).unsqueeze(0), "sample_rate": SAMPLE_RATE})
+            if not language and not pipeline.preset_language:
+                language = pipeline.detect_language(audio)
+        vad_segments = merge_chunks(
+            vad_segments,
+            chunk_size,
+            onset=pipeline._vad_params["vad_onset"],
+            offset=pipeline._vad_params["vad_offset"],
+        )
+
+        language = language or pipeline.preset_language
+        # a private tokenizer, the one of the pipeline is swapped by transcribe
+        tokenizer = Tokenizer(
+            pipeline.model.hf_tokenizer,
+            pipeline.model.model.is_multilingual,
+            task="transcribe",
+            language=language)
+
+        n_mels = pipeline.model.feat_kwargs.get("feature_size") or 80
+        texts = []
+        pending = deque()
+        for segment in vad_segments:
+            chunk = audio[int(segment['start'] * SAMPLE_RATE):int(segment['end'] * SAMPLE_RATE)]
+            features = log_mel_spectrogram(chunk, n_mels=n_mels, padding=N_SAMPLES - chunk.shape[0])
+            pending.append(self.submit((key, language), features.numpy(), pipeline, tokenizer))
+            # bound the features held per job on long files
+            while len(pending) >= 2 * self.max_batch_size:
+                texts.append(pending.popleft().result())
+        texts += [future.result() for future in pending]
+
+        segments = [
+            {
+                "text": text,
+                "start": round(segment['start'], 3),
+                "end": round(segment['end'], 3),
+            }
+            for segment, text in zip(vad_segments, texts)
+        ]
+        return {"segments": segments, "language": language}
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = sum(len(queue) for queue in self._queues.values())
+        return {
+            "batches": self.batches,
+            "chunks": self.chunks,
+            "mean_batch_size": round(self.chunks / self.batches, 2) if self.batches else 0.0,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "queued": queued,
+        }
@@ -0,0 +1,18 @@
+import hashlib
+import json
+from pathlib import Path
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """sha256 of the file content."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_hash(*parts, **params) -> str:
+    """Stable sha256 of the given values, e.g. a media hash plus stage parameters."""
+    payload = json.dumps([parts, params], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
@@ -0,0 +1,172 @@
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+
+class DiskCache:
+    """
+    Directory of files addressed by key, evicted least recently used first
+    once their total size exceeds max_bytes. Reads refresh the modification
+    time of an entry, which is what eviction orders by, so the cache may be
+    shared by several worker processes. A pinned entry holds a shared flock
+    on its file, which no process evicts.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.logger = logging.getLogger(__name__)
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._tmp = self.root / "tmp"
+        os.makedirs(self._tmp, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = self._scan_size()
+        # open file and count of the pins of each entry pinned by this process
+        self._pins: Dict[str, list] = {}
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _entries(self):
+        for d in self.root.iterdir():
+            if d == self._tmp or not d.is_dir():
+                continue
+            for f in d.iterdir():
+                try:
+                    st = f.stat()
+                except FileNotFoundError:
+                    continue
+                yield f, st.st_size, st.st_mtime
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def pin(self, key: str) -> bool:
+        """
+        Protects the entry of key from eviction by any process sharing the
+        directory until as many unpin. False if there is no such entry.
+        """
+        with self._lock:
+            pin = self._pins.get(key)
+            if pin is not None:
+                pin[1] += 1
+                return True
+            try:
+                fd = os.open(self._path(key), os.O_RDONLY)
+            except FileNotFoundError:
+                return False
+            # waits for an eviction in progress, which leaves the file unlinked
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            if os.fstat(fd).st_nlink == 0:
+                os.close(fd)
+                return False
+            self._pins[key] = [fd, 1]
+            return True
+
+    def unpin(self, key: str) -> None:
+        with self._lock:
+            pin = self._pins.get(key)
+            if pin is None:
+                return
+            pin[1] -= 1
+            if not pin[1]:
+                del self._pins[key]
+                os.close(pin[0])
+
+    def tmp_file(self, suffix: str = "") -> Path:
+        """Path of a new file on the cache file system, to be filled and passed to put_file."""
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp, suffix=suffix)
+        os.close(fd)
+        return Path(tmp_path)
+
+    def put_bytes(self, key: str, data: bytes) -> Path:
+        tmp_path = self.tmp_file()
+        tmp_path.write_bytes(data)
+        return self.put_file(key, tmp_path)
+
+    def put_file(self, key: str, src: Path) -> Path:
+        """
+        Stores src in the cache under key. Files created with tmp_file are
+        moved, others are copied.
+        """
+        path = self._path(key)
+        os.makedirs(path.parent, exist_ok=True)
+        size = src.stat().st_size
+        if src.parent != self._tmp:
+            # copy first so that the final rename is atomic even across
+            # file systems
+            tmp_path = self.tmp_file()
+            shutil.copyfile(src, tmp_path)
+            src = tmp_path
+        with self._lock:
+            # an entry stored again under the same key replaces the old file
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(src, path)
+            self._size += size - replaced
+            if self.max_bytes and self._size > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    @staticmethod
+    def _unlink_unpinned(path: Path) -> bool:
+        """Deletes path unless a process pinned it."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        try:
+            # not replaced since it was opened
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+        finally:
+            os.close(fd)
+        return True
+
+    def _evict(self, keep: Path = None) -> None:
+        # must be called with self._lock held; other processes may share the
+        # directory so the file system is the source of truth
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes:
+                break
+            if path == keep or path.name in self._pins or not self._unlink_unpinned(path):
+                continue
+            self._size -= size
+            self.logger.info(f"evicted {path.name} from {self.root}")
+
+    def delete(self, key: str) -> None:
+        try:
+            path = self._path(key)
+            size = path.stat().st_size
+            path.unlink()
+            with self._lock:
+                self._size -= size
+        except FileNotFoundError:
+            pass
+
+    @property
+    def size(self) -> int:
+        return self._size
@@ -0,0 +1,309 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import redis
+from redis.exceptions import ResponseError
+
+
+class JobQueueException(Exception):
+    pass
+
+
+@dataclass
+class QueuedJob:
+    job_id: str
+    # backend specific handle used to acknowledge the job
+    receipt: bytes
+    deliveries: int = 1
+
+
+class JobQueue(ABC):
+    @abstractmethod
+    def get(self, timeout: int) -> Optional[QueuedJob]:
+        """Blocks up to timeout seconds for the next job."""
+        pass
+
+    @abstractmethod
+    def ack(self, job: QueuedJob) -> None:
+        """Marks the job as done, it will not be delivered again."""
+        pass
+
+    def start(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class ListJobQueue(JobQueue):
+    """
+    Jobs are moved from the queue list into a per-worker processing list and
+    removed from it once done. Jobs left in the processing list by a previous
+    run of the same worker are requeued on start.
+    """
+
+    def __init__(self, r: redis.Redis, consumer: str, name: str = "subtitle"):
+        self.r = r
+        self.name = name
+        self.processing = f'{name}:processing:{consumer}'
+
+    def start(self) -> None:
+        while self.r.lmove(self.processing, self.name, 'RIGHT', 'LEFT'):
+            pass
+
+    def get(self, timeout: int) -> Optional[QueuedJob]:
+        job_id = self.r.blmove(self.name, self.processing, timeout, 'LEFT', 'RIGHT')
+        if not job_id:
+            return None
+        return QueuedJob(job_id.decode('utf-8'), job_id)
+
+    def ack(self, job: QueuedJob) -> None:
+        self.r.lrem(self.processing, 1, job.receipt)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "list",
+            "length": self.r.llen(self.name),
+            "processing": self.r.llen(self.processing),
+        }
+
+
+class StreamJobQueue(JobQueue):
+    """
+    Jobs are read from a redis stream through a consumer group. Entries stay in
+    the group pending list until acknowledged; while a job runs its entry is
+    periodically re-claimed by its consumer to reset the idle time, so entries
+    idle for longer than claim_idle_ms belong to dead consumers and are claimed
+    by the others.
+    """
+
+    def __init__(
+            self,
+            r: redis.Redis,
+            consumer: str,
+            name: str = "subtitle:stream",
+            group: str = "workers",
+            claim_idle_ms: int = 60000):
+        self.logger = logging.getLogger(__name__)
+        self.r = r
+        self.consumer = consumer
+        self.name = name
+        self.group = group
+        self.claim_idle_ms = claim_idle_ms
+
+        self._in_progress: Dict[bytes, QueuedJob] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        try:
+            self.r.xgroup_create(self.name, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise JobQueueException(f"failed to create consumer group {self.group}: {e}")
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.claim_idle_ms / 3000):
+            with self._lock:
+                ids = list(self._in_progress.keys())
+            if not ids:
+                continue
+            try:
+                self.r.xclaim(self.name, self.group, self.consumer, 0, ids, justid=True)
+            except redis.RedisError as e:
+                self.logger.warning(f"failed to refresh pending jobs: {e}")
+
+    def _track(self, msg_id: bytes, fields: dict, deliveries: int) -> QueuedJob:
+        job = QueuedJob(fields[b'job_id'].decode('utf-8'), msg_id, deliveries)
+        with self._lock:
+            self._in_progress[msg_id] = job
+        return job
+
+    def _claim(self) -> Optional[QueuedJob]:
+        _, claimed, *_ = self.r.xautoclaim(
+            self.name, self.group, self.consumer, self.claim_idle_ms, start_id='0-0', count=1)
+        for msg_id, fields in claimed:
+            # entries trimmed from the stream are returned without fields
+            if not fields:
+                continue
+            pending = self.r.xpending_range(self.name, self.group, min=msg_id, max=msg_id, count=1)
+            deliveries = pending[0]['times_delivered'] if pending else 1
+            self.logger.info(f"claimed job {fields[b'job_id']} from a dead consumer")
+            return self._track(msg_id, fields, deliveries)
+        return None
+
+    def get(self, timeout: int) -> Optional[QueuedJob]:
+        job = self._claim()
+        if job:
+            return job
+        res = self.r.xreadgroup(
+            self.group, self.consumer, {self.name: '>'}, count=1, block=timeout * 1000)
+        for _, messages in res or []:
+            for msg_id, fields in messages:
+                return self._track(msg_id, fields, 1)
+        return None
+
+    def ack(self, job: QueuedJob) -> None:
+        with self._lock:
+            self._in_progress.pop(job.receipt, None)
+        pipe = self.r.pipeline()
+        pipe.xack(self.name, self.group, job.receipt)
+        pipe.xdel(self.name, job.receipt)
+        pipe.execute()
+
+    def stats(self) -> dict:
+        consumers = self.r.xinfo_consumers(self.name, self.group)
+        group = next((g for g in self.r.xinfo_groups(self.name) if g['name'] == self.group.encode()), {})
+        return {
+            "backend": "stream",
+            "length": self.r.xlen(self.name),
+            "lag": group.get('lag'),
+            "pending": group.get('pending'),
+            "consumers": {c['name'].decode('utf-8'): {"pending": c['pending'], "idle": c['idle']} for c in consumers},
+        }
+
+
+class PriorityJobQueue(JobQueue):
+    """
+    Jobs are popped from a sorted set, lowest score first, into a per-worker
+    processing hash that keeps their score, so that they can be requeued at
+    their original place. The api scores jobs by priority class and estimated
+    cost, and pushes a token to the ready list for each job it queues: idle
+    workers block on that list instead of polling the sorted set.
+
+    Workers record their last heartbeat in the consumers sorted set. Jobs left
+    in the processing hash by a previous run of the same worker are requeued
+    on start, those of a worker whose heartbeat is older than claim_idle_ms
+    are requeued by the other workers.
+
+    Assumes a single redis instance, not a cluster: the reclaim script
+    derives the processing hash of each dead consumer from its name, keys
+    that it cannot declare upfront.
+    """
+
+    # pops the next job and records it as processing in a single step; with
+    # ARGV[1] set, a job taken without waiting on the ready list also takes
+    # its token, so that tokens do not pile up
+    _POP_SCRIPT = """
+    local popped = redis.call('ZPOPMIN', KEYS[1])
+    if #popped == 0 then
+        return nil
+    end
+    if ARGV[1] == '1' then
+        redis.call('LPOP', KEYS[4])
+    end
+    redis.call('HSET', KEYS[2], popped[1], popped[2])
+    local deliveries = redis.call('HINCRBY', KEYS[3], popped[1], 1)
+    return {popped[1], deliveries}
+    """
+
+    # requeues the jobs of the consumers whose heartbeat is older than ARGV[2]
+    _RECLAIM_SCRIPT = """
+    local requeued = 0
+    for _, consumer in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])) do
+        local processing = ARGV[1] .. consumer
+        local jobs = redis.call('HGETALL', processing)
+        for i = 1, #jobs, 2 do
+            redis.call('ZADD', KEYS[1], jobs[i + 1], jobs[i])
+            redis.call('RPUSH', KEYS[3], 1)
+            requeued = requeued + 1
+        end
+        redis.call('DEL', processing)
+        redis.call('ZREM', KEYS[2], consumer)
+    end
+    return requeued
+    """
+
+    def __init__(
+            self,
+            r: redis.Redis,
+            consumer: str,
+            name: str = "subtitle:priority",
+            claim_idle_ms: int = 60000):
+        self.logger = logging.getLogger(__name__)
+        self.r = r
+        self.consumer = consumer
+        self.name = name
+        self.processing_prefix = f'{name}:processing:'
+        self.processing = f'{self.processing_prefix}{consumer}'
+        self.deliveries = f'{name}:deliveries'
+        self.ready = f'{name}:ready'
+        self.consumers = f'{name}:consumers'
+        self.claim_idle_ms = claim_idle_ms
+        self._pop = self.r.register_script(self._POP_SCRIPT)
+        self._reclaim = self.r.register_script(self._RECLAIM_SCRIPT)
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._beat()
+        leftovers = self.r.hgetall(self.processing)
+        if leftovers:
+            pipe = self.r.pipeline()
+            pipe.zadd(self.name, {job_id: float(score) for job_id, score in leftovers.items()})
+            pipe.rpush(self.ready, *[1] * len(leftovers))
+            pipe.delete(self.processing)
+            pipe.execute()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def _beat(self) -> None:
+        self.r.zadd(self.consumers, {self.consumer: time.time()})
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.claim_idle_ms / 3000):
+            try:
+                self._beat()
+            except redis.RedisError as e:
+                self.logger.warning(f"failed to refresh worker heartbeat: {e}")
+
+    def _claim(self) -> None:
+        cutoff = time.time() - self.claim_idle_ms / 1000
+        requeued = self._reclaim(keys=[self.name, self.consumers, self.ready], args=[self.processing_prefix, cutoff])
+        if requeued:
+            self.logger.info(f"requeued {requeued} jobs of dead workers")
+
+    def _pop_job(self, take_token: bool) -> Optional[QueuedJob]:
+        popped = self._pop(
+            keys=[self.name, self.processing, self.deliveries, self.ready], args=[1 if take_token else 0])
+        if not popped:
+            return None
+        job_id, deliveries = popped
+        return QueuedJob(job_id.decode('utf-8'), job_id, int(deliveries))
+
+    def get(self, timeout: int) -> Optional[QueuedJob]:
+        self._claim()
+        job = self._pop_job(take_token=True)
+        if job:
+            return job
+        # scripts cannot block, the ready list wakes the worker up when a job
+        # is queued; tokens of jobs already taken by other workers pop nothing
+        if not self.r.blpop([self.ready], timeout):
+            return None
+        return self._pop_job(take_token=False)
+
+    def ack(self, job: QueuedJob) -> None:
+        pipe = self.r.pipeline()
+        pipe.hdel(self.processing, job.receipt)
+        pipe.hdel(self.deliveries, job.receipt)
+        pipe.execute()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "priority",
+            "length": self.r.zcard(self.name),
+            "processing": self.r.hlen(self.processing),
+        }
+
+
+def create_job_queue(r: redis.Redis, backend: str, consumer: str, claim_idle_ms: int = 60000) -> JobQueue:
+    if backend == "list":
+        return ListJobQueue(r, consumer)
+    if backend == "stream":
+        return StreamJobQueue(r, consumer, claim_idle_ms=claim_idle_ms)
+    if backend == "priority":
+        return PriorityJobQueue(r, consumer, claim_idle_ms=claim_idle_ms)
+    raise JobQueueException(f"unsupported job queue backend: {backend}")
@@ -0,0 +1,83 @@
+import re
+from typing import List, Tuple
+
+import numpy as np
+import whisperx
+
+from audio_decoder import SAMPLE_RATE
+
+# lines such as [Chorus] or (Verse 2) are not sung
+SECTION_MARKER = re.compile(r"\s*[\[(][^\])]*[\])]\s*")
+
+
+def lyric_lines(text: str) -> List[str]:
+    """The sung lines of the lyrics, without blank lines and section markers."""
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if line and not SECTION_MARKER.fullmatch(line):
+            lines.append(line)
+    return lines
+
+
+def line_windows(lines: List[str], start: float, end: float) -> List[Tuple[float, float]]:
+    """Spreads lines over [start, end] in proportion to their length."""
+    weights = np.array([len(line) + 1 for line in lines], dtype=np.float64)
+    bounds = start + (end - start) * np.concatenate(([0.0], np.cumsum(weights))) / weights.sum()
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def predicted_segment(line: str, start: float, end: float) -> dict:
+    """A line without word timings, at the times its length predicts."""
+    return {"start": round(start, 3), "end": round(end, 3), "text": line, "words": []}
+
+
+def predicted_lyrics(lines: List[str], duration: float) -> dict:
+    """The lines spread over the whole audio, e.g. when none of it is voiced."""
+    windows = line_windows(lines, 0.0, duration)
+    segments = [predicted_segment(line, start, end) for line, (start, end) in zip(lines, windows)]
+    return {"segments": segments, "word_segments": [], "unaligned_lines": len(lines)}
+
+
+def align_lyrics(
+        lines: List[str],
+        audio: np.ndarray,
+        model,
+        metadata: dict,
+        device: str,
+        padding: float = 5.0) -> dict:
+    """
+    Forced alignment of the lines of the lyrics against audio, without
+    transcribing it.
+
+    Lines are aligned one at a time, in order. Each line is searched from the
+    end of the previous one up to where its length predicts it ends, when
+    the lines left are spread over the rest of the audio, plus padding
+    seconds. whisperx splits a line at sentence punctuation, its pieces are
+    merged back into one segment per line, words it could not time are kept
+    without times. Lines that cannot be aligned keep their predicted times
+    and no word timings, they are counted in unaligned_lines.
+    """
+    duration = audio.shape[-1] / SAMPLE_RATE
+    segments = []
+    unaligned = 0
+    position = 0.0
+    for i, line in enumerate(lines):
+        predicted_start, predicted_end = line_windows(lines[i:], position, duration)[0]
+        window = {"start": position, "end": min(predicted_end + padding, duration), "text": line}
+        aligned = whisperx.align([window], model, metadata, audio, device, return_char_alignments=False)["segments"]
+        words = [word for segment in aligned for word in segment.get("words", [])]
+        starts = [word["start"] for word in words if word.get("start") is not None]
+        ends = [word["end"] for word in words if word.get("end") is not None]
+        if not starts or not ends:
+            segments.append(predicted_segment(line, predicted_start, predicted_end))
+            position = predicted_end
+            unaligned += 1
+            continue
+        segments.append({"start": min(starts), "end": max(ends), "text": line, "words": words})
+        position = max(position, max(ends))
+    return {
+        "segments": segments,
+        "word_segments": [word for segment in segments for word in segment["words"]],
+        "unaligned_lines": unaligned,
+    }
@@ -1,10 +1,28 @@
 from subtitle import SubtitleService
+from model_cache import ModelCache
+from job_queue import QueuedJob, create_job_queue
+from result_cache import create_result_cache, result_key
+from content_hash import params_hash
+from artifact_cache import ArtifactCache
+from media_cache import CachedMedia, MediaCache
+from scratch import ScratchDir, ScratchSpace, estimate_scratch_bytes
+from audio_decoder import probe_duration
+from metrics import JOBS, start_metrics_server
+from batching import BatchScheduler
+from tuning import Tuning, apply, tune, tune_isolated
+from result_encoding import empty_result, encode_result, encode_segments
+from supervisor import ProcessStats, Supervisor
+from pipeline import PipelineItem, Stage, StagedPipeline
 import time
 import redis
-import os
 import requests
+import torch
+import os
 import threading
+import socket
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import quote
 
 hugging_face_token = os.getenv("HUGGING_FACE_TOKEN")
 
@@ -14,75 +32,562 @@ api_host = os.getenv("API_HOST", "localhost")
 api_port = os.getenv("API_PORT", "8000")
 api_url = f'http://{api_host}:{api_port}'
 
-def get_file(filename: str):
-    response = requests.get(f'{api_url}/file/{filename}')
-    if response.status_code != 200:
+# number of jobs processed concurrently by this worker
+worker_concurrency = int(os.getenv("WORKER_CONCURRENCY", "2"))
+# seconds a blocking dequeue waits before polling again
+dequeue_timeout = int(os.getenv("DEQUEUE_TIMEOUT", "5"))
+worker_id = os.getenv("WORKER_ID", socket.gethostname())
+# with more than one process, the worker preloads the torch models then forks
+# processes that share them, each loading its whisper models and running
+# WORKER_CONCURRENCY jobs
+worker_processes = int(os.getenv("WORKER_PROCESSES", "1"))
+# jobs redelivered more times than this, e.g. because they keep crashing
+# workers, are failed
+job_max_deliveries = int(os.getenv("JOB_MAX_DELIVERIES", "3"))
+
+def create_worker_queue(consumer: str):
+    return create_job_queue(
+        r,
+        os.getenv("JOB_QUEUE_BACKEND", "list"),
+        consumer,
+        claim_idle_ms=int(os.getenv("JOB_CLAIM_IDLE_MS", "60000")))
+
+job_queue = create_worker_queue(worker_id)
+
+# models stay loaded across jobs, least recently used ones are evicted once
+# the cache grows past the memory budget
+model_cache = ModelCache(
+    memory_budget=int(os.getenv("MODEL_CACHE_MEMORY_MB", "4096")) * 2**20,
+    max_entries=int(os.getenv("MODEL_CACHE_MAX_ENTRIES", "0")))
+
+separation_model = os.getenv("SEPARATION_MODEL", "mdx_extra")
+# vocals are separated in segments of this many seconds, to bound memory on
+# long tracks, cross-faded over the given overlap
+separation_segment = float(os.getenv("SEPARATION_SEGMENT_SECONDS", "60"))
+separation_overlap = float(os.getenv("SEPARATION_OVERLAP_SECONDS", "2"))
+# window length of jobs run in streaming mode
+stream_window = float(os.getenv("STREAM_WINDOW_SECONDS", "120"))
+# segments of realign jobs are aligned within their times widened by this
+realign_padding = float(os.getenv("REALIGN_PADDING_SECONDS", "1"))
+# decoded audio of files longer than this is memory mapped instead of held in memory
+audio_spill_seconds = float(os.getenv("AUDIO_SPILL_SECONDS", "1200"))
+# regions of the vocals without speech are not transcribed, a region is
+# voiced when louder than VAD_THRESHOLD_DB relative to the loudest part
+vad_enabled = os.getenv("VAD_ENABLED", "true").lower() in ("1", "true", "yes")
+vad_threshold_db = float(os.getenv("VAD_THRESHOLD_DB", "-40"))
+
+cache_dir = Path(os.getenv("CACHE_DIR", "/tmp/mais-cache"))
+# results of previous jobs on the same media with the same config, backend is
+# one of disk, redis or none
+result_cache = create_result_cache(
+    os.getenv("RESULT_CACHE_BACKEND", "disk"),
+    r,
+    cache_dir / "results",
+    int(os.getenv("RESULT_CACHE_MAX_MB", "512")) * 2**20)
+
+# decoded audio, vocals and transcriptions reused by jobs on the same media
+# with different settings
+artifact_cache_max_mb = int(os.getenv("ARTIFACT_CACHE_MAX_MB", "4096"))
+artifact_cache = ArtifactCache(cache_dir / "artifacts", artifact_cache_max_mb * 2**20) if artifact_cache_max_mb > 0 else None
+
+def optional_env(name: str, cast=str):
+    value = os.getenv(name)
+    return cast(value) if value else None
+
+# port of the prometheus metrics endpoint, 0 disables it
+metrics_port = int(os.getenv("METRICS_PORT", "9100"))
+
+# media files downloaded from the api, shared by the jobs on the same file
+media_cache = MediaCache(
+    cache_dir / "media",
+    int(os.getenv("MEDIA_CACHE_MAX_MB", "8192")) * 2**20,
+    api_url,
+    part_size=int(os.getenv("DOWNLOAD_PART_MB", "16")) * 2**20,
+    parallelism=int(os.getenv("DOWNLOAD_PARALLELISM", "4")))
+
+# per-job scratch directories, on tmpfs while the jobs fit in
+# SCRATCH_TMPFS_MAX_MB, on disk otherwise. New jobs wait while the estimated
+# scratch use of the running jobs exceeds SCRATCH_MAX_MB, split evenly between
+# the worker processes
+def create_scratch_space(owner: str, processes: int = 1) -> ScratchSpace:
+    tmpfs_dir = os.getenv("SCRATCH_TMPFS_DIR", "/dev/shm")
+    return ScratchSpace(
+        Path(os.getenv("SCRATCH_DIR", "/tmp/mais-scratch")) / owner,
+        int(os.getenv("SCRATCH_MAX_MB", "16384")) * 2**20 // processes,
+        tmpfs_root=Path(tmpfs_dir) / "mais-scratch" / owner if tmpfs_dir else None,
+        tmpfs_quota=int(os.getenv("SCRATCH_TMPFS_MAX_MB", "2048")) * 2**20 // processes)
+
+scratch_space = create_scratch_space(worker_id)
+
+# audio chunks of concurrent jobs sharing a whisper model are decoded in common
+# batches, a chunk waits at most ASR_BATCH_MAX_LATENCY_MS for others to join
+# its batch
+asr_batching = os.getenv("ASR_BATCHING", "true").lower() in ("1", "true", "yes")
+
+# batch size, compute type and thread counts are picked for the hardware from
+# a calibration run on TUNING_CALIBRATION_MODEL unless set explicitly, at
+# startup by setup_inference
+calibration_model = os.getenv("TUNING_CALIBRATION_MODEL", "tiny")
+tuning: Tuning = None
+batch_scheduler: BatchScheduler = None
+
+def tune_inference(isolated: bool = False) -> Tuning:
+    """
+    Picks the inference settings. Isolated, the calibration runs in a separate
+    process so that this one loads no model, starts no torch thread pool and
+    does not initialize cuda, and can fork worker processes.
+    """
+    settings = dict(
+        concurrency=worker_concurrency,
+        shared_decoder=asr_batching,
+        calibration_model=None if calibration_model == "none" else calibration_model,
+        batch_size=optional_env("ASR_BATCH_SIZE", int),
+        compute_type=optional_env("ASR_COMPUTE_TYPE"),
+        asr_threads=optional_env("ASR_THREADS", int),
+        torch_threads=optional_env("TORCH_THREADS", int),
+        max_batch_size=int(os.getenv("TUNING_MAX_BATCH_SIZE", "32")),
+        processes=worker_processes)
+    if isolated:
+        return tune_isolated(**settings)
+    return tune(model_cache, **settings)
+
+def setup_inference(settings: Tuning) -> None:
+    """Applies the inference settings to the current process and creates its batch scheduler."""
+    global tuning, batch_scheduler
+    tuning = settings
+    apply(tuning)
+    print(f"Inference settings: {tuning}")
+    batch_scheduler = BatchScheduler(
+        max_batch_size=tuning.batch_size,
+        max_latency=float(os.getenv("ASR_BATCH_MAX_LATENCY_MS", "50")) / 1000) if asr_batching else None
+
+# failed jobs, and optionally completed ones, expire from redis after these
+# seconds (0 keeps them)
+job_failed_ttl = int(os.getenv("JOB_FAILED_TTL", "30"))
+job_completed_ttl = int(os.getenv("JOB_COMPLETED_TTL", "0"))
+
+def update_job(job_id: str, fields: dict, metadata: dict = None, ttl: int = 0, pipe=None) -> None:
+    """
+    Writes fields and metadata entries of a job, and its expiry, in a single
+    transaction, so that readers never see a partial state change.
+    """
+    execute = pipe is None
+    if pipe is None:
+        pipe = r.pipeline(transaction=True)
+    key = f'job:{job_id}'
+    if metadata:
+        # jobs created without metadata
+        pipe.json().set(key, '$.metadata', {}, nx=True)
+        for name, value in metadata.items():
+            pipe.json().set(key, f'$.metadata.{name}', value)
+    for name, value in fields.items():
+        pipe.json().set(key, f'$.{name}', value)
+    if ttl > 0:
+        pipe.expire(key, ttl)
+    if execute:
+        pipe.execute()
+
+# deletes the in-flight marker of a job only if it still points to that job
+release_inflight = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+def resolve_followers(job_id: str, fields: dict, ttl: int = 0, identity: str = None) -> list:
+    """
+    Copies the final fields of a job to the identical jobs the api attached to
+    it, returns their ids.
+    """
+    if identity is None:
+        identity = next(iter(r.json().get(f'job:{job_id}', '$.metadata.identity') or []), None)
+    if identity:
+        # identical jobs submitted from now on run on their own
+        release_inflight(keys=[f'job:inflight:{identity}'], args=[job_id])
+    followers = [follower.decode('utf-8') for follower in r.smembers(f'job:{job_id}:followers')]
+    if not followers:
+        return []
+    pipe = r.pipeline(transaction=False)
+    for follower in followers:
+        update_job(follower, fields, ttl=ttl, pipe=pipe)
+    pipe.delete(f'job:{job_id}:followers')
+    # followers deleted in the meantime are skipped
+    pipe.execute(raise_on_error=False)
+    print(f"Job {job_id} resolved {len(followers)} identical jobs")
+    return followers
+
+def fail_job(job_id: str, reason: str, metadata: dict = None, identity: str = None) -> None:
+    fields = {'status': 'failed', 'error': reason}
+    try:
+        update_job(job_id, fields, metadata, ttl=job_failed_ttl)
+    except redis.ResponseError as e:
+        # e.g. the job was deleted
+        print(f"Failed to update job {job_id}: {e}")
+    resolve_followers(job_id, fields, ttl=job_failed_ttl, identity=identity)
+
+def complete_job(job_id: str, result: dict, metadata: dict = None, identity: str = None) -> None:
+    fields = {'status': 'completed', 'data': encode_result(result), 'progress': 1.0}
+    try:
+        update_job(job_id, fields, metadata, ttl=job_completed_ttl)
+    except redis.ResponseError as e:
+        # e.g. the job was deleted, its followers still get the result
+        print(f"Failed to update job {job_id}: {e}")
+    resolve_followers(job_id, fields, ttl=job_completed_ttl, identity=identity)
+
+def append_job_segments(job_id: str, segments: list, progress: float, language: str) -> None:
+    key = f'job:{job_id}'
+    pipe = r.pipeline(transaction=True)
+    if segments:
+        pipe.json().arrappend(key, '$.data.segments', *encode_segments(segments))
+    pipe.json().set(key, '$.data.language', language)
+    pipe.json().set(key, '$.progress', progress)
+    pipe.execute()
+
+def job_metadata(subtitle_service: SubtitleService) -> dict:
+    return {**subtitle_service.metadata, 'stages': subtitle_service.metrics.to_list()}
+
+class JobFailure(Exception):
+    pass
+
+class WorkerJob(PipelineItem):
+    """A job going through the stages of the worker."""
+
+    def __init__(self, queued: QueuedJob):
+        super().__init__()
+        self.queued = queued
+        self.job_id = queued.job_id
+        self.config = None
+        self.lyrics = None
+        # segments of a transcription to align again, instead of a full run
+        self.realign = None
+        self.media: CachedMedia = None
+        self.scratch_dir: ScratchDir = None
+        self.cache_key = None
+        self.service: SubtitleService = None
+        self.result = None
+        self.cached = False
+        self.identity = None
+        # written with the next state change of the job
+        self.metadata = {}
+
+    @property
+    def streaming(self) -> bool:
+        # streaming jobs go through all the steps in the transcribe stage, one
+        # window at a time; lyrics are aligned as a whole, realign jobs only
+        # align
+        return bool(self.config.get('streaming')) and not self.lyrics and not self.realign
+
+def create_subtitle_service(job: WorkerJob) -> SubtitleService:
+    return SubtitleService(
+        **job.config,
+        hugging_face_token=hugging_face_token,
+        model_cache=model_cache,
+        separation_model=separation_model,
+        separation_segment=separation_segment,
+        separation_overlap=separation_overlap,
+        audio_spill_seconds=audio_spill_seconds,
+        artifact_cache=artifact_cache,
+        stream_window=stream_window,
+        skip_silence=vad_enabled,
+        vad_threshold_db=vad_threshold_db,
+        batch_scheduler=batch_scheduler,
+        batch_size=tuning.batch_size,
+        compute_type=tuning.compute_type,
+        asr_threads=tuning.asr_threads,
+        lyrics=job.lyrics,
+        scratch_dir=job.scratch_dir.path)
+
+def fetch_stage(job: WorkerJob):
+    if job.queued.deliveries > job_max_deliveries:
+        print(f"Job {job.job_id} delivered {job.queued.deliveries} times, giving up")
+        raise JobFailure('job failed too many times')
+
+    print(f"Processing job: {job.job_id}")
+    doc = r.json().get(f'job:{job.job_id}')
+    if not doc:
+        print(f"Job {job.job_id} not found")
+        job.done = True
         return
-    with open(filename, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-
-def cleanup_job(job_id, delay: float=30):
-    if delay and delay>0:
-        time.sleep(delay)
-    r.json().delete(f'job:{job_id}', '$')
-
-def fail_job(job_id: str, reason: str) -> None:
-    r.json().set(f'job:{job_id}', 'status', 'failed')
-    r.json().set(f'job:{job_id}', 'error', reason)
-    cleanup_job(job_id)
-
-def process_job(job_id):
-    print(f"Processing job: {job_id}")
-    job = r.json().get(f'job:{job_id}')
-
-    job_info = job.get('info')
+    if doc.get('status') == 'completed':
+        # already processed by a worker that died before acknowledging it
+        job.done = True
+        return
+
+    job.identity = (doc.get('metadata') or {}).get('identity')
+    job_info = doc.get('info') or {}
     filename = job_info.get('filename')
-    job_config = job_info.get('config')
-    if not job_info or not filename or not job_config:
-        fail_job(job_id, 'invalid job')
+    job.config = job_info.get('config')
+    job.lyrics = job_info.get('lyrics')
+    job.realign = job_info.get('realign')
+    if not job_info or not filename or not job.config:
+        raise JobFailure('invalid job')
 
-    try:
-        get_file(filename)
-    except Exception as e:
-        fail_job(job_id, str(e))
+    job.media = media_cache.acquire(filename)
+    if result_cache and not job.realign:
+        # looked up before probing the media and reserving scratch space, a
+        # hit is answered without either
+        job.cache_key = result_key(
+            job.media.sha256, job.config,
+            separation_model=separation_model,
+            compute_type=tuning.compute_type,
+            vad_threshold_db=vad_threshold_db if vad_enabled else None,
+            lyrics=params_hash(job.lyrics) if job.lyrics else None)
+        result = result_cache.get(job.cache_key)
+        job.metadata['result_cache'] = {'hit': result is not None, 'hit_rate': result_cache.hit_rate}
+        if result is not None:
+            job.result = result
+            job.cached = True
+            job.done = True
+            return
+
+    if job.realign:
+        # at most the padded windows of the segments are decoded
+        duration = sum(max(s['end'] - s['start'], 0) + 2 * realign_padding for s in job.realign['segments'])
+    else:
+        duration = probe_duration(job.media.path)
+    if job.streaming:
+        # only one window is decoded at a time
+        duration = min(duration, stream_window)
+    job.scratch_dir = scratch_space.acquire(
+        job.job_id, estimate_scratch_bytes(duration, job.config.get('separate_vocals', True)))
+
+    running = {'status': 'running'}
+    if job.streaming:
+        running.update(data=empty_result(), progress=0.0)
+    update_job(job.job_id, running, job.metadata)
+    job.metadata = {}
+    job.service = create_subtitle_service(job)
+
+def decode_stage(job: WorkerJob):
+    if job.realign:
+        # the windows of realign jobs are separated as they are decoded
+        job.service.decode_realign(job.media.path, job.realign['segments'], job.media.sha256, realign_padding)
+    elif not job.streaming:
+        job.service.decode(job.media.path, job.media.sha256)
+
+def separate_stage(job: WorkerJob):
+    if not job.streaming and not job.realign:
+        job.service.separate()
+
+def transcribe_stage(job: WorkerJob):
+    if job.realign:
+        return
+    if not job.streaming:
+        job.service.transcribe()
+        return
+    job.result = job.service.generate_subtitles(
+        job.media.path,
+        job.media.sha256,
+        on_segments=lambda segments, progress, language: append_job_segments(job.job_id, segments, progress, language))
+
+def align_stage(job: WorkerJob):
+    if job.realign:
+        job.result = job.service.align_realign()
+    elif not job.streaming:
+        job.service.align()
 
-    r.json().set(f'job:{job_id}', 'status', 'running')
-    
+def diarize_stage(job: WorkerJob):
+    if not job.streaming and not job.realign:
+        job.service.diarize()
+        job.result = job.service.result()
+
+def post_realign_result(job: WorkerJob) -> None:
+    """Hands the outcome of a realign job to the api, which applies it to its transcription."""
+    if job.error is not None:
+        body = {'status': 'failed', 'error': str(job.error)}
+    else:
+        segments = [
+            {**segment, 'words': [{field: word.get(field) for field in ('word', 'start', 'end', 'score')}
+                                  for word in segment['words']]}
+            for segment in job.result['segments']
+        ]
+        body = {'status': 'completed', 'data': {'segments': segments, 'language': job.result.get('language')}}
+    url = f"{api_url}/transcription/{quote(job.realign['transcription_id'])}/realign/{quote(job.job_id)}"
     try:
-        subtitle_service = SubtitleService(**job_config, hugging_face_token=hugging_face_token)
-        result = subtitle_service.generate_subtitles(Path(filename))
-        r.json().set(f'job:{job_id}', 'status', 'completed')
-        r.json().set(f'job:{job_id}', 'data', result)
-    except Exception as e:
-        fail_job(job_id, str(e))
-
-
-def jobs_loop():
-    print("Starting jobs loop")
-    job_retry = 1
-    failed_jobs_dict = {}
-    
+        requests.post(url, json=body, timeout=30).raise_for_status()
+    except requests.RequestException as e:
+        # the transcription keeps its words, realigning it again supersedes this job
+        print(f"Failed to post the result of realign job {job.job_id}: {e}")
+
+def publish_stage(job: WorkerJob):
+    if job.scratch_dir is not None:
+        scratch_space.release(job.scratch_dir)
+    media_cache.release(job.media)
+
+    job_id = job.job_id
+    if job.service is not None:
+        # also the stages that ran before a failure
+        job.metadata.update(job_metadata(job.service))
+    if job.error is not None:
+        JOBS.labels('failed').inc()
+        fail_job(job_id, str(job.error), job.metadata, job.identity)
+    elif job.result is not None:
+        complete_job(job_id, job.result, job.metadata, job.identity)
+        JOBS.labels('cached' if job.cached else 'completed').inc()
+        if job.cache_key and not job.cached:
+            result_cache.put(job.cache_key, job.result)
+    if job.realign and (job.error is not None or job.result is not None):
+        post_realign_result(job)
+
+    if job.media is not None:
+        print(f"Model cache: {model_cache.stats()}")
+        print(f"Media cache: {media_cache.stats()}")
+        print(f"Scratch space: {scratch_space.stats()}")
+        if result_cache:
+            print(f"Result cache: {result_cache.stats()}")
+        if artifact_cache:
+            print(f"Artifact cache: {artifact_cache.stats()}")
+        if batch_scheduler:
+            print(f"ASR batches: {batch_scheduler.stats()}")
+
+# with the staged pipeline each stage has its own threads and a queue of
+# PIPELINE_QUEUE_SIZE jobs, so that the stages of consecutive jobs overlap.
+# Otherwise each job goes through all the stages in one of WORKER_CONCURRENCY
+# threads
+pipeline_enabled = os.getenv("PIPELINE_ENABLED", "true").lower() in ("1", "true", "yes")
+pipeline_queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "1"))
+# default threads of each stage, PIPELINE_<STAGE>_CONCURRENCY overrides them
+pipeline_stages = [
+    ('fetch', fetch_stage, 2),
+    ('decode', decode_stage, 1),
+    ('separate', separate_stage, 1),
+    ('transcribe', transcribe_stage, worker_concurrency),
+    ('align', align_stage, 1),
+    ('diarize', diarize_stage, 1),
+    ('publish', publish_stage, 2),
+]
+
+def create_pipeline(on_done) -> StagedPipeline:
+    return StagedPipeline([
+        Stage(
+            name,
+            run,
+            concurrency=int(os.getenv(f"PIPELINE_{name.upper()}_CONCURRENCY", str(concurrency))),
+            capacity=pipeline_queue_size,
+            always=name == 'publish')
+        for name, run, concurrency in pipeline_stages
+    ], on_done=on_done)
+
+def jobs_loop(stats: ProcessStats = None):
+    def job_done(job: WorkerJob):
+        try:
+            job_queue.ack(job.queued)
+            print(f"Pipeline stages: {pipeline.stats()}")
+        finally:
+            if stats:
+                stats.job_finished()
+            free_slots.release()
+
+    pipeline = create_pipeline(job_done)
+    if pipeline_enabled:
+        # by default one job is decoded ahead of the transcribe threads, each
+        # job in flight holds its decoded audio
+        max_jobs = int(os.getenv("PIPELINE_MAX_JOBS", "0")) or worker_concurrency + 1
+        print(f"Starting jobs loop with a staged pipeline of up to {max_jobs} jobs")
+        pipeline.start()
+        dispatch = pipeline.submit
+    else:
+        max_jobs = worker_concurrency
+        print(f"Starting jobs loop with {worker_concurrency} workers")
+        executor = ThreadPoolExecutor(max_workers=worker_concurrency, thread_name_prefix='job')
+        dispatch = lambda job: executor.submit(pipeline.run, job)
+    free_slots = threading.BoundedSemaphore(max_jobs)
+
+    job_queue.start()
+
     while True:
-        job_id = r.lpop('subtitle')
-        if job_id:
-            try:
-                t = threading.Thread(target=process_job, args=(job_id.decode('utf-8'),))
-                t.start()
-            except Exception as e:
-                try:
-                    failed_jobs_dict[job_id] += 1
-                except KeyError:
-                    failed_jobs_dict[job_id] = 1
-
-                if failed_jobs_dict[job_id] < job_retry:
-                    # push the job back to the queue
-                    r.rpush('subtitle', job_id)
-        else:
-            time.sleep(0.1)
+        # only dequeue when a worker is free, so that while this worker is busy
+        # pending jobs stay in the queue for other workers to pick up
+        free_slots.acquire()
+        # hold new jobs back while the running ones use up the scratch quota
+        while not scratch_space.wait_for_space(dequeue_timeout):
+            pass
+        try:
+            job = job_queue.get(dequeue_timeout)
+        except redis.RedisError as e:
+            print(f"Failed to dequeue job: {e}")
+            free_slots.release()
+            time.sleep(dequeue_timeout)
+            continue
+        if not job:
+            free_slots.release()
+            continue
+        if stats:
+            stats.job_started()
+        dispatch(WorkerJob(job))
+
+def preload_models(whisper: bool = True):
+    """
+    Loads the models of the job configs listed in PRELOAD_MODELS into the
+    model cache, without the whisper models with whisper=False.
+    """
+    model_sizes = [size.strip() for size in os.getenv("PRELOAD_MODELS", "").split(",") if size.strip()]
+    languages = [lang.strip() for lang in os.getenv("PRELOAD_LANGUAGES", "").split(",") if lang.strip()] or [None]
+    speaker_detection = os.getenv("PRELOAD_SPEAKER_DETECTION", "false").lower() in ("1", "true", "yes")
+    if not model_sizes:
+        return
+    scratch_dir = scratch_space.acquire('preload', 0)
+    try:
+        for model_size in model_sizes:
+            for language in languages:
+                SubtitleService(
+                    model_size=model_size,
+                    language=language,
+                    speaker_detection=speaker_detection,
+                    hugging_face_token=hugging_face_token,
+                    model_cache=model_cache,
+                    separation_model=separation_model,
+                    compute_type=tuning.compute_type,
+                    asr_threads=tuning.asr_threads,
+                    scratch_dir=scratch_dir.path).preload(whisper)
+    finally:
+        scratch_space.release(scratch_dir)
+    print(f"Preloaded models: {model_cache.stats()}")
+
+def worker_process(index: int, stats: ProcessStats, settings: Tuning):
+    """
+    Runs the jobs loop in a process forked by the supervisor. The models
+    preloaded by the supervisor are inherited, the whisper models are loaded
+    here.
+    """
+    global worker_id, job_queue, scratch_space
+    # jobs left by a previous process on the same index are requeued by its
+    # successor, which takes over its queue consumer and scratch directories
+    worker_id = f'{worker_id}-{index}'
+    job_queue = create_worker_queue(worker_id)
+    scratch_space = create_scratch_space(worker_id, worker_processes)
+    setup_inference(settings)
+    preload_models()
+    if metrics_port:
+        start_metrics_server(metrics_port + 1 + index)
+    jobs_loop(stats)
 
 def main():
+    if worker_processes > 1:
+        settings = tune_inference(isolated=True)
+        if settings.device == "cuda":
+            # a cuda context cannot be used in a forked process
+            raise SystemExit("WORKER_PROCESSES above 1 is not supported on cuda, use WORKER_CONCURRENCY instead")
+        global tuning
+        tuning = settings
+        # loaded single threaded so that no torch thread pool exists at fork
+        # time, the processes set their own thread counts
+        torch.set_num_threads(1)
+        preload_models(whisper=False)
+        supervisor = Supervisor(
+            lambda index, stats: worker_process(index, stats, settings),
+            worker_processes,
+            worker_concurrency,
+            sample_interval=float(os.getenv("WORKER_STATS_INTERVAL", "10")))
+        if metrics_port:
+            start_metrics_server(metrics_port)
+        supervisor.run()
+        return
+    setup_inference(tune_inference())
+    preload_models()
+    if metrics_port:
+        start_metrics_server(metrics_port)
     jobs_loop()
 
 if __name__ == '__main__':
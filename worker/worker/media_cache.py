@@ -0,0 +1,203 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from content_hash import file_hash, params_hash
+from disk_cache import DiskCache
+
+
+class MediaCacheException(Exception):
+    pass
+
+
+@dataclass
+class CachedMedia:
+    key: str
+    path: Path
+    size: int
+    # sha256 of the content, computed on download and checked on reuse
+    sha256: str
+
+
+class MediaCache:
+    """
+    Media files downloaded from the api, kept on local disk under an LRU
+    quota and reused by later jobs on the same file.
+
+    Files are identified by name, size and ETag, so a file replaced on the
+    api is downloaded again. Large files are fetched with parallel HTTP
+    Range requests, each part is checked for its length and ETag, and
+    concurrent jobs on the same file share a single download. The sha256 of
+    a file is stored next to it, a reused file whose content no longer
+    matches it is downloaded again. Files are pinned in the disk cache while
+    jobs use them, against eviction by any process sharing it.
+    """
+
+    def __init__(
+            self,
+            root: Path,
+            max_bytes: int,
+            api_url: str,
+            part_size: int = 16 * 2**20,
+            parallelism: int = 4,
+            buffer_size: int = 2**20,
+            timeout: float = 60):
+        self.logger = logging.getLogger(__name__)
+        self.cache = DiskCache(root, max_bytes)
+        self.api_url = api_url
+        self.part_size = part_size
+        self.parallelism = parallelism
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max(parallelism, 10))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def _url(self, filename: str) -> str:
+        return f'{self.api_url}/file/{quote(filename)}'
+
+    def _head(self, filename: str):
+        response = self.session.head(self._url(filename), timeout=self.timeout)
+        if response.status_code != 200:
+            raise MediaCacheException(f"failed to get {filename}: status {response.status_code}")
+        size = int(response.headers.get("Content-Length", -1))
+        etag = response.headers.get("ETag", "")
+        ranges = response.headers.get("Accept-Ranges") == "bytes"
+        return size, etag, ranges
+
+    def _check_etag(self, filename: str, response, etag: str) -> None:
+        if etag and response.headers.get("ETag", etag) != etag:
+            raise MediaCacheException(f"{filename} changed during download")
+
+    def _download_part(self, filename: str, fd: int, start: int, end: int, etag: str) -> None:
+        response = self.session.get(
+            self._url(filename), headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=self.timeout)
+        with response:
+            if response.status_code != 206:
+                raise MediaCacheException(f"range request on {filename} failed: status {response.status_code}")
+            self._check_etag(filename, response, etag)
+            offset = start
+            for chunk in response.iter_content(chunk_size=self.buffer_size):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        if offset != end + 1:
+            raise MediaCacheException(f"short read on {filename}: bytes {start}-{offset - 1} of {start}-{end}")
+
+    def _download(self, filename: str, dest: Path, size: int, etag: str, ranges: bool) -> None:
+        fd = os.open(dest, os.O_WRONLY)
+        try:
+            if ranges and size > self.part_size and self.parallelism > 1:
+                os.ftruncate(fd, size)
+                parts = [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+                with ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix='download') as executor:
+                    futures = [executor.submit(self._download_part, filename, fd, *part, etag) for part in parts]
+                    for future in futures:
+                        future.result()
+                return
+
+            response = self.session.get(self._url(filename), stream=True, timeout=self.timeout)
+            with response:
+                if response.status_code != 200:
+                    raise MediaCacheException(f"failed to download {filename}: status {response.status_code}")
+                self._check_etag(filename, response, etag)
+                written = 0
+                for chunk in response.iter_content(chunk_size=self.buffer_size):
+                    written += os.write(fd, chunk)
+            if size >= 0 and written != size:
+                raise MediaCacheException(f"short read on {filename}: {written} of {size} bytes")
+        finally:
+            os.close(fd)
+
+    def _fetch(self, filename: str) -> CachedMedia:
+        size, etag, ranges = self._head(filename)
+        key = params_hash(filename, size, etag) + Path(filename).suffix.lower()
+        sha256_key = f'{key}.sha256'
+
+        # pinned for the caller, until release
+        path = self.cache.get(key)
+        if path is not None and self.cache.pin(key):
+            sha256_path = self.cache.get(sha256_key)
+            if size >= 0 and path.stat().st_size != size:
+                self.logger.warning(f"cached {filename} is truncated, downloading it again")
+            elif sha256_path is not None and file_hash(path) != sha256_path.read_text():
+                self.logger.warning(f"cached {filename} does not match its sha256, downloading it again")
+            else:
+                self.hits += 1
+                if sha256_path is None:
+                    sha256 = file_hash(path)
+                    self.cache.put_bytes(sha256_key, sha256.encode())
+                else:
+                    sha256 = sha256_path.read_text()
+                return CachedMedia(key, path, size, sha256)
+            self.cache.unpin(key)
+            self.cache.delete(key)
+
+        self.misses += 1
+        tmp_path = self.cache.tmp_file(suffix=Path(filename).suffix)
+        try:
+            self._download(filename, tmp_path, size, etag, ranges)
+            sha256 = file_hash(tmp_path)
+            path = self.cache.put_file(key, tmp_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        self.cache.put_bytes(sha256_key, sha256.encode())
+        if not self.cache.pin(key):
+            raise MediaCacheException(f"{filename} was evicted as soon as it was downloaded")
+        return CachedMedia(key, path, path.stat().st_size, sha256)
+
+    def acquire(self, filename: str) -> CachedMedia:
+        """
+        Returns the local copy of filename, downloading it if needed. The file
+        is not evicted until released.
+        """
+        with self._lock:
+            future = self._inflight.get(filename)
+            leader = future is None
+            if leader:
+                future = self._inflight[filename] = Future()
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                future.set_result(self._fetch(filename))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._inflight[filename]
+
+        try:
+            media = future.result()
+        except requests.RequestException as e:
+            raise MediaCacheException(f"failed to download {filename}: {e}")
+        if not leader and not self.cache.pin(media.key):
+            # released and evicted since the shared download
+            return self.acquire(filename)
+        return media
+
+    def release(self, media: Optional[CachedMedia]) -> None:
+        if media is None:
+            return
+        self.cache.unpin(media.key)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "shared": self.shared, "size": self.cache.size}
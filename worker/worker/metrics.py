@@ -0,0 +1,94 @@
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import List
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from model_cache import current_rss
+
+STAGE_SECONDS = Histogram(
+    "mais_stage_seconds", "Wall time of a pipeline stage", ["stage"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+STAGE_CPU_SECONDS = Counter(
+    "mais_stage_cpu_seconds", "Process cpu time spent in a pipeline stage", ["stage"])
+STAGE_AUDIO_SECONDS = Counter(
+    "mais_stage_audio_seconds", "Seconds of audio processed by a pipeline stage", ["stage"])
+STAGE_REAL_TIME_FACTOR = Histogram(
+    "mais_stage_real_time_factor", "Wall time over audio duration of a pipeline stage", ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+STAGE_PEAK_RSS = Histogram(
+    "mais_stage_peak_rss_bytes", "Peak resident memory of the worker during a pipeline stage", ["stage"],
+    buckets=tuple(2**i * 2**20 for i in range(7, 16)))
+JOBS = Counter("mais_jobs", "Jobs processed by the worker", ["status"])
+PIPELINE_QUEUED = Gauge("mais_pipeline_queued_jobs", "Jobs waiting for a stage of the worker pipeline", ["stage"])
+PIPELINE_BUSY = Gauge("mais_pipeline_busy_jobs", "Jobs being processed by a stage of the worker pipeline", ["stage"])
+
+
+def _max_rss() -> int:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass
+class StageSpan:
+    stage: str
+    start: float
+    wall_seconds: float = 0.0
+    # cpu time of the whole process, including the other jobs running at the
+    # same time
+    cpu_seconds: float = 0.0
+    peak_rss: int = 0
+    audio_seconds: float = 0.0
+    real_time_factor: float = None
+
+
+class JobMetrics:
+    """Spans of the pipeline stages of a job."""
+
+    def __init__(self):
+        self.spans: List[StageSpan] = []
+
+    @contextmanager
+    def span(self, stage: str, audio_seconds: float = 0.0):
+        """
+        Measures the enclosed block as a stage. The yielded span may be
+        updated in the block, e.g. with the audio seconds once known.
+        """
+        span = StageSpan(stage=stage, start=time.time(), audio_seconds=audio_seconds)
+        max_rss_before = _max_rss()
+        rss_before = current_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield span
+        finally:
+            span.wall_seconds = round(time.perf_counter() - wall_start, 4)
+            span.cpu_seconds = round(time.process_time() - cpu_start, 4)
+            max_rss_after = _max_rss()
+            # the process peak is exact when reached during the stage, sampled
+            # at the boundaries of the stage otherwise
+            span.peak_rss = max_rss_after if max_rss_after > max_rss_before else max(rss_before, current_rss())
+            if span.audio_seconds:
+                span.audio_seconds = round(span.audio_seconds, 3)
+                span.real_time_factor = round(span.wall_seconds / span.audio_seconds, 4)
+            self.spans.append(span)
+            observe(span)
+
+    def to_list(self) -> List[dict]:
+        return [asdict(span) for span in self.spans]
+
+
+def observe(span: StageSpan) -> None:
+    STAGE_SECONDS.labels(span.stage).observe(span.wall_seconds)
+    STAGE_CPU_SECONDS.labels(span.stage).inc(span.cpu_seconds)
+    STAGE_PEAK_RSS.labels(span.stage).observe(span.peak_rss)
+    if span.audio_seconds:
+        STAGE_AUDIO_SECONDS.labels(span.stage).inc(span.audio_seconds)
+        STAGE_REAL_TIME_FACTOR.labels(span.stage).observe(span.real_time_factor)
+
+
+def start_metrics_server(port: int) -> None:
+    """Serves the metrics in the prometheus text format on /metrics."""
+    start_http_server(port)
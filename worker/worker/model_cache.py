@@ -0,0 +1,250 @@
+import gc
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Union
+
+import torch
+
+
+class ModelCacheException(Exception):
+    pass
+
+
+def current_rss() -> int:
+    """Resident set size of the current process in bytes, 0 if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def files_size(path: Path) -> int:
+    """Bytes of the files under path, e.g. the weights of a model kept on disk."""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def whisper_files_size(model_size: str) -> int:
+    """Bytes of the ctranslate2 weights of a whisper model, 0 if they are not on disk yet."""
+    from faster_whisper.utils import download_model
+
+    try:
+        path = model_size if os.path.isdir(model_size) else download_model(model_size, local_files_only=True)
+        return files_size(path)
+    except Exception:
+        return 0
+
+
+def model_size(model: Any, depth: int = 3) -> int:
+    """
+    Bytes of the torch parameters and buffers reachable from model through
+    containers and attributes, up to depth levels down. 0 for models keeping
+    their weights elsewhere, e.g. ctranslate2.
+    """
+    tensors = {}
+    seen = set()
+
+    def visit(obj, level):
+        if level < 0 or id(obj) in seen:
+            return
+        seen.add(id(obj))
+        if isinstance(obj, torch.nn.Module):
+            # shared weights are counted once
+            for tensor in itertools.chain(obj.parameters(), obj.buffers()):
+                tensors[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+            return
+        if isinstance(obj, dict):
+            children = obj.values()
+        elif isinstance(obj, (list, tuple)):
+            children = obj
+        elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+            children = vars(obj).values()
+        else:
+            return
+        for child in children:
+            visit(child, level - 1)
+
+    visit(model, depth)
+    return sum(tensors.values())
+
+
+# bytes, or a callable returning them once the model is loaded
+SizeHint = Union[int, Callable[[], int]]
+
+
+class _CacheEntry:
+    def __init__(self, model: Any, size: int):
+        self.model = model
+        self.size = size
+        self.users = 0
+        # serializes callers of models that keep per-call state (e.g. the
+        # whisperx pipeline swaps its tokenizer inside transcribe)
+        self.lock = threading.Lock()
+
+
+class ModelCache:
+    """
+    Process-wide registry of loaded models, shared across jobs.
+
+    Models are looked up by a hashable key, e.g.
+    ("whisper", model_size, device, compute_type, language), and loaded on
+    first use through the given loader. Least recently used models are
+    evicted when the size of the cached models exceeds memory_budget bytes;
+    models currently in use are never evicted.
+    """
+
+    def __init__(self, memory_budget: int = 0, max_entries: int = 0):
+        self.logger = logging.getLogger(__name__)
+
+        self.memory_budget = memory_budget
+        self.max_entries = max_entries
+
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # a model is loaded once, different models load concurrently
+        self._load_locks: Dict[Hashable, threading.Lock] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def memory_used(self) -> int:
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def _lookup(self, key: Hashable) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.users += 1
+            return entry
+
+    def _load_lock(self, key: Hashable) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def _acquire(self, key: Hashable, loader: Callable[[], Any], size_hint: SizeHint = 0) -> _CacheEntry:
+        entry = self._lookup(key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        with self._load_lock(key):
+            # another job may have loaded the model while we were waiting
+            entry = self._lookup(key)
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                return entry
+
+            self.logger.info(f"loading model {key}")
+            rss_before = current_rss()
+            try:
+                model = loader()
+            except Exception as e:
+                raise ModelCacheException(f"failed to load model {key}: {e}")
+            rss_delta = current_rss() - rss_before
+            size = max(model_size(model), size_hint() if callable(size_hint) else size_hint)
+            if not size:
+                # approximate, it includes what other threads allocated meanwhile
+                size = max(rss_delta, 0)
+
+            entry = _CacheEntry(model, size)
+            entry.users = 1
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = entry
+                evicted = self._evict()
+            if evicted:
+                self._free_memory()
+            self.logger.info(f"loaded model {key} ({size / 2**20:.0f} MB)")
+            return entry
+
+    def _release(self, entry: _CacheEntry) -> None:
+        with self._lock:
+            entry.users -= 1
+            evicted = self._evict()
+        if evicted:
+            self._free_memory()
+
+    def _evict(self) -> bool:
+        # must be called with self._lock held, returns whether a model was
+        # evicted; _free_memory is then called once the lock is released
+        def over_budget():
+            used = sum(e.size for e in self._entries.values())
+            return (self.memory_budget and used > self.memory_budget) or \
+                (self.max_entries and len(self._entries) > self.max_entries)
+
+        evicted = False
+        for key in list(self._entries.keys()):
+            if not over_budget():
+                break
+            if self._entries[key].users > 0:
+                continue
+            self.logger.info(f"evicting model {key}")
+            del self._entries[key]
+            # unless a load of the same model is waiting on it
+            load_lock = self._load_locks.get(key)
+            if load_lock is not None and not load_lock.locked():
+                del self._load_locks[key]
+            self.evictions += 1
+            evicted = True
+        return evicted
+
+    @staticmethod
+    def _free_memory() -> None:
+        # outside of the cache lock, collecting can take a while
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def get(self, key: Hashable, loader: Callable[[], Any], size_hint: SizeHint = 0) -> Any:
+        """Returns the cached model for key, loading it on a miss."""
+        entry = self._acquire(key, loader, size_hint)
+        self._release(entry)
+        return entry.model
+
+    @contextmanager
+    def use(self, key: Hashable, loader: Callable[[], Any], size_hint: SizeHint = 0, exclusive: bool = False):
+        """
+        Yields the cached model for key and pins it against eviction for the
+        duration of the block. With exclusive=True concurrent users of the same
+        model are serialized. A model is sized by its torch parameters, or by
+        size_hint (bytes, or a callable run after loading) when larger.
+        """
+        entry = self._acquire(key, loader, size_hint)
+        try:
+            if exclusive:
+                with entry.lock:
+                    yield entry.model
+            else:
+                yield entry.model
+        finally:
+            self._release(entry)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "memory_used": sum(e.size for e in self._entries.values()),
+                "memory_budget": self.memory_budget,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        gc.collect()
@@ -0,0 +1,144 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+from metrics import PIPELINE_BUSY, PIPELINE_QUEUED
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[Any], None]
+    # items processed at the same time by the stage
+    concurrency: int = 1
+    # items waiting for the stage, a full queue blocks the previous stage
+    capacity: int = 1
+    # run even for items that failed or finished early, e.g. to publish them
+    always: bool = False
+
+
+class PipelineItem:
+    """
+    Unit of work going through the stages. A stage sets done to skip the
+    following ones, an exception raised by a stage is kept in error and
+    skips them too; only the stages marked always still run.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.error = None
+
+
+class _StageRunner:
+    def __init__(self, stage: Stage):
+        self.stage = stage
+        self.queue = queue.Queue(maxsize=max(stage.capacity, 1))
+        self.busy = 0
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+
+
+class StagedPipeline:
+    """
+    Runs items through a fixed sequence of stages, each with its own bounded
+    queue and worker threads, so that different items are in different
+    stages at the same time. A stage that falls behind fills its queue and
+    holds back the stages before it, throughput is set by the slowest stage
+    and the number of items in flight stays bounded.
+    """
+
+    def __init__(self, stages: List[Stage], on_done: Callable[[PipelineItem], None] = None):
+        self.logger = logging.getLogger(__name__)
+        self.on_done = on_done
+        self._runners = [_StageRunner(stage) for stage in stages]
+        self._threads = []
+        self.started = time.monotonic()
+
+    @property
+    def capacity(self) -> int:
+        """Items in flight when every stage is busy and every queue is full."""
+        return sum(max(r.stage.concurrency, 1) + r.queue.maxsize for r in self._runners)
+
+    def start(self) -> None:
+        for i, runner in enumerate(self._runners):
+            for n in range(max(runner.stage.concurrency, 1)):
+                thread = threading.Thread(
+                    target=self._work, args=(i,), name=f'stage-{runner.stage.name}-{n}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, item: PipelineItem, timeout: float = None) -> bool:
+        """Queues item for the first stage, returns False if its queue stayed full for timeout seconds."""
+        try:
+            self._runners[0].queue.put(item, timeout=timeout)
+        except queue.Full:
+            return False
+        PIPELINE_QUEUED.labels(self._runners[0].stage.name).inc()
+        return True
+
+    def run(self, item: PipelineItem) -> None:
+        """Runs item through all the stages in the calling thread."""
+        for runner in self._runners:
+            self._process(runner, item)
+        self._finish(item)
+
+    def _process(self, runner: _StageRunner, item: PipelineItem) -> None:
+        stage = runner.stage
+        if (item.done or item.error is not None) and not stage.always:
+            return
+        with runner.lock:
+            runner.busy += 1
+        PIPELINE_BUSY.labels(stage.name).inc()
+        start = time.perf_counter()
+        try:
+            stage.run(item)
+        except Exception as e:
+            self.logger.exception(f"stage {stage.name} failed")
+            if item.error is None:
+                item.error = e
+        finally:
+            PIPELINE_BUSY.labels(stage.name).dec()
+            with runner.lock:
+                runner.busy -= 1
+                runner.processed += 1
+                runner.busy_seconds += time.perf_counter() - start
+
+    def _finish(self, item: PipelineItem) -> None:
+        if self.on_done:
+            try:
+                self.on_done(item)
+            except Exception:
+                self.logger.exception("pipeline completion callback failed")
+
+    def _work(self, index: int) -> None:
+        runner = self._runners[index]
+        while True:
+            item = runner.queue.get()
+            PIPELINE_QUEUED.labels(runner.stage.name).dec()
+            self._process(runner, item)
+            if index + 1 < len(self._runners):
+                following = self._runners[index + 1]
+                # blocks while the next stage is behind
+                following.queue.put(item)
+                PIPELINE_QUEUED.labels(following.stage.name).inc()
+            else:
+                self._finish(item)
+
+    def stats(self) -> Dict[str, dict]:
+        elapsed = time.monotonic() - self.started
+        stats = {}
+        for runner in self._runners:
+            with runner.lock:
+                stats[runner.stage.name] = {
+                    "queued": runner.queue.qsize(),
+                    "busy": runner.busy,
+                    "processed": runner.processed,
+                    # fraction of the stage threads kept busy since the start
+                    "utilization": round(
+                        runner.busy_seconds / (elapsed * max(runner.stage.concurrency, 1)), 3) if elapsed else 0.0,
+                }
+        return stats
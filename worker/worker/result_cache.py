@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import redis
+
+from content_hash import params_hash
+from disk_cache import DiskCache
+
+# bump when the pipeline changes in a way that invalidates cached results
+RESULT_CACHE_VERSION = 1
+
+
+def normalize_job_config(
+        model_size="tiny",
+        language=None,
+        subtitles_frequency=5,
+        speaker_detection=False,
+        **kwargs) -> dict:
+    """Job config fields that affect the transcription, in canonical form."""
+    return {
+        "model_size": str(model_size).strip().lower(),
+        "language": str(language).strip().lower() if language else None,
+        "subtitles_frequency": int(subtitles_frequency),
+        "speaker_detection": bool(speaker_detection),
+    }
+
+
+def result_key(media_hash: str, job_config: dict, **pipeline_params) -> str:
+    return params_hash(
+        RESULT_CACHE_VERSION, media_hash, **normalize_job_config(**job_config), **pipeline_params)
+
+
+class ResultCache(ABC):
+    """Transcription results addressed by media content and job config."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def _count(self, hit: bool) -> None:
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, result: dict) -> None:
+        pass
+
+    def get(self, key: str) -> Optional[dict]:
+        result = self._get(key)
+        self._count(result is not None)
+        return result
+
+    @property
+    def hit_rate(self) -> float:
+        with self._counter_lock:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hit_rate, 4)}
+
+
+class DiskResultCache(ResultCache):
+    def __init__(self, root: Path, max_bytes: int):
+        super().__init__()
+        self.cache = DiskCache(root, max_bytes)
+
+    def _get(self, key: str) -> Optional[dict]:
+        path = self.cache.get(key)
+        if not path:
+            return None
+        try:
+            return json.loads(path.read_bytes())
+        except (OSError, ValueError):
+            # evicted by another process or partially written
+            return None
+
+    def put(self, key: str, result: dict) -> None:
+        self.cache.put_bytes(key, json.dumps(result, separators=(',', ':')).encode())
+
+
+class RedisResultCache(ResultCache):
+    """
+    Results stored as redis strings, shared by all workers. A sorted set of
+    last access times and a size hash bound the total size of the cache.
+    """
+
+    def __init__(self, r: redis.Redis, max_bytes: int, prefix: str = "result"):
+        super().__init__()
+        self.r = r
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.lru_key = f'{prefix}:lru'
+        self.sizes_key = f'{prefix}:sizes'
+
+    def _get(self, key: str) -> Optional[dict]:
+        data = self.r.get(f'{self.prefix}:{key}')
+        if data is None:
+            return None
+        self.r.zadd(self.lru_key, {key: time.time()}, xx=True)
+        return json.loads(data)
+
+    def put(self, key: str, result: dict) -> None:
+        data = json.dumps(result, separators=(',', ':')).encode()
+        pipe = self.r.pipeline()
+        pipe.set(f'{self.prefix}:{key}', data)
+        pipe.zadd(self.lru_key, {key: time.time()})
+        pipe.hset(self.sizes_key, key, len(data))
+        pipe.execute()
+        self._evict()
+
+    def _evict(self) -> None:
+        if not self.max_bytes:
+            return
+        sizes = {k.decode(): int(v) for k, v in self.r.hgetall(self.sizes_key).items()}
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        for key in self.r.zrange(self.lru_key, 0, -1):
+            if total <= self.max_bytes:
+                break
+            key = key.decode()
+            pipe = self.r.pipeline()
+            pipe.delete(f'{self.prefix}:{key}')
+            pipe.zrem(self.lru_key, key)
+            pipe.hdel(self.sizes_key, key)
+            pipe.execute()
+            total -= sizes.get(key, 0)
+
+
+def create_result_cache(backend: str, r: redis.Redis, root: Path, max_bytes: int) -> Optional[ResultCache]:
+    if backend == "disk":
+        return DiskResultCache(root, max_bytes)
+    if backend == "redis":
+        return RedisResultCache(r, max_bytes)
+    return None
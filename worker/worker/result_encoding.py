@@ -0,0 +1,40 @@
+from typing import List
+
+# Results published in redis keep each word once, inside its segment, as a
+# row of WORD_FIELDS instead of an object repeated in word_segments. The api
+# expands them back to the json schema when it serves the job.
+RESULT_ENCODING = "compact-v1"
+WORD_FIELDS = ("word", "start", "end", "score", "speaker")
+
+
+def encode_words(words: List[dict]) -> List[list]:
+    rows = []
+    for word in words:
+        row = [word.get(field) for field in WORD_FIELDS]
+        # the speaker is only set by diarization
+        if row[-1] is None:
+            row.pop()
+        rows.append(row)
+    return rows
+
+
+def encode_segments(segments: List[dict]) -> List[dict]:
+    encoded = []
+    for segment in segments:
+        segment = dict(segment)
+        if segment.get("words") is not None:
+            segment["words"] = encode_words(segment["words"])
+        encoded.append(segment)
+    return encoded
+
+
+def encode_result(result: dict) -> dict:
+    return {
+        "encoding": RESULT_ENCODING,
+        "segments": encode_segments(result.get("segments", [])),
+        "language": result.get("language"),
+    }
+
+
+def empty_result() -> dict:
+    return {"encoding": RESULT_ENCODING, "segments": [], "language": None}
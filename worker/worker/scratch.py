@@ -0,0 +1,131 @@
+import logging
+import os
+import shutil
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+# float32 pcm written per second of media: the decoded track at the demucs
+# rate plus the vocals at the whisper rate, or the decoded track alone
+SEPARATION_BYTES_PER_SECOND = 44100 * 2 * 4 + 16000 * 4
+DECODE_BYTES_PER_SECOND = 16000 * 4
+
+
+class ScratchException(Exception):
+    pass
+
+
+def estimate_scratch_bytes(duration: float, separate_vocals: bool = True) -> int:
+    """Upper bound of the scratch space used by a job on duration seconds of media."""
+    rate = SEPARATION_BYTES_PER_SECOND if separate_vocals else DECODE_BYTES_PER_SECOND
+    return int(duration * rate)
+
+
+def free_bytes(path: Path) -> int:
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return 0
+    return st.f_bavail * st.f_frsize
+
+
+@dataclass
+class ScratchDir:
+    job_id: str
+    path: Path
+    reserved: int
+    tmpfs: bool
+
+
+class ScratchSpace:
+    """
+    Owns the per-job scratch directories of a worker.
+
+    A job reserves its estimated scratch size before it starts, and waits
+    while the reservations of the running jobs would exceed quota bytes. Jobs
+    that fit in what is left of tmpfs_quota get a directory on tmpfs_root,
+    the others on disk_root. Directories are deleted when released, and those
+    left over by a previous run of the same worker at start.
+    """
+
+    def __init__(
+            self,
+            disk_root: Path,
+            quota: int,
+            tmpfs_root: Optional[Path] = None,
+            tmpfs_quota: int = 0):
+        self.logger = logging.getLogger(__name__)
+        self.disk_root = Path(disk_root)
+        self.tmpfs_root = Path(tmpfs_root) if tmpfs_root else None
+        self.quota = quota
+        self.tmpfs_quota = tmpfs_quota
+
+        self._cond = threading.Condition()
+        self._reserved = 0
+        self._tmpfs_reserved = 0
+        self._jobs = {}
+
+        for root in (self.disk_root, self.tmpfs_root):
+            if root is not None:
+                self._clean(root)
+        if self.tmpfs_root is not None:
+            # never plan for more than the tmpfs can hold
+            self.tmpfs_quota = min(self.tmpfs_quota, free_bytes(self.tmpfs_root))
+
+    def _clean(self, root: Path) -> None:
+        if root.exists():
+            for path in root.iterdir():
+                self.logger.info(f"removing leftover scratch directory {path}")
+                self._rmtree(path)
+        os.makedirs(root, exist_ok=True)
+
+    def _rmtree(self, path: Path) -> None:
+        shutil.rmtree(path, onerror=lambda func, path, exc_info: self.logger.warning(
+            f"Error occurred while deleting {path}: {exc_info[1]}"))
+
+    def _fits(self, size: int) -> bool:
+        # a job larger than the whole quota is admitted once nothing else runs
+        return not self._jobs or self._reserved + size <= self.quota
+
+    def wait_for_space(self, timeout: Optional[float] = None) -> bool:
+        """Blocks while the quota is used up, returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.quota or self._reserved < self.quota, timeout)
+
+    def acquire(self, job_id: str, size: int, timeout: Optional[float] = None) -> ScratchDir:
+        """Reserves size bytes and creates the scratch directory of job_id."""
+        with self._cond:
+            if self.quota and not self._cond.wait_for(lambda: self._fits(size), timeout):
+                raise ScratchException(f"no scratch space for job {job_id} ({size / 2**20:.0f} MB)")
+            tmpfs = self.tmpfs_root is not None and self._tmpfs_reserved + size <= self.tmpfs_quota
+            self._reserved += size
+            if tmpfs:
+                self._tmpfs_reserved += size
+            root = self.tmpfs_root if tmpfs else self.disk_root
+            scratch_dir = ScratchDir(job_id, root / job_id, size, tmpfs)
+            self._jobs[job_id] = scratch_dir
+
+        os.makedirs(scratch_dir.path, exist_ok=True)
+        self.logger.info(
+            f"scratch directory of job {job_id} on {'tmpfs' if tmpfs else 'disk'}: {scratch_dir.path}")
+        return scratch_dir
+
+    def release(self, scratch_dir: ScratchDir) -> None:
+        self._rmtree(scratch_dir.path)
+        with self._cond:
+            self._jobs.pop(scratch_dir.job_id, None)
+            self._reserved -= scratch_dir.reserved
+            if scratch_dir.tmpfs:
+                self._tmpfs_reserved -= scratch_dir.reserved
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "jobs": len(self._jobs),
+                "reserved": self._reserved,
+                "quota": self.quota,
+                "tmpfs_reserved": self._tmpfs_reserved,
+                "tmpfs_quota": self.tmpfs_quota,
+            }
@@ -0,0 +1,131 @@
+import logging
+import math
+
+import julius
+import numpy as np
+import torch
+from demucs.apply import apply_model
+from demucs.pretrained import get_model
+
+
+class SeparationException(Exception):
+    pass
+
+
+class VocalSeparator:
+    """
+    Keeps a demucs model loaded and extracts the vocals stem from in-memory
+    audio, without writing stems to disk.
+    """
+
+    def __init__(self, model_name: str = "mdx_extra", device: str = "cpu"):
+        self.logger = logging.getLogger(__name__)
+        self.model_name = model_name
+        self.device = device
+
+        try:
+            self.model = get_model(model_name)
+        except Exception as e:
+            raise SeparationException(f"failed to load demucs model {model_name}: {e}")
+        self.model.to(device)
+        self.model.eval()
+
+        if "vocals" not in self.model.sources:
+            raise SeparationException(f"demucs model {model_name} has no vocals stem")
+        self.vocals_index = self.model.sources.index("vocals")
+
+    @property
+    def samplerate(self) -> int:
+        return self.model.samplerate
+
+    @property
+    def audio_channels(self) -> int:
+        return self.model.audio_channels
+
+    def _separate_block(self, block: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            sources = apply_model(self.model, block[None], device=self.device, split=True, progress=False)[0]
+        return sources[self.vocals_index]
+
+    def _normalization(self, wav: torch.Tensor, block_length: int):
+        # same normalization demucs.separate applies to the whole track,
+        # computed block by block so that memory mapped audio is not
+        # materialized at once
+        total, total_sq, count = 0.0, 0.0, 0
+        for start in range(0, wav.shape[-1], block_length):
+            ref = wav[:, start:start + block_length].mean(0, dtype=torch.float64)
+            total += ref.sum().item()
+            total_sq += (ref * ref).sum().item()
+            count += ref.shape[-1]
+        if count == 0:
+            return 0.0, 1.0
+        mean = total / count
+        std = math.sqrt(max(total_sq / count - mean * mean, 0.0) * count / max(count - 1, 1))
+        return mean, std if std > 0 else 1.0
+
+    def separate(
+            self,
+            wav: torch.Tensor,
+            output_samplerate: int = 16000,
+            segment: float = 60.0,
+            overlap: float = 2.0,
+            out: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the vocals of wav, a (channels, samples) tensor at the model
+        samplerate, as mono float32 audio at output_samplerate.
+
+        The track is separated in segments of `segment` seconds overlapping by
+        `overlap` seconds, cross-faded together, so that peak memory depends on
+        the segment length rather than on the track length. segment <= 0
+        separates the whole track at once. The result is written to out if
+        given, e.g. a memory mapped buffer.
+        """
+        if wav.dim() != 2 or wav.shape[0] != self.audio_channels:
+            raise SeparationException(
+                f"expected audio with {self.audio_channels} channels, got shape {tuple(wav.shape)}")
+
+        length = wav.shape[-1]
+        ratio = output_samplerate / self.samplerate
+        output_length = math.ceil(length * ratio)
+        if out is None:
+            out = np.zeros(output_length, dtype=np.float32)
+        elif out.shape[-1] < output_length:
+            raise SeparationException(f"output buffer too small: {out.shape[-1]} < {output_length}")
+
+        if segment <= 0 or segment * self.samplerate >= length:
+            block_length, step = length, length
+        else:
+            block_length = int(segment * self.samplerate)
+            overlap_length = min(int(overlap * self.samplerate), block_length // 2)
+            step = block_length - overlap_length
+
+        mean, std = self._normalization(wav, block_length)
+
+        # output of the previous block overlapping the current one
+        tail = None
+        for start in range(0, length, step):
+            end = min(start + block_length, length)
+            block = (wav[:, start:end] - mean) / std
+
+            vocals = self._separate_block(block) * std + mean
+            vocals = julius.resample_frac(vocals.mean(0), self.samplerate, output_samplerate)
+            vocals = vocals.cpu().numpy()
+
+            out_start = int(start * ratio)
+            vocals = vocals[:output_length - out_start]
+
+            # linear cross-fade with the tail of the previous block
+            if tail is not None:
+                n = min(tail.shape[-1], vocals.shape[-1])
+                fade = np.linspace(0, 1, n + 2, dtype=np.float32)[1:-1]
+                vocals[:n] = tail[:n] * (1 - fade) + vocals[:n] * fade
+
+            if end >= length:
+                out[out_start:out_start + vocals.shape[-1]] = vocals
+                break
+
+            keep = int((start + step) * ratio) - out_start
+            out[out_start:out_start + keep] = vocals[:keep]
+            tail = vocals[keep:]
+
+        return out[:output_length]
@@ -1,12 +1,21 @@
 import logging
-import demucs.separate
-from moviepy import AudioFileClip
+import math
+import numpy as np
 import whisperx
 import torch
 import os
 import uuid
 import time
 from pathlib import Path
+from model_cache import ModelCache, whisper_files_size
+from artifact_cache import ArtifactCache
+from batching import BatchScheduler
+from metrics import JobMetrics
+from content_hash import file_hash, params_hash
+from separation import VocalSeparator
+from voice_activity import SpeechTimeline, detect_speech
+from lyrics import align_lyrics, lyric_lines, predicted_lyrics
+from audio_decoder import SAMPLE_RATE, AudioDecoderException, decode_audio, probe_duration
 
 class SubtitleServiceException(Exception):
     pass
@@ -21,7 +30,23 @@ class SubtitleService:
             hugging_face_token="",
             separate_vocals=True,
             cache_path: Path = Path("/tmp/mais"),
-            captions_path: Path = Path("captions")):
+            captions_path: Path = Path("captions"),
+            model_cache: ModelCache = None,
+            separation_model="mdx_extra",
+            separation_segment: float = 60.0,
+            separation_overlap: float = 2.0,
+            audio_spill_seconds: float = 1200,
+            artifact_cache: ArtifactCache = None,
+            streaming=False,
+            stream_window: float = 120,
+            skip_silence=True,
+            vad_threshold_db: float = -40.0,
+            batch_scheduler: BatchScheduler = None,
+            batch_size=4,
+            compute_type="int8",
+            asr_threads=4,
+            lyrics: str = None,
+            scratch_dir: Path = None):
 
         self.logger = logging.getLogger(__name__)
         self.logger.propagate = False
@@ -32,11 +57,59 @@ class SubtitleService:
         self.speaker_detection = speaker_detection
         self.hugging_face_token = hugging_face_token
         self.separate_vocals = separate_vocals
+        self.separation_model = separation_model
+        self.separation_segment = separation_segment
+        self.separation_overlap = separation_overlap
+        # decoded audio of longer files is memory mapped from cache_path
+        self.audio_spill_seconds = audio_spill_seconds
+
+        if model_cache is None:
+            model_cache = ModelCache()
+        self.model_cache = model_cache
+        # intermediate artifacts are reused across jobs on the same media
+        self.artifact_cache = artifact_cache
+        self.media_hash = None
+        # in streaming mode the audio is processed in windows of stream_window
+        # seconds and segments are reported as soon as they are aligned
+        self.streaming = streaming
+        self.stream_window = stream_window
+        # regions of the vocals stem quieter than vad_threshold_db relative to
+        # the loudest part are not transcribed
+        self.skip_silence = skip_silence
+        self.vad_threshold_db = vad_threshold_db
+        # chunks are decoded in batches shared with the other jobs of the
+        # worker when a scheduler is given
+        self.batch_scheduler = batch_scheduler
+        # inference settings, picked by the worker for the hardware it runs on
+        self.batch_size = batch_size
+        self.compute_type = compute_type
+        self.asr_threads = asr_threads
+        # when the text is known it is aligned to the audio instead of being
+        # transcribed, one segment per line
+        self.lyrics = lyric_lines(lyrics) if lyrics else None
+        # per job figures reported next to the result
+        self.metadata = {}
+        self.metrics = JobMetrics()
+        # state handed from one pipeline stage to the next
+        self._spill = False
+        self._mix = None
+        self._audio = None
+        self._audio_key = None
+        self._timeline = None
+        self._voiced = None
+        self._transcription = None
+        self._transcription_key = None
+        self._result = None
+        self._language = None
+        # (segment, window, window audio, offset) of each segment to realign
+        self._realign_windows = None
 
         self.id = str(uuid.uuid4())
 
-        self.cache_path = cache_path / Path(self.id)
-        os.makedirs(self.cache_path)
+        # temporary files go to scratch_dir when the caller manages one, to a
+        # new directory under cache_path otherwise
+        self.cache_path = scratch_dir or cache_path / Path(self.id)
+        os.makedirs(self.cache_path, exist_ok=True)
 
         self.captions_path = captions_path
         os.makedirs(self.captions_path, exist_ok=True)
@@ -49,102 +122,487 @@ class SubtitleService:
             self.logger.warning("cuda not available, fallback to cpu")
             self.device = "cpu"
 
-    def _extract_audio_from_video(self, video_path: Path):
-        # Create an AudioFileClip object
-        try:
-            audio = AudioFileClip(str(video_path))
-        except Exception as e:
-            raise SubtitleServiceException(f"Failed to extract audio from video: {e}")
+    def _should_spill(self, file_path: Path) -> bool:
+        return self.audio_spill_seconds > 0 and probe_duration(file_path) > self.audio_spill_seconds
+
+    def _lookup(self, key, stage, channels=None):
+        # audio artifacts are stored as raw pcm, the others as json
+        if self.artifact_cache is None or key is None:
+            return None
+        if channels:
+            value = self.artifact_cache.get_audio(key, stage, channels)
+        else:
+            value = self.artifact_cache.get_json(key, stage)
+        if value is not None:
+            self.logger.info(f"{stage} loaded from artifact cache")
+        return value
 
-        audio_file_path = self.cache_path / f'{video_path.stem}.mp3'
+    def _store(self, key, value, channels=None):
+        if self.artifact_cache is None or key is None:
+            return
+        if channels:
+            self.artifact_cache.put_audio(key, value)
+        else:
+            self.artifact_cache.put_json(key, value)
 
-        # Write the audio to an .mp3 file
-        audio.write_audiofile(audio_file_path)
+    def _cached(self, key, stage, compute, channels=None):
+        # looks up a stage artifact, computing and storing it on a miss
+        value = self._lookup(key, stage, channels)
+        if value is None:
+            value = compute()
+            self._store(key, value, channels)
+        return value
 
-        return audio_file_path
+    def _stage_key(self, input_key, stage, **params):
+        if self.artifact_cache is None or input_key is None:
+            return None
+        return self.artifact_cache.key(input_key, stage, **params)
 
-    def _extract_vocals_from_audio(self, audio_path: Path):
-        model_name = "mdx_extra"
-        demucs.separate.main(["--mp3", "--two-stems", "vocals", "-n", model_name, str(audio_path)])
-        # TODO: use demucs api https://github.com/adefossez/demucs/blob/main/docs/api.md for greater control
-        vocals_file_path = self.cache_path / 'vocals.mp3'
-        
-        Path(Path("separated") / model_name / Path(audio_path.stem) / 'vocals.mp3').rename(vocals_file_path)
+    def _extract_audio_from_video(self, video_path: Path, sample_rate=SAMPLE_RATE, channels=1, spill=False):
+        def decode():
+            spill_path = self.cache_path / f'{video_path.stem}.{sample_rate}.{channels}.f32' if spill else None
+            with self.metrics.span("decode") as span:
+                try:
+                    audio = decode_audio(video_path, sample_rate, channels, spill_path)
+                except AudioDecoderException as e:
+                    raise SubtitleServiceException(f"Failed to extract audio from video: {e}")
+                span.audio_seconds = audio.shape[-1] / sample_rate
+            return audio
 
-        return vocals_file_path
+        key = self._stage_key(self.media_hash, "audio", sample_rate=sample_rate, channels=channels)
+        audio = self._cached(key, "audio", decode, channels=channels)
+        return audio, key
 
-    def generate_subtitles(self, file_path: Path):
-        # Extract audio from video
-        self.logger.info("extracting audio from video")
-        raw_audio_path = self._extract_audio_from_video(file_path)
+    def _separator(self):
+        separation_key = ("demucs", self.separation_model, self.device, None, None)
+        return self.model_cache.use(
+            separation_key,
+            lambda: VocalSeparator(self.separation_model, self.device))
 
-        # Extract vocals from audio
-        self.logger.info("extracting vocals from audio")
-        audio_path = self._extract_vocals_from_audio(raw_audio_path)
+    def _whisper(self, exclusive=False):
+        model_key = ("whisper", self.model_size, self.device, self.compute_type, self.language)
+        return model_key, self.model_cache.use(
+            model_key,
+            lambda: whisperx.load_model(
+                self.model_size,
+                self.device,
+                compute_type=self.compute_type,
+                language=self.language,
+                threads=self.asr_threads),
+            size_hint=lambda: whisper_files_size(self.model_size),
+            exclusive=exclusive)
 
-        batch_size = 4  # reduce if low on GPU mem
-        # default to "float16", change to "int8" if low on GPU mem (may reduce
-        # accuracy)
-        compute_type = "int8"
+    def _alignment_model(self, language):
+        align_key = ("align", None, self.device, None, language)
+        return self.model_cache.use(
+            align_key,
+            lambda: whisperx.load_align_model(language_code=language, device=self.device))
+
+    def _diarization_model(self):
+        diarize_key = ("diarize", None, self.device, None, None)
+        return self.model_cache.use(
+            diarize_key,
+            lambda: whisperx.DiarizationPipeline(use_auth_token=self.hugging_face_token, device=self.device),
+            exclusive=True)
+
+    def preload(self, whisper: bool = True):
+        """
+        Loads the models used by jobs with this config into the model cache.
+        whisper=False leaves out the whisper model, whose ctranslate2 threads
+        do not survive a fork.
+        """
+        if self.separate_vocals:
+            with self._separator():
+                pass
+        if whisper:
+            _, whisper_model = self._whisper()
+            with whisper_model:
+                pass
+        if self.language:
+            with self._alignment_model(self.language):
+                pass
+        if self.speaker_detection:
+            with self._diarization_model():
+                pass
+
+    def _vocals_key(self):
+        return self._stage_key(
+            self.media_hash, "vocals",
+            model=self.separation_model,
+            segment=self.separation_segment,
+            overlap=self.separation_overlap,
+            sample_rate=SAMPLE_RATE)
+
+    def _transcribe(self, audio, audio_key=None):
+        batch_size = self.batch_size
+        compute_type = self.compute_type
 
-        # 1. Transcribe with original whisper (batched)
         if not self.language:
             self.language = None
-        model = whisperx.load_model(
-            self.model_size,
-            self.device,
+
+        def transcribe():
+            # the pipeline keeps per-call tokenizer state, concurrent jobs sharing
+            # it must take turns unless the batch scheduler drives the decoding
+            model_key, whisper = self._whisper(exclusive=self.batch_scheduler is None)
+            # the span starts once the model is loaded and held
+            with whisper as model, self.metrics.span("transcribe", audio.shape[-1] / SAMPLE_RATE):
+                if self.batch_scheduler is not None:
+                    return self.batch_scheduler.transcribe(
+                        model_key,
+                        model,
+                        audio,
+                        language=self.language,
+                        chunk_size=self.subtitles_frequency)
+                return model.transcribe(
+                    audio,
+                    batch_size=batch_size,
+                    language=self.language,
+                    chunk_size=self.subtitles_frequency)
+
+        key = self._stage_key(
+            audio_key, "transcription",
+            model_size=self.model_size,
             compute_type=compute_type,
-            language=self.language)
-
-        # save model to local path (optional)
-        # model_dir = "/path/"
-        # model = whisperx.load_model("large-v2", device, compute_type=compute_type, download_root=model_dir)
-        audio = whisperx.load_audio(audio_path)
-        result = model.transcribe(
-            audio,
-            batch_size=batch_size,
             language=self.language,
-            chunk_size=self.subtitles_frequency)
-        self.logger.debug("transcription before alignment: ",
-              result["segments"])
+            chunk_size=self.subtitles_frequency,
+            vad=self._vad_params())
+        result = self._cached(key, "transcription", transcribe)
+        return result, key
 
-        # delete model if low on GPU resources
-        # import gc; gc.collect(); torch.cuda.empty_cache(); del model
+    def _align(self, result, audio, transcription_key=None):
+        def align():
+            with self._alignment_model(result["language"]) as (model_a, metadata), \
+                    self.metrics.span("align", audio.shape[-1] / SAMPLE_RATE):
+                return whisperx.align(
+                    result["segments"],
+                    model_a,
+                    metadata,
+                    audio,
+                    self.device,
+                    return_char_alignments=False)
 
-        # 2. Align whisper output
-        model_a, metadata = whisperx.load_align_model(
-            language_code=result["language"], device=self.device)
-        result_aligned = whisperx.align(
-            result["segments"],
-            model_a,
-            metadata,
-            audio,
-            self.device,
-            return_char_alignments=False)
-
-        self.logger.debug("transcription after alignment: ",
-              result_aligned["segments"])  # after alignment
-
-        # delete model if low on GPU resources
-        # import gc; gc.collect(); torch.cuda.empty_cache(); del model_a
+        key = self._stage_key(transcription_key, "alignment", language=result["language"])
+        return self._cached(key, "alignment", align)
 
-        if self.speaker_detection:
-            # 3. Assign speaker labels
-            diarize_model = whisperx.DiarizationPipeline(
-                use_auth_token=self.hugging_face_token, device=self.device)
+    def _align_lyrics(self, audio):
+        def align():
+            with self._alignment_model(self.language) as (model_a, metadata), \
+                    self.metrics.span("align", audio.shape[-1] / SAMPLE_RATE):
+                return align_lyrics(self.lyrics, audio, model_a, metadata, self.device)
+
+        key = self._stage_key(
+            self._audio_key, "lyrics_alignment",
+            language=self.language,
+            lyrics=params_hash(*self.lyrics),
+            vad=self._vad_params())
+        return self._cached(key, "lyrics_alignment", align)
+
+    def _vad_params(self):
+        # voice activity detection only runs on the separated vocals, on the
+        # full mix music is too loud to tell voiced regions apart
+        if not (self.separate_vocals and self.skip_silence):
+            return None
+        return {"threshold_db": self.vad_threshold_db}
+
+    def _speech_timeline(self, audio):
+        if self._vad_params() is None:
+            return None
+        duration = audio.shape[-1] / SAMPLE_RATE
+        with self.metrics.span("vad", duration):
+            timeline = SpeechTimeline(detect_speech(audio, SAMPLE_RATE, threshold_db=self.vad_threshold_db), duration)
+
+        # accumulated over the windows in streaming mode
+        vad = self.metadata.setdefault("vad", {"speech_seconds": 0.0, "total_seconds": 0.0})
+        vad["speech_seconds"] = round(vad["speech_seconds"] + timeline.speech_seconds, 3)
+        vad["total_seconds"] = round(vad["total_seconds"] + duration, 3)
+        vad["skipped_fraction"] = round(1 - vad["speech_seconds"] / vad["total_seconds"], 4) if vad["total_seconds"] else 0.0
+        self.logger.info(f"skipping {timeline.skipped_fraction:.0%} of {duration:.1f}s without speech")
+        return timeline
+
+    def _transcribe_and_align(self, audio, audio_key=None):
+        """
+        Transcribes and aligns the voiced regions of audio only, laid out back
+        to back, and maps the timestamps back to audio.
+        """
+        self._audio, self._audio_key = audio, audio_key
+        self.transcribe()
+        self.align()
+        return self._result, self._language
 
+    def _diarize(self, result_aligned, audio):
+        with self._diarization_model() as diarize_model, self.metrics.span("diarize", audio.shape[-1] / SAMPLE_RATE):
             # add min/max number of speakers if known
             diarize_segments = diarize_model(audio)
             # diarize_model(audio, min_speakers=min_speakers, max_speakers=max_speakers)
 
-            result_aligned_with_speakers = whisperx.assign_word_speakers(
-                diarize_segments, result_aligned)
-            print("transcription after alignment with speakers: ",
-                  result_aligned_with_speakers["segments"])
-            result_aligned = result_aligned_with_speakers
+        return whisperx.assign_word_speakers(diarize_segments, result_aligned)
+
+    def _extract_window(self, file_path: Path, start: float, duration: float):
+        try:
+            if not self.separate_vocals:
+                with self.metrics.span("decode", duration):
+                    return decode_audio(file_path, SAMPLE_RATE, 1, start=start, duration=duration)
+            with self._separator() as separator:
+                with self.metrics.span("decode", duration):
+                    wav = decode_audio(
+                        file_path, separator.samplerate, separator.audio_channels, start=start, duration=duration)
+                with self.metrics.span("separate", duration):
+                    return separator.separate(
+                        torch.from_numpy(wav),
+                        output_samplerate=SAMPLE_RATE,
+                        segment=self.separation_segment,
+                        overlap=self.separation_overlap)
+        except AudioDecoderException as e:
+            raise SubtitleServiceException(f"Failed to extract audio from video: {e}")
+
+    @staticmethod
+    def _shift_segments(segments, offset: float):
+        for segment in segments:
+            for item in [segment, *segment.get("words", [])]:
+                for k in ("start", "end"):
+                    if item.get(k) is not None:
+                        item[k] = round(item[k] + offset, 3)
+
+    def _generate_subtitles_streaming(self, file_path: Path, on_segments=None):
+        duration = probe_duration(file_path)
+        if not duration:
+            raise SubtitleServiceException(f"Failed to read duration of {file_path}")
+        if self.speaker_detection:
+            # speaker labels would not be consistent across windows
+            self.logger.warning("speaker detection is not supported in streaming mode")
+
+        segments = []
+        language = None
+        start = 0.0
+        while start < duration:
+            end = min(start + self.stream_window, duration)
+            self.logger.info(f"processing window {start:.1f}s - {end:.1f}s of {duration:.1f}s")
+            audio = self._extract_window(file_path, start, end - start)
+
+            result_aligned, window_language = self._transcribe_and_align(audio)
+            language = language or window_language
+            window_segments = result_aligned["segments"]
+
+            # the last segment may be cut by the window boundary, it is
+            # transcribed again as part of the next window
+            next_start = end
+            if end < duration and len(window_segments) > 1 and window_segments[-1]["start"] > 0:
+                next_start = start + window_segments[-1]["start"]
+                window_segments = window_segments[:-1]
+
+            self._shift_segments(window_segments, start)
+            segments += window_segments
+            if on_segments:
+                on_segments(window_segments, min(next_start / duration, 1.0), language)
+            start = next_start
+
+        return {
+            "segments": segments,
+            "word_segments": [word for segment in segments for word in segment.get("words", [])],
+            "language": language,
+        }
+
+    # The stages of generate_subtitles, in order. Each one picks up the state
+    # left by the previous one, so consecutive stages may run in different
+    # threads, e.g. as part of the staged pipeline of the worker.
+
+    def decode(self, file_path: Path, media_hash: str = None):
+        """
+        Decodes the audio track once, every stage works on the same buffer. When
+        vocals are separated the track is decoded at the separation model rate,
+        unless the vocals are in the artifact cache.
+        """
+        if self.artifact_cache is not None and not media_hash:
+            media_hash = file_hash(file_path)
+        self.media_hash = media_hash
+        self._spill = self._should_spill(file_path)
+
+        if not self.separate_vocals:
+            self.logger.info("extracting audio from video")
+            self._audio, self._audio_key = self._extract_audio_from_video(file_path, spill=self._spill)
+            return
+
+        self._audio_key = self._vocals_key()
+        self._audio = self._lookup(self._audio_key, "vocals", channels=1)
+        if self._audio is not None:
+            return
+        self.logger.info("extracting vocals from audio")
+        with self._separator() as separator:
+            samplerate, channels = separator.samplerate, separator.audio_channels
+        self._mix, _ = self._extract_audio_from_video(file_path, samplerate, channels, self._spill)
+
+    def separate(self):
+        """Separates the vocals of the decoded track, they come back at the whisper rate."""
+        if self._mix is None:
+            return
+        with self._separator() as separator:
+            out = None
+            if self._spill:
+                length = math.ceil(self._mix.shape[-1] * SAMPLE_RATE / separator.samplerate)
+                out = np.memmap(self.cache_path / 'vocals.f32', dtype=np.float32, mode='w+', shape=(length,))
+            with self.metrics.span("separate", self._mix.shape[-1] / separator.samplerate):
+                vocals = separator.separate(
+                    torch.from_numpy(self._mix),
+                    output_samplerate=SAMPLE_RATE,
+                    segment=self.separation_segment,
+                    overlap=self.separation_overlap,
+                    out=out)
+        self._mix = None
+        self._store(self._audio_key, vocals, channels=1)
+        self._audio = vocals
+
+    def transcribe(self):
+        """Transcribes the voiced regions of the audio only, laid out back to back."""
+        self._timeline = self._speech_timeline(self._audio)
+        self._voiced = self._audio
+        self._transcription = None
+        self._language = self.language
+        if self.lyrics is not None and not self.language:
+            raise SubtitleServiceException("a language is required to align lyrics")
+        if self._timeline is not None:
+            if not self._timeline.regions:
+                self._voiced = None
+                return
+            self._voiced = self._timeline.compact(self._audio, SAMPLE_RATE)
+        if self.lyrics is not None:
+            # nothing to transcribe, the lines are aligned in the next stage
+            return
+
+        # 1. Transcribe with original whisper (batched)
+        self._transcription, self._transcription_key = self._transcribe(self._voiced, self._audio_key)
+        self._language = self._transcription["language"]
+        self.logger.debug("transcription before alignment: %s", self._transcription["segments"])
+
+    def align(self):
+        """
+        Aligns the transcription, or the lyrics when they are given, and maps
+        the timestamps back to the audio.
+        """
+        # 2. Align whisper output
+        if self.lyrics and self._voiced is None:
+            # nothing voiced, the lines keep the times their length predicts
+            # over the whole audio
+            self._result = predicted_lyrics(self.lyrics, self._audio.shape[-1] / SAMPLE_RATE)
+            self._result.pop("unaligned_lines")
+            self.metadata["lyrics"] = {"lines": len(self.lyrics), "aligned_lines": 0}
+            return
+        if self.lyrics:
+            result_aligned = self._align_lyrics(self._voiced)
+            unaligned = result_aligned.pop("unaligned_lines")
+            self.metadata["lyrics"] = {"lines": len(self.lyrics), "aligned_lines": len(self.lyrics) - unaligned}
+        elif self._transcription and self._transcription["segments"]:
+            result_aligned = self._align(self._transcription, self._voiced, self._transcription_key)
+        else:
+            self._result = {"segments": [], "word_segments": []}
+            return
+        self._voiced = None
+
+        self.logger.debug("transcription after alignment: %s", result_aligned["segments"])
+
+        if self._timeline is not None:
+            # alignment results loaded from the artifact cache do not share the
+            # word dicts between segments and word_segments
+            self._timeline.remap_segments(result_aligned["segments"])
+            result_aligned["word_segments"] = [
+                word for segment in result_aligned["segments"] for word in segment.get("words", [])]
+        self._result = result_aligned
+
+    def diarize(self):
+        """Assigns speaker labels when speaker detection is enabled."""
+        if self.speaker_detection and self._result["segments"]:
+            # 3. Assign speaker labels
+            self._result = self._diarize(self._result, self._audio)
+            self.logger.debug("transcription after alignment with speakers: %s", self._result["segments"])
+
+    def result(self):
+        """The transcription, once all the stages ran. Releases the audio."""
+        self._audio = None
+        self._result["language"] = self._language
+        return self._result
+
+    def generate_subtitles(self, file_path: Path, media_hash: str = None, on_segments=None):
+        """
+        Transcribes file_path. In streaming mode on_segments(segments, progress,
+        language) is called with the aligned segments of each window.
+        """
+        if self.streaming and self.lyrics is None:
+            return self._generate_subtitles_streaming(file_path, on_segments)
+
+        self.decode(file_path, media_hash)
+        self.separate()
+        self.transcribe()
+        self.align()
+        self.diarize()
+        return self.result()
+
+    def _decoded_audio(self):
+        """The audio decoded by an earlier job on the same media, if it is still in the artifact cache."""
+        if self.separate_vocals:
+            return self._lookup(self._vocals_key(), "vocals", channels=1)
+        key = self._stage_key(self.media_hash, "audio", sample_rate=SAMPLE_RATE, channels=1)
+        return self._lookup(key, "audio", channels=1)
+
+    def decode_realign(self, file_path: Path, segments: list, media_hash: str = None, padding: float = 1.0):
+        """
+        First step of realign: the audio of each segment, within its start and
+        end widened by padding seconds and clamped to the media. Works on the
+        audio decoded by the job that transcribed file_path when it is in the
+        artifact cache, decodes only the windows otherwise.
+        """
+        if not self.language:
+            raise SubtitleServiceException("a language is required to align segments")
+        if self.artifact_cache is not None and not media_hash:
+            media_hash = file_hash(file_path)
+        self.media_hash = media_hash
+        audio = self._decoded_audio()
+        duration = audio.shape[-1] / SAMPLE_RATE if audio is not None else probe_duration(file_path)
+        self.metadata["realign"] = {"segments": len(segments), "cached_audio": audio is not None}
+
+        self._realign_windows = []
+        for segment in segments:
+            start, end, text = float(segment["start"]), float(segment["end"]), segment["text"]
+            window_start, window_end = max(start - padding, 0.0), min(end + padding, duration)
+            window = window_audio = None
+            offset = 0.0
+            if end > start and window_end > window_start and text.strip():
+                window, window_audio = {"start": window_start, "end": window_end, "text": text}, audio
+                if audio is None:
+                    window_audio = self._extract_window(file_path, window_start, window_end - window_start)
+                    window, offset = {"start": 0.0, "end": window_end - window_start, "text": text}, window_start
+            self._realign_windows.append(({"start": start, "end": end, "text": text}, window, window_audio, offset))
+
+    def align_realign(self) -> dict:
+        """
+        Second step of realign: aligns the text of each segment in its window.
+        Returns one segment per given segment, in the same order.
+        """
+        realigned = []
+        for segment, window, window_audio, offset in self._realign_windows:
+            words = []
+            if window is not None:
+                with self._alignment_model(self.language) as (model_a, metadata), \
+                        self.metrics.span("align", window["end"] - window["start"]):
+                    aligned = whisperx.align(
+                        [window], model_a, metadata, window_audio, self.device, return_char_alignments=False)
+                self._shift_segments(aligned["segments"], offset)
+                # whisperx splits segments in sentences
+                words = [word for s in aligned["segments"] for word in s.get("words", [])]
+            realigned.append({**segment, "words": words})
+        self._realign_windows = None
+
+        return {
+            "segments": realigned,
+            "word_segments": [word for segment in realigned for word in segment["words"]],
+            "language": self.language,
+        }
 
-        result_aligned["language"] = result["language"]
-        return result_aligned
+    def realign(self, file_path: Path, segments: list, media_hash: str = None, padding: float = 1.0):
+        """
+        Aligns the text of segments again around their start and end, e.g.
+        after the text was edited, without transcribing.
+        """
+        self.decode_realign(file_path, segments, media_hash, padding)
+        return self.align_realign()
 
     def write_subtitle_file(self, file_path: Path, result_aligned):
         with open(file_path, "w") as f:
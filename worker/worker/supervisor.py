@@ -0,0 +1,197 @@
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+PROCESS_UTILIZATION = Gauge(
+    "mais_worker_process_utilization", "Fraction of the job slots of a worker process in use", ["process"])
+PROCESS_RUNNING_JOBS = Gauge(
+    "mais_worker_process_running_jobs", "Jobs running in a worker process", ["process"])
+PROCESS_RESTARTS = Counter(
+    "mais_worker_process_restarts", "Worker processes restarted after exiting", ["process"])
+
+# a process exiting sooner than this after its start is restarted with an
+# increasing delay
+MIN_UPTIME = 60
+
+
+class ProcessStats:
+    """
+    Job counters of a worker process in shared memory, updated by the process
+    and read by the supervisor.
+    """
+
+    def __init__(self, ctx):
+        # slot seconds in use up to the last change, time of the last change,
+        # jobs running since then
+        self._busy = ctx.Array('d', [0.0, time.monotonic(), 0.0])
+        self._jobs = ctx.Value('L', 0, lock=False)
+
+    def _update(self, running: int) -> None:
+        with self._busy.get_lock():
+            now = time.monotonic()
+            self._busy[0] += self._busy[2] * (now - self._busy[1])
+            self._busy[1] = now
+            self._busy[2] += running
+
+    def job_started(self) -> None:
+        self._update(1)
+
+    def job_finished(self) -> None:
+        self._update(-1)
+        with self._busy.get_lock():
+            self._jobs.value += 1
+
+    def clear_running(self) -> None:
+        """Forgets the running jobs, e.g. of a process that died."""
+        with self._busy.get_lock():
+            self._update(-int(self._busy[2]))
+
+    def snapshot(self) -> dict:
+        with self._busy.get_lock():
+            now = time.monotonic()
+            return {
+                "busy_seconds": self._busy[0] + self._busy[2] * (now - self._busy[1]),
+                "running": int(self._busy[2]),
+                "jobs": self._jobs.value,
+            }
+
+
+class _Child:
+    def __init__(self, index: int, stats: ProcessStats):
+        self.index = index
+        self.stats = stats
+        self.process: Optional[multiprocessing.Process] = None
+        self.started = 0.0
+        self.restarts = 0
+        self.restart_delay = 0.0
+        self.restart_at: Optional[float] = None
+        self.sampled_at = time.monotonic()
+        self.sampled_busy = 0.0
+        self.utilization = 0.0
+
+
+class Supervisor:
+    """
+    Runs target(index, stats) in processes forked from the current one.
+
+    Models the parent loaded before run are shared copy-on-write by the
+    children, provided it started no thread, e.g. a torch thread pool or a
+    ctranslate2 model, and did not initialize cuda, none of which survives a
+    fork. Children that exit are restarted with the same index, after a delay that doubles, up to max_restart_delay,
+    while they keep exiting within MIN_UPTIME seconds of their start. The
+    utilization of the slots of each child is sampled every sample_interval
+    seconds.
+    """
+
+    def __init__(
+            self,
+            target: Callable[[int, ProcessStats], None],
+            processes: int,
+            slots: int,
+            restart_delay: float = 1.0,
+            max_restart_delay: float = 60.0,
+            sample_interval: float = 10.0):
+        self.logger = logging.getLogger(__name__)
+        self.target = target
+        self.slots = max(slots, 1)
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.sample_interval = sample_interval
+
+        self._ctx = multiprocessing.get_context("fork")
+        self._children: List[_Child] = [_Child(i, ProcessStats(self._ctx)) for i in range(processes)]
+        self._stopping = False
+
+    def _run_child(self, index: int, stats: ProcessStats) -> None:
+        # forked with the handlers of the supervisor
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        self.target(index, stats)
+
+    def _start(self, child: _Child) -> None:
+        child.process = self._ctx.Process(
+            target=self._run_child, args=(child.index, child.stats), name=f'worker-{child.index}')
+        child.process.start()
+        child.started = time.monotonic()
+        child.restart_at = None
+        self.logger.info(f"started worker process {child.index} (pid {child.process.pid})")
+
+    def _exited(self, child: _Child) -> None:
+        uptime = time.monotonic() - child.started
+        self.logger.warning(
+            f"worker process {child.index} (pid {child.process.pid}) exited with code {child.process.exitcode} "
+            f"after {uptime:.0f}s")
+        child.process.close()
+        child.process = None
+        # the jobs it was running are requeued by the next process on this index
+        child.stats.clear_running()
+        if uptime < MIN_UPTIME:
+            child.restart_delay = min(max(child.restart_delay * 2, self.restart_delay), self.max_restart_delay)
+        else:
+            child.restart_delay = self.restart_delay
+        child.restart_at = time.monotonic() + child.restart_delay
+
+    def _sample(self) -> None:
+        now = time.monotonic()
+        for child in self._children:
+            stats = child.stats.snapshot()
+            elapsed = now - child.sampled_at
+            if elapsed > 0:
+                child.utilization = (stats["busy_seconds"] - child.sampled_busy) / (elapsed * self.slots)
+            child.sampled_at, child.sampled_busy = now, stats["busy_seconds"]
+            PROCESS_UTILIZATION.labels(str(child.index)).set(child.utilization)
+            PROCESS_RUNNING_JOBS.labels(str(child.index)).set(stats["running"])
+
+    def stop(self, *_) -> None:
+        self._stopping = True
+
+    def run(self) -> None:
+        """Starts the children and supervises them until SIGTERM or SIGINT."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for child in self._children:
+            self._start(child)
+        next_sample = time.monotonic() + self.sample_interval
+        try:
+            while not self._stopping:
+                now = time.monotonic()
+                for child in self._children:
+                    if child.process is not None and not child.process.is_alive():
+                        self._exited(child)
+                    if child.process is None and child.restart_at <= now:
+                        child.restarts += 1
+                        PROCESS_RESTARTS.labels(str(child.index)).inc()
+                        self._start(child)
+                if now >= next_sample:
+                    self._sample()
+                    self.logger.info(f"worker processes: {self.stats()}")
+                    next_sample = now + self.sample_interval
+
+                sentinels = [child.process.sentinel for child in self._children if child.process is not None]
+                timeouts = [next_sample] + [child.restart_at for child in self._children if child.process is None]
+                wait(sentinels, timeout=max(min(timeouts) - time.monotonic(), 0))
+        finally:
+            self._shutdown()
+
+    def _shutdown(self) -> None:
+        alive = [child.process for child in self._children if child.process is not None]
+        for process in alive:
+            process.terminate()
+        for process in alive:
+            process.join()
+        self.logger.info("worker processes stopped")
+
+    def stats(self) -> List[Dict]:
+        return [{
+            "index": child.index,
+            "pid": child.process.pid if child.process is not None else None,
+            "restarts": child.restarts,
+            "utilization": round(child.utilization, 3),
+            **child.stats.snapshot(),
+        } for child in self._children]
@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+from model_cache import ModelCache, whisper_files_size
+
+logger = logging.getLogger(__name__)
+
+# compute types tried by the calibration, fastest first on typical hardware
+COMPUTE_TYPE_CANDIDATES = {
+    "cuda": ["float16", "int8_float16", "int8"],
+    "cpu": ["int8", "float32"],
+}
+# rough peak memory of one 30 s chunk in a decoding batch
+CHUNK_MEMORY = 256 * 2**20
+
+
+@dataclass
+class Tuning:
+    device: str
+    cores: int
+    memory: int
+    batch_size: int
+    compute_type: str
+    # intra-op threads of the whisper model and of torch (separation,
+    # alignment, diarization)
+    asr_threads: int
+    torch_threads: int
+    calibrated: bool = False
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory(device: str) -> int:
+    """Free memory of the device in bytes, 0 if unknown."""
+    if device == "cuda":
+        free, _ = torch.cuda.mem_get_info()
+        return free
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def supported_compute_types(device: str) -> List[str]:
+    import ctranslate2
+    supported = ctranslate2.get_supported_compute_types(device)
+    return [t for t in COMPUTE_TYPE_CANDIDATES[device] if t in supported]
+
+
+def _calibration_features(model, n_chunks: int) -> np.ndarray:
+    from whisperx.audio import N_SAMPLES, log_mel_spectrogram
+
+    # low level noise, the same for every candidate
+    audio = np.random.default_rng(0).normal(0, 0.01, N_SAMPLES).astype(np.float32)
+    n_mels = model.model.feat_kwargs.get("feature_size") or 80
+    features = log_mel_spectrogram(audio, n_mels=n_mels).numpy()
+    return np.repeat(features[None], n_chunks, axis=0)
+
+
+def _throughput(model, batch_size: int, repeats: int = 2) -> float:
+    """Chunks per second decoded in batches of batch_size."""
+    from faster_whisper.tokenizer import Tokenizer
+
+    tokenizer = Tokenizer(model.model.hf_tokenizer, model.model.model.is_multilingual, task="transcribe", language="en")
+    features = _calibration_features(model, batch_size)
+    # warm up
+    model.model.generate_segment_batched(features, tokenizer, model.options)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.model.generate_segment_batched(features, tokenizer, model.options)
+    return batch_size * repeats / (time.perf_counter() - start)
+
+
+def calibrate(
+        model_cache: ModelCache,
+        model_size: str,
+        device: str,
+        compute_types: List[str],
+        batch_sizes: List[int],
+        asr_threads: int):
+    """
+    Measures the decoding throughput of model_size for each compute type and
+    batch size. Returns the fastest compute type and the smallest batch size
+    within 10% of the best throughput with it.
+    """
+    import whisperx
+
+    results = {}
+    for compute_type in compute_types:
+        key = ("whisper", model_size, device, compute_type, None)
+        try:
+            with model_cache.use(
+                    key,
+                    lambda: whisperx.load_model(model_size, device, compute_type=compute_type, threads=asr_threads),
+                    size_hint=lambda: whisper_files_size(model_size),
+                    exclusive=True) as model:
+                for batch_size in batch_sizes:
+                    try:
+                        results[(compute_type, batch_size)] = _throughput(model, batch_size)
+                    except RuntimeError as e:
+                        # most likely out of memory, larger batches won't fit either
+                        logger.warning(f"calibration of {compute_type} batch {batch_size} failed: {e}")
+                        break
+                    logger.info(
+                        f"calibration {compute_type} batch {batch_size}: "
+                        f"{results[(compute_type, batch_size)]:.2f} chunks/s")
+        except Exception as e:
+            logger.warning(f"calibration of {compute_type} failed: {e}")
+    if not results:
+        return None, None
+
+    compute_type = max(compute_types, key=lambda t: max(
+        [v for (ct, _), v in results.items() if ct == t], default=0))
+    by_batch = {b: v for (ct, b), v in results.items() if ct == compute_type}
+    best = max(by_batch.values())
+    batch_size = min(b for b, v in by_batch.items() if v >= 0.9 * best)
+    return compute_type, batch_size
+
+
+def tune(
+        model_cache: ModelCache,
+        concurrency: int,
+        shared_decoder: bool = False,
+        calibration_model: Optional[str] = "tiny",
+        batch_size: Optional[int] = None,
+        compute_type: Optional[str] = None,
+        asr_threads: Optional[int] = None,
+        torch_threads: Optional[int] = None,
+        max_batch_size: int = 32,
+        processes: int = 1) -> Tuning:
+    """
+    Picks the inference settings of the worker from the available cores and
+    memory and a short calibration run on calibration_model. Any setting
+    given explicitly is kept as is, calibration_model=None skips calibration.
+
+    Torch threads are split across the concurrent jobs so that the jobs
+    together do not oversubscribe the cores. With shared_decoder the whisper
+    decoding of all jobs runs in a single thread, which gets all the cores.
+    With several worker processes on the host, each gets its share of the
+    cores and memory.
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    cores = available_cores()
+    memory = available_memory(device)
+
+    processes = max(processes, 1)
+    per_process = max(cores // processes, 1)
+    per_job = max(per_process // max(concurrency, 1), 1)
+    torch_threads = torch_threads or per_job
+    asr_threads = asr_threads or (per_process if shared_decoder else per_job)
+
+    # every concurrent job may hold a batch in memory
+    memory_batches = memory // (CHUNK_MEMORY * max(concurrency, 1) * processes) if memory else max_batch_size
+    batch_limit = int(max(1, min(max_batch_size, memory_batches)))
+    batch_sizes = [b for b in (1, 2, 4, 8, 16, 32, 64) if b <= batch_limit]
+
+    calibrated = False
+    if calibration_model and (batch_size is None or compute_type is None):
+        torch.set_num_threads(torch_threads)
+        compute_types = [compute_type] if compute_type else supported_compute_types(device)
+        calibrated_type, calibrated_batch = calibrate(
+            model_cache,
+            calibration_model,
+            device,
+            compute_types,
+            [batch_size] if batch_size else batch_sizes,
+            asr_threads)
+        if calibrated_type:
+            calibrated = True
+            compute_type = compute_type or calibrated_type
+            batch_size = batch_size or calibrated_batch
+
+    tuning = Tuning(
+        device=device,
+        cores=cores,
+        memory=memory,
+        batch_size=batch_size or min(4 if device == "cpu" else 16, batch_limit),
+        compute_type=compute_type or ("int8" if device == "cpu" else "float16"),
+        asr_threads=asr_threads,
+        torch_threads=torch_threads,
+        calibrated=calibrated)
+    apply(tuning)
+    logger.info(f"inference settings: {asdict(tuning)}")
+    return tuning
+
+
+def tune_isolated(**kwargs) -> Tuning:
+    """
+    Same as tune, run by this module as a script in a new interpreter with
+    its own model cache. The calibration models, the torch thread pools and
+    cuda are then never initialized in the calling process, which may still
+    fork safely, and none of the modules of the caller is imported again.
+    """
+    with tempfile.NamedTemporaryFile("r", suffix=".json") as out:
+        subprocess.run([sys.executable, __file__, out.name], input=json.dumps(kwargs), text=True, check=True)
+        return Tuning(**json.load(out))
+
+
+def apply(tuning: Tuning) -> None:
+    torch.set_num_threads(tuning.torch_threads)
+
+
+if __name__ == "__main__":
+    # tune_isolated: the arguments of tune as json on stdin, the settings are
+    # written as json to the file given as argument
+    settings = tune(ModelCache(), **json.load(sys.stdin))
+    with open(sys.argv[1], "w") as f:
+        json.dump(asdict(settings), f)
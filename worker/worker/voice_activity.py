@@ -0,0 +1,111 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+def detect_speech(
+        audio: np.ndarray,
+        sample_rate: int,
+        frame: float = 0.03,
+        threshold_db: float = -40.0,
+        min_speech: float = 0.25,
+        min_silence: float = 0.6,
+        pad: float = 0.2) -> List[Tuple[float, float]]:
+    """
+    Energy based voice activity detection, meant for a separated vocals stem
+    where instrumental and silent parts are close to silence.
+
+    Frames louder than threshold_db relative to the loudest frame are voiced.
+    Returns the (start, end) seconds of the voiced regions, with gaps shorter
+    than min_silence merged, regions shorter than min_speech dropped and the
+    remaining ones padded by pad seconds.
+    """
+    frame_length = max(int(frame * sample_rate), 1)
+    n_frames = audio.shape[-1] // frame_length
+    if n_frames == 0:
+        return []
+
+    frames = np.asarray(audio[:n_frames * frame_length]).reshape(n_frames, frame_length)
+    energy = np.einsum('ij,ij->i', frames, frames) / frame_length
+    db = 10 * np.log10(energy + 1e-10)
+    voiced = db > db.max() + threshold_db
+    if not voiced.any():
+        return []
+
+    # frame indices where voiced runs start and end
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * frame
+    ends = np.flatnonzero(edges == -1) * frame
+
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start - regions[-1][1] < min_silence:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    duration = audio.shape[-1] / sample_rate
+    padded = []
+    for start, end in regions:
+        if end - start < min_speech:
+            continue
+        start, end = max(start - pad, 0.0), min(end + pad, duration)
+        if padded and start <= padded[-1][1]:
+            padded[-1] = (padded[-1][0], end)
+        else:
+            padded.append((float(start), float(end)))
+    return padded
+
+
+class SpeechTimeline:
+    """
+    Voiced regions of an audio track laid out back to back, separated by gap
+    seconds of silence, and the mapping of times in the compacted audio back
+    to the original track.
+    """
+
+    def __init__(self, regions: List[Tuple[float, float]], duration: float, gap: float = 0.5):
+        self.regions = regions
+        self.duration = duration
+        self.gap = gap
+        self.compact_starts = []
+        position = 0.0
+        for start, end in regions:
+            self.compact_starts.append(position)
+            position += end - start + gap
+
+    @property
+    def speech_seconds(self) -> float:
+        return sum(end - start for start, end in self.regions)
+
+    @property
+    def skipped_fraction(self) -> float:
+        if not self.duration:
+            return 0.0
+        return max(0.0, 1 - self.speech_seconds / self.duration)
+
+    def compact(self, audio: np.ndarray, sample_rate: int) -> np.ndarray:
+        gap = np.zeros(int(self.gap * sample_rate), dtype=np.float32)
+        parts = []
+        for start, end in self.regions:
+            parts.append(audio[int(start * sample_rate):int(end * sample_rate)])
+            parts.append(gap)
+        if not parts:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(parts).astype(np.float32, copy=False)
+
+    def to_original(self, t: float) -> float:
+        if not self.regions:
+            return t
+        i = max(int(np.searchsorted(self.compact_starts, t, side='right')) - 1, 0)
+        start, end = self.regions[i]
+        # times falling in the inserted gaps stick to the end of the region
+        return round(start + min(max(t - self.compact_starts[i], 0.0), end - start), 3)
+
+    def remap_segments(self, segments: list) -> list:
+        for segment in segments:
+            for item in [segment, *segment.get("words", [])]:
+                for k in ("start", "end"):
+                    if item.get(k) is not None:
+                        item[k] = self.to_original(item[k])
+        return segments